@@ -0,0 +1,117 @@
+"""
+m.pyに処理能力を超える負荷(書き込み多め)を開ループで掛け、入場制御の有無で比較する
+
+- write: POST /users/{id}/items/bulk (--bulk件)
+- read: GET /users/{id}
+- 完了を待たずに--rate件/秒で--seconds秒間投げ続ける
+- offはpoolのタイムアウト(30秒)待ちが重なるので数分かかる
+
+    python -m benchmarks.admission --rate 400 --seconds 2 --bulk 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import httpx
+
+import m
+from benchmarks.compression import seed
+from common.admission import admission_options
+from sql_app import database, models
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def configure(enabled: bool):
+    """m.admissionの上限を書き換える。無効の時は何でも即通す"""
+    controller = m.admission
+    options = admission_options() if enabled else {}
+    unlimited = 10 ** 9
+    controller.capacity = options.get("capacity", unlimited)
+    controller.lanes["read"].limit = options.get("capacity", unlimited)
+    controller.lanes["read"].max_queue = options.get("read_queue", unlimited)
+    controller.lanes["write"].limit = options.get("write_limit", unlimited)
+    controller.lanes["write"].max_queue = options.get("write_queue", unlimited)
+    controller.queue_timeout = options.get("queue_timeout", unlimited)
+
+
+async def run(rate: float, seconds: float, write_share: float, bulk: int, users: int):
+    rng = random.Random(0)
+    results = {"read": [], "write": []}
+    body = [{"title": f"item {i}"} for i in range(bulk)]
+    limits = httpx.Limits(max_connections=None)
+    async with httpx.AsyncClient(app=m.app, base_url="http://test", limits=limits) as client:
+
+        async def one(kind):
+            user_id = rng.randrange(users) + 1
+            start = time.perf_counter()
+            try:
+                if kind == "write":
+                    response = await client.post(f"/users/{user_id}/items/bulk", json=body)
+                else:
+                    response = await client.get(f"/users/{user_id}")
+                status = response.status_code
+            except Exception:
+                # poolのTimeoutError等。ASGITransportは500にせずそのまま投げる
+                status = 500
+            results[kind].append((status, time.perf_counter() - start))
+
+        tasks = []
+        start = time.perf_counter()
+        for i in range(int(rate * seconds)):
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            kind = "write" if rng.random() < write_share else "read"
+            tasks.append(asyncio.create_task(one(kind)))
+        await asyncio.gather(*tasks)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=400)
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--write-share", type=float, default=0.3)
+    parser.add_argument("--bulk", type=int, default=20)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--modes", nargs="+", choices=["off", "on"], default=["off", "on"])
+    args = parser.parse_args()
+
+    if m.admission is None:
+        parser.error("ADMISSION_CONTROL=false disables the middleware")
+    # 書き込みが1本に絞られるSQLITE_MODE=walで、m.pyのengineをそのまま使う
+    os.environ["SQLITE_MODE"] = "wal"
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    database.dispose_engines()
+    engine = database.get_engine()
+    seed(engine, users=args.users, items_per_user=5)
+    with engine.begin() as conn:
+        models.init_db(conn)
+
+    for mode in args.modes:
+        enabled = mode == "on"
+        configure(enabled)
+        results = asyncio.run(
+            run(args.rate, args.seconds, args.write_share, args.bulk, args.users)
+        )
+        for kind, responses in results.items():
+            ok = [elapsed for status, elapsed in responses if status == 200]
+            shed = sum(status == 503 for status, _ in responses)
+            errors = sum(status == 500 for status, _ in responses)
+            print(
+                f"admission {mode:>3} {kind:>5}: "
+                f"{len(ok):6d} ok {shed:6d} shed {errors:6d} errors  "
+                f"p50 {percentile(ok, 0.5) * 1000:8.1f}ms "
+                f"p99 {percentile(ok, 0.99) * 1000:8.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+同一プロセス・同一イベントループで m.py(同期) と m_async.py(非同期) を比較
+
+    python -m benchmarks.async_concurrency --requests 2000 --concurrency 200
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import m
+import m_async
+from benchmarks.pagination import seed
+
+
+def use_database(db_path: str):
+    engine = create_engine(
+        f"sqlite:///{db_path}", connect_args={"check_same_thread": False}
+    )
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    AsyncSessionLocal = sessionmaker(
+        async_engine, class_=AsyncSession, expire_on_commit=False
+    )
+
+    async def get_async_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    m.app.dependency_overrides[m.get_db] = get_db
+    m.app.dependency_overrides[m.get_read_db] = get_db
+    m_async.app.dependency_overrides[m_async.get_db] = get_async_db
+    return engine
+
+
+async def run(app, requests: int, concurrency: int, users: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+
+        async def one(i):
+            async with semaphore:
+                response = await client.get(f"/users/{i % users + 1}")
+                assert response.status_code == 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    seed(use_database(db_path), args.users)
+
+    for name, app in (("sync", m.app), ("async", m_async.app)):
+        rps = asyncio.run(run(app, args.requests, args.concurrency, args.users))
+        print(f"{name:>5}: {rps:8.1f} req/s (concurrency {args.concurrency})")
+
+
+if __name__ == "__main__":
+    main()
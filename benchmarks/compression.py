@@ -0,0 +1,102 @@
+"""
+実際のレスポンス(m.pyの/users/, /items/, /export/users)を圧縮レベル毎に比較する
+
+    python -m benchmarks.compression --users 100 --items-per-user 5
+"""
+import argparse
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import m
+from common.compression import _BrotliCompressor, _GzipCompressor, brotli
+from sql_app import models
+from sql_app.database import Base
+
+
+def seed(engine, users: int, items_per_user: int):
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(
+            models.User.__table__.insert(),
+            [
+                {"email": f"user{i}@example.com", "hashed_password": "x"}
+                for i in range(users)
+            ],
+        )
+        conn.execute(
+            models.Item.__table__.insert(),
+            [
+                {
+                    "title": f"Item {j} of user {i}",
+                    "description": "A very nice Item",
+                    "owner_id": i + 1,
+                }
+                for i in range(users)
+                for j in range(items_per_user)
+            ],
+        )
+
+
+def payloads(users: int, items_per_user: int):
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    seed(engine, users, items_per_user)
+    SessionLocal = sessionmaker(bind=engine)
+
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    m.app.dependency_overrides[m.get_db] = get_db
+    m.app.dependency_overrides[m.get_read_db] = get_db
+    client = TestClient(m.app)
+    headers = {"Accept-Encoding": "identity"}
+    return {
+        "GET /users/": client.get("/users/", headers=headers).content,
+        "GET /items/?limit=100": client.get(
+            "/items/?limit=100", headers=headers
+        ).content,
+        "GET /export/users": client.get("/export/users", headers=headers).content,
+    }
+
+
+def compressors():
+    for level in (1, 6, 9):
+        yield f"gzip-{level}", lambda level=level: _GzipCompressor(level)
+    if brotli is not None:
+        for quality in (4, 11):
+            yield f"br-{quality}", lambda quality=quality: _BrotliCompressor(quality)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--items-per-user", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    for name, body in payloads(args.users, args.items_per_user).items():
+        print(f"{name} ({len(body)} bytes)")
+        for label, factory in compressors():
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                compressor = factory()
+                compressed = compressor.compress(body) + compressor.finish()
+            elapsed = (time.perf_counter() - start) / args.repeat * 1e6
+            saved = 1 - len(compressed) / len(body)
+            print(
+                f"  {label:>7}: {len(compressed):8d} bytes "
+                f"({saved:6.1%} saved) {elapsed:9.1f} us"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+標準のレスポンス処理と use_fast_json の比較
+
+    python -m benchmarks.fast_json --items 1000 --requests 200
+"""
+import argparse
+import asyncio
+import time
+from typing import List, Union
+
+import httpx
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+from common.responses import use_fast_json
+
+
+class Item(BaseModel):
+    name: str
+    description: Union[str, None] = None
+    price: float
+    tax: Union[float, None] = None
+    tags: List[str] = []
+
+
+def build_app(fast: bool, items: List[Item]):
+    app = FastAPI()
+    use_fast_json(app, enabled=fast)
+
+    @app.get("/items", response_model=List[Item])
+    async def read_items():
+        return items
+
+    return app
+
+
+async def run(app, requests: int):
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        await client.get("/items")
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = await client.get("/items")
+            assert response.status_code == 200
+        return (time.perf_counter() - start) / requests * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    items = [
+        Item(
+            name=f"Foo{i}",
+            description="A very nice Item",
+            price=35.4,
+            tax=3.2,
+            tags=["a", "b"],
+        )
+        for i in range(args.items)
+    ]
+    for name, fast in (("default", False), ("fast_json", True)):
+        ms = asyncio.run(run(build_app(fast, items), args.requests))
+        print(f"{name:>9}: {ms:7.2f} ms/request ({args.items} items)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+1行毎にopen/append/closeする書き込みと BatchedLogWriter の比較
+
+    python -m benchmarks.log_writer --lines 100000 --threads 8
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.logwriter import BatchedLogWriter
+
+
+def open_per_line(path):
+    def write(line):
+        with open(path, mode="a+") as f:
+            f.write(line)
+
+    return write, lambda: None
+
+
+def batched(path):
+    writer = BatchedLogWriter(path, max_bytes=0)
+    return writer.write, writer.stop
+
+
+def run(factory, lines: int, threads: int):
+    path = os.path.join(tempfile.mkdtemp(), "log.txt")
+    write, close = factory(path)
+    start = time.perf_counter()
+    # BackgroundTasksと同様にスレッドプールから書き込む
+    with ThreadPoolExecutor(threads) as pool:
+        for i in range(lines):
+            pool.submit(write, f"notification for user{i}@example.com: message\n")
+    close()
+    elapsed = time.perf_counter() - start
+    with open(path) as f:
+        assert sum(1 for _ in f) == lines
+    return lines / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+    for name, factory in (("open_per_line", open_per_line), ("batched", batched)):
+        rate = run(factory, args.lines, args.threads)
+        print(f"{name:>13}: {rate:10.0f} lines/s")
+
+
+if __name__ == "__main__":
+    main()
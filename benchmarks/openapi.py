@@ -0,0 +1,57 @@
+"""
+main.pyの/api/v1/openapi.jsonを、FastAPI標準のルート(毎回JSONResponseでエンコード)と
+serve_cached_openapiのキャッシュ済みバイト列で比較する
+
+    python -m benchmarks.openapi --requests 500
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from common.compression import brotli
+import main as main_app
+
+URL = main_app.app.openapi_url
+
+
+def use_default_route(enabled: bool):
+    """FastAPI.setup()が登録するのと同じルートに差し替える"""
+    routes = main_app.app.router.routes
+    index = next(i for i, route in enumerate(routes) if getattr(route, "path", None) == URL)
+    if enabled:
+        routes[index] = Route(URL, lambda request: JSONResponse(main_app.app.openapi()))
+    else:
+        routes[index] = Route(URL, main_app.openapi_cache.endpoint, include_in_schema=False)
+
+
+async def run(requests: int, headers: dict):
+    async with httpx.AsyncClient(app=main_app.app, base_url="http://test") as client:
+        await client.get(URL, headers=headers)
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = await client.get(URL, headers=headers)
+            assert response.status_code == 200
+        return requests / (time.perf_counter() - start), int(response.headers["content-length"])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    encodings = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+    for label in encodings:
+        headers = {"Accept-Encoding": label}
+        for name, default in (("default", True), ("cached", False)):
+            use_default_route(default)
+            rate, size = asyncio.run(run(args.requests, headers))
+            print(f"{label:>8} {name:>8}: {rate:8.0f} req/s ({size} bytes on the wire)")
+    use_default_route(False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+offset/limit と keyset(cursor) の比較
+
+    python -m benchmarks.pagination --rows 1000000 --limit 100
+"""
+import argparse
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sql_app import crud, models
+from sql_app.database import Base
+
+
+def seed(engine, rows: int):
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(
+            models.User.__table__.insert(),
+            [
+                {"email": f"user{i}@example.com", "hashed_password": "x", "is_active": True}
+                for i in range(rows)
+            ],
+        )
+
+
+def timeit(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    seed(engine, args.rows)
+    db = sessionmaker(bind=engine)()
+
+    last_page = args.rows // args.limit
+    for page in (1, last_page):
+        skip = (page - 1) * args.limit
+        offset_ms = timeit(
+            lambda: crud.get_users(db, skip=skip, limit=args.limit), args.repeat
+        )
+        # keyset は直前ページの最後の id から seek する(id は 1 始まりの連番)
+        keyset_ms = timeit(
+            lambda: crud.get_users(db, limit=args.limit, after_id=skip), args.repeat
+        )
+        print(f"page {page:>6}: offset {offset_ms:8.2f} ms  keyset {keyset_ms:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
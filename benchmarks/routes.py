@@ -0,0 +1,415 @@
+"""
+main.py, m.py, main_b.pyの全ルートをASGI経由でインプロセスに叩き、
+スループットとp50/p99レイテンシをJSONのベースラインと比較する
+
+    # ベースラインを作る(更新する)
+    python -m benchmarks.routes --update
+    # ベースラインとの比較。閾値を超えて遅くなったルートがあれば
+    # (ベースラインが無い時も)終了コード1
+    python -m benchmarks.routes --threshold 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import m
+import main as main_app
+import main_b
+from benchmarks.compression import seed
+from common.logwriter import BatchedLogWriter
+from common.passwords import password_hasher
+from common.store import StripedStore
+from sql_app import crud, models
+
+# PUT /items/{item_id2}はPUT /items/{item_id}に隠れてリクエストが届かない
+UNREACHABLE = {("main", "PUT", "/items/{item_id2}")}
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+APPS = {"main": main_app.app, "m": m.app, "main_b": main_b.app}
+USERS = 100
+LOGIN = {"email": "user0@example.com", "password": "secret"}
+ITEMS_PER_USER = 5
+
+ITEM = main_app.Item.Config.schema_extra["example"]
+TOKEN = {"X-Token": main_b.fake_secret_token}
+
+
+@dataclass
+class Case:
+    app: str
+    method: str
+    path: str
+    # i番目のリクエストの(url, httpx.requestのキーワード引数)を返す
+    request: Callable[[int], tuple] = None
+    status: int = 200
+    name: str = field(default="")
+
+    def __post_init__(self):
+        self.name = self.name or f"{self.app} {self.method} {self.path}"
+        if self.request is None:
+            self.request = lambda i, path=self.path: (path, {})
+
+
+def simple(path: str, **kwargs):
+    return lambda i: (path, kwargs)
+
+
+CASES = [
+    # main.py
+    Case("main", "GET", "/api/v1/openapi.json"),
+    Case("main", "GET", "/docs"),
+    Case("main", "GET", "/docs/oauth2-redirect"),
+    Case("main", "GET", "/redoc"),
+    Case("main", "GET", "/metrics"),
+    Case("main", "GET", "/"),
+    Case(
+        "main",
+        "GET",
+        "/items/",
+        simple(
+            "/items/",
+            params={"q": ["foo", "bar"], "r": "query"},
+            cookies={"ads_id": "ad"},
+        ),
+    ),
+    Case("main", "POST", "/items/", simple("/items/", json=ITEM), status=201),
+    Case("main", "GET", "/items/{item_id}", lambda i: (f"/items/{i % 100 + 4}", {})),
+    Case("main", "GET", "/items2/{item_id}", simple("/items2/bar")),
+    Case("main", "GET", "/items/{item_id}/name", simple("/items/bar/name")),
+    Case("main", "GET", "/items/{item_id}/public", simple("/items/bar/public")),
+    Case("main", "PUT", "/items/{item_id}", lambda i: (f"/items/{i}", {"json": ITEM})),
+    Case("main", "GET", "/models/{model_name}", simple("/models/resnet")),
+    Case(
+        "main",
+        "POST",
+        "/user/",
+        simple(
+            "/user/",
+            json={
+                "username": "Test",
+                "email": "test@example.com",
+                "full_name": "testname",
+                "password": "secret",
+            },
+        ),
+    ),
+    Case("main", "GET", "/items3/{item_id}", simple("/items3/item1")),
+    Case("main", "GET", "/items2/"),
+    Case(
+        "main",
+        "POST",
+        "/login/",
+        simple("/login/", data={"username": "Test", "password": "secret"}),
+    ),
+    Case(
+        "main",
+        "POST",
+        "/files/",
+        simple("/files/", files={"file": ("a.bin", b"x" * 64 * 1024)}),
+    ),
+    Case("main", "POST", "/files/stream", simple("/files/stream", content=b"x" * 1024 ** 2)),
+    Case(
+        "main",
+        "POST",
+        "/uploadfile/",
+        simple("/uploadfile/", files={"file": ("a.bin", b"x" * 64 * 1024)}),
+    ),
+    Case("main", "GET", "/unicorns/{name}", simple("/unicorns/rainbow")),
+    Case(
+        "main",
+        "POST",
+        "/send-notification/{email}",
+        simple("/send-notification/user@example.com", params={"q": "query"}),
+    ),
+    # m.py
+    Case("m", "GET", "/openapi.json"),
+    Case("m", "GET", "/docs"),
+    Case("m", "GET", "/docs/oauth2-redirect"),
+    Case("m", "GET", "/redoc"),
+    Case("m", "GET", "/metrics"),
+    Case(
+        "m",
+        "POST",
+        "/users/",
+        lambda i: ("/users/", {"json": {"email": f"bench{i}@example.com", "password": "x"}}),
+    ),
+    Case("m", "POST", "/login/", simple("/login/", json=LOGIN)),
+    Case(
+        "m",
+        "POST",
+        "/users/import",
+        lambda i: (
+            "/users/import",
+            {
+                "files": {
+                    "file": (
+                        "users.csv",
+                        "email\n" + "".join(f"import{i}-{j}@example.com\n" for j in range(100)),
+                    )
+                }
+            },
+        ),
+    ),
+    Case("m", "GET", "/users/", simple("/users/", params={"limit": 100})),
+    Case("m", "GET", "/users/summary/", simple("/users/summary/", params={"limit": 100})),
+    Case("m", "GET", "/users/{user_id}", lambda i: (f"/users/{i % USERS + 1}", {})),
+    Case(
+        "m",
+        "POST",
+        "/users/{user_id}/items/",
+        lambda i: (f"/users/{i % USERS + 1}/items/", {"json": {"title": f"Item {i}"}}),
+    ),
+    Case(
+        "m",
+        "POST",
+        "/users/{user_id}/items/bulk",
+        lambda i: (
+            f"/users/{i % USERS + 1}/items/bulk",
+            {"json": [{"title": f"Item {i}-{j}"} for j in range(50)]},
+        ),
+    ),
+    Case("m", "GET", "/items/", simple("/items/", params={"limit": 100})),
+    Case("m", "GET", "/items/search", simple("/items/search", params={"q": "user 1"})),
+    Case("m", "GET", "/export/users"),
+    Case("m", "GET", "/export/items", simple("/export/items", params={"format": "csv"})),
+    Case("m", "GET", "/stats/pool"),
+    Case("m", "GET", "/stats/cache"),
+    # main_b.py
+    Case("main_b", "GET", "/openapi.json"),
+    Case("main_b", "GET", "/docs"),
+    Case("main_b", "GET", "/docs/oauth2-redirect"),
+    Case("main_b", "GET", "/redoc"),
+    Case("main_b", "GET", "/metrics"),
+    Case(
+        "main_b",
+        "GET",
+        "/items",
+        simple("/items", params={"ids": "foo,bar,missing"}, headers=TOKEN),
+    ),
+    Case("main_b", "GET", "/items/{item_id}", simple("/items/foo", headers=TOKEN)),
+    Case(
+        "main_b",
+        "POST",
+        "/items/",
+        lambda i: (
+            "/items/",
+            {
+                "headers": TOKEN,
+                "json": {"id": f"bench{i}", "title": "Bench", "description": "An item"},
+            },
+        ),
+    ),
+    Case(
+        "main_b",
+        "POST",
+        "/batch",
+        simple(
+            "/batch",
+            headers=TOKEN,
+            json={"requests": [{"path": f"/items/{key}"} for key in ("foo", "bar") * 10]},
+        ),
+    ),
+]
+
+
+def check_coverage(cases: List[Case]):
+    """ルートを追加した時にケースの書き忘れがあれば落とす"""
+    covered = {(case.app, case.method, case.path) for case in cases} | UNREACHABLE
+    missing = [
+        f"{name} {method} {route.path}"
+        for name, app in APPS.items()
+        for route in app.routes
+        for method in sorted(getattr(route, "methods", ()) or ())
+        if method != "HEAD" and (name, method, route.path) not in covered
+    ]
+    if missing:
+        raise SystemExit("benchmark cases missing for: " + ", ".join(missing))
+
+
+@contextmanager
+def isolated_state():
+    """DB・アップロード先・ログ・item_storeをベンチマーク用に差し替える"""
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    seed(engine, USERS, ITEMS_PER_USER)
+    # POST /login/用に1人だけ本物のハッシュを持たせる
+    with engine.begin() as conn:
+        conn.execute(
+            models.User.__table__.update()
+            .where(models.User.email == LOGIN["email"])
+            .values(hashed_password=password_hasher.hash(LOGIN["password"]))
+        )
+    SessionLocal = sessionmaker(bind=engine)
+
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    saved = (
+        main_app.UPLOAD_SPOOL_DIR,
+        main_app.notification_log,
+        main_b.item_store,
+        dict(m.app.dependency_overrides),
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        m.app.dependency_overrides[m.get_db] = get_db
+        m.app.dependency_overrides[m.get_read_db] = get_db
+        main_app.UPLOAD_SPOOL_DIR = directory
+        main_app.notification_log = BatchedLogWriter(os.path.join(directory, "log.txt"))
+        main_b.item_store = StripedStore()
+        main_b.item_store.update(saved[2].to_dict())
+        crud.user_cache.clear()
+        crud.user_email_cache.clear()
+        try:
+            yield
+        finally:
+            main_app.notification_log.stop()
+            (
+                main_app.UPLOAD_SPOOL_DIR,
+                main_app.notification_log,
+                main_b.item_store,
+                overrides,
+            ) = saved
+            m.app.dependency_overrides.clear()
+            m.app.dependency_overrides.update(overrides)
+            crud.user_cache.clear()
+            crud.user_email_cache.clear()
+            engine.dispose()
+
+
+def percentile(values: List[float], q: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_case(
+    client: httpx.AsyncClient, case: Case, iterations: int, warmup: int, concurrency: int
+):
+    counter = iter(range(warmup + iterations))
+    latencies = []
+
+    async def worker():
+        for i in counter:
+            url, kwargs = case.request(i)
+            start = time.perf_counter()
+            response = await client.request(case.method, url, **kwargs)
+            elapsed = time.perf_counter() - start
+            if response.status_code != case.status:
+                raise RuntimeError(
+                    f"{case.name}: expected {case.status}, got {response.status_code}"
+                )
+            latencies.append(elapsed)
+
+    for _ in range(warmup):
+        url, kwargs = case.request(next(counter))
+        await client.request(case.method, url, **kwargs)
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+    }
+
+
+async def run(cases: List[Case], iterations: int = 200, warmup: int = 20, concurrency: int = 1):
+    results = {}
+    clients = {
+        name: httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://bench"
+        )
+        for name, app in APPS.items()
+    }
+    try:
+        for case in cases:
+            results[case.name] = await run_case(
+                clients[case.app], case, iterations, warmup, concurrency
+            )
+    finally:
+        for client in clients.values():
+            await client.aclose()
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float):
+    """p99・スループットがthreshold以上悪化したルートを返す"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["p99_ms"] > base["p99_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p99 {base['p99_ms']:.2f}ms -> {result['p99_ms']:.2f}ms")
+        if result["throughput"] < base["throughput"] / (1 + threshold):
+            regressions.append(
+                f"{name}: throughput {base['throughput']:.0f}/s -> {result['throughput']:.0f}/s"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=float(os.getenv("BENCH_REGRESSION_THRESHOLD", "0.25")),
+    )
+    parser.add_argument("--update", action="store_true", help="write results as the new baseline")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    args = parser.parse_args()
+
+    check_coverage(CASES)
+    cases = [case for case in CASES if args.filter in case.name]
+    # main.pyの/user/はprintするので、結果の表示と混ざらないよう捨てる
+    with isolated_state(), open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        results = asyncio.run(run(cases, args.iterations, args.warmup, args.concurrency))
+
+    for name, result in results.items():
+        print(
+            f"{name:<45} {result['throughput']:8.0f} req/s "
+            f"p50 {result['p50_ms']:7.2f}ms p99 {result['p99_ms']:7.2f}ms"
+        )
+
+    if args.update:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"baseline written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        # ここで成功扱いにすると、CIのゲートが何も検出できない
+        sys.exit(f"no baseline at {args.baseline}; run with --update first")
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.threshold)
+    if regressions:
+        print(f"regressions over {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"no regressions over {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+GET /items/searchのFTS5検索と、title/descriptionへの LIKE '%q%' を比較する
+
+    python -m benchmarks.search --items 200000 --repeat 20
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, or_, select
+from sqlalchemy.orm import Session
+
+from sql_app import crud, models
+from sql_app.database import Base
+
+# 語の出現頻度はZipf分布にする(先頭の語ほど多くのitemに出てくる)
+WORDS = (
+    "red blue green lamp desk chair kettle bicycle pump cotton linen steel oak "
+    "walnut glass ceramic brass copper vintage modern compact portable heavy light"
+).split() + [f"term{i}" for i in range(5000)]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(WORDS))]
+
+
+def seed(engine, items: int, seed_value: int = 0):
+    rng = random.Random(seed_value)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(
+            models.User.__table__.insert(),
+            [{"email": "owner@example.com", "hashed_password": "x"}],
+        )
+        for start in range(0, items, 10000):
+            conn.execute(
+                models.Item.__table__.insert(),
+                [
+                    {
+                        "title": " ".join(rng.choices(WORDS, WEIGHTS, k=3)),
+                        "description": " ".join(rng.choices(WORDS, WEIGHTS, k=20)),
+                        "owner_id": 1,
+                    }
+                    for _ in range(min(10000, items - start))
+                ],
+            )
+
+
+def like(db: Session, q: str, limit: int):
+    pattern = f"%{q}%"
+    query = (
+        select(models.Item)
+        .where(or_(models.Item.title.like(pattern), models.Item.description.like(pattern)))
+        .order_by(models.Item.id)
+        .limit(limit)
+    )
+    return db.execute(query).all()
+
+
+def timed(function, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        rows = function()
+    return (time.perf_counter() - start) / repeat * 1000, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'search.db')}")
+    start = time.perf_counter()
+    seed(engine, args.items)
+    print(f"seeded {args.items} items in {time.perf_counter() - start:.1f}s")
+
+    # 一致が多い語から、どこにもない語まで
+    queries = ["red", "walnut", "term200", "term4000", "zeppelin"]
+    with Session(engine) as db:
+        for q in queries:
+            fts_ms, fts_rows = timed(lambda: crud.search_items(db, q, args.limit), args.repeat)
+            like_ms, like_rows = timed(lambda: like(db, q, args.limit), args.repeat)
+            print(
+                f"{q!r:>16}: fts5 {fts_ms:8.2f}ms ({fts_rows} rows)  "
+                f"like {like_ms:8.2f}ms ({like_rows} rows)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+m.pyのPOST /users/のスループットと、その間のイベントループの遅れをKDFの実行場所毎に比較する
+
+- loop: イベントループの中でそのまま計算する(async defから素朴に呼んだ場合)
+- thread: デフォルトのスレッドプール(PASSWORD_HASH_WORKERS=0)
+- process: プロセスプール
+
+コストはPASSWORD_SCRYPT_N等の環境変数で変えられる
+
+    python -m benchmarks.signup --signups 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+import m
+from common.passwords import PasswordHasher, hasher_options
+from sql_app import database, models
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+class InlineHasher(PasswordHasher):
+    async def hash_async(self, password: str) -> str:
+        return self.hash(password)
+
+
+async def probe(stop: asyncio.Event, lags: list, interval: float = 0.005):
+    """interval毎に起きるタスクが、予定からどれだけ遅れて起きたか"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(mode: str, signups: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    lags = []
+    stop = asyncio.Event()
+    async with httpx.AsyncClient(app=m.app, base_url="http://test") as client:
+
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/users/", json={"email": f"{mode}{i}@example.com", "password": "secret"}
+                )
+                assert response.status_code == 200, response.text
+                latencies.append(time.perf_counter() - start)
+
+        # プロセスの起動はベンチマークに含めない
+        await m.password_hasher.hash_async("warmup")
+        probe_task = asyncio.create_task(probe(stop, lags))
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(signups)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe_task
+    return signups / elapsed, latencies, lags
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--signups", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--modes", nargs="+", choices=["loop", "thread", "process"],
+                        default=["loop", "thread", "process"])
+    args = parser.parse_args()
+
+    os.environ["SQLITE_MODE"] = "wal"
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    database.dispose_engines()
+    with database.get_engine().begin() as conn:
+        models.Base.metadata.create_all(bind=conn)
+        models.init_db(conn)
+
+    options = hasher_options()
+    print(f"{options['algorithm']} cpus={os.cpu_count()} workers={PasswordHasher(**options).workers}")
+    for mode in args.modes:
+        if mode == "loop":
+            hasher = InlineHasher(**options)
+        elif mode == "thread":
+            hasher = PasswordHasher(**{**options, "workers": 0})
+        else:
+            hasher = PasswordHasher(**options)
+        m.password_hasher = hasher
+        try:
+            rps, latencies, lags = asyncio.run(run(mode, args.signups, args.concurrency))
+        finally:
+            hasher.shutdown()
+        print(
+            f"{mode:>7}: {rps:7.1f} signups/s  "
+            f"p50 {percentile(latencies, 0.5) * 1000:7.1f}ms "
+            f"p99 {percentile(latencies, 0.99) * 1000:7.1f}ms  "
+            f"loop lag p99 {percentile(lags, 0.99) * 1000:6.1f}ms "
+            f"max {max(lags, default=0) * 1000:6.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
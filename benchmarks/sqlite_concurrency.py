@@ -0,0 +1,100 @@
+"""
+ファイルのSQLiteで読み取りと書き込みを同時に流し、SQLITE_MODE=default と wal を比較する
+
+- reader: crud.get_user(m.pyのGET /users/{user_id}と同じ読み方) を get_read_engine() のセッションで繰り返す
+- writer: crud.create_user_item を get_engine() のセッションで繰り返す
+
+    python -m benchmarks.sqlite_concurrency --readers 8 --writers 4 --seconds 5
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.compression import seed
+from sql_app import crud, database, models, schemas
+
+
+def worker(stop: threading.Event, operation, latencies: list, errors: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            operation()
+        except Exception as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def read_user(counter=iter(range(10 ** 9))):
+    db = database.SessionLocal(bind=database.get_read_engine())
+    try:
+        crud.get_user(db, user_id=next(counter) % 100 + 1)
+    finally:
+        db.close()
+
+
+def write_item(counter=iter(range(10 ** 9))):
+    db = database.SessionLocal(bind=database.get_engine())
+    try:
+        i = next(counter)
+        crud.create_user_item(db, schemas.ItemCreate(title=f"Item {i}"), user_id=i % 100 + 1)
+    finally:
+        db.close()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def run(mode: str, readers: int, writers: int, seconds: float):
+    os.environ["SQLITE_MODE"] = mode
+    directory = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    database.dispose_engines()
+    engine = database.get_engine()
+    seed(engine, users=100, items_per_user=5)
+    with engine.begin() as conn:
+        models.init_db(conn)
+
+    stop = threading.Event()
+    results = {"read": ([], []), "write": ([], [])}
+    threads = [
+        threading.Thread(target=worker, args=(stop, read_user, *results["read"]))
+        for _ in range(readers)
+    ] + [
+        threading.Thread(target=worker, args=(stop, write_item, *results["write"]))
+        for _ in range(writers)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    database.dispose_engines()
+
+    for kind, (latencies, errors) in results.items():
+        print(
+            f"{mode:>7} {kind:>5}: {len(latencies) / seconds:8.1f} ops/s "
+            f"p50 {percentile(latencies, 0.5) * 1000:7.2f}ms "
+            f"p99 {percentile(latencies, 0.99) * 1000:7.2f}ms "
+            f"errors {len(errors)}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    for mode in ("default", "wal"):
+        run(mode, args.readers, args.writers, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+アプリ毎の起動時間レポート。新しいプロセスで計測するので、キャッシュ済みのimportに影響されない
+
+- import time: `python -X importtime` の結果をパッケージ毎・モジュール毎(self時間)に集計
+- first request: import → startupイベント → 最初のリクエストまでの時間
+  (TestClient自体のimportは含めない)
+
+    python -m benchmarks.startup --top 10
+    python -m benchmarks.startup --apps m --json startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+FIRST_REQUEST = {
+    "main": "/",
+    "m": "/users/?limit=1",
+    "m_async": "/users/?limit=1",
+    "main_b": "/openapi.json",
+}
+
+FIRST_REQUEST_SCRIPT = """
+import json, sys, time
+from fastapi.testclient import TestClient
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+with TestClient({module}.app) as client:
+    started = time.perf_counter()
+    status = client.get({path!r}).status_code
+    first_request = time.perf_counter()
+print(json.dumps({{
+    "import": imported - start,
+    "startup": started - imported,
+    "first_request": first_request - started,
+    "total": first_request - start,
+    "status": status,
+}}))
+"""
+
+
+def run_python(args, env):
+    return subprocess.run(
+        [sys.executable, *args],
+        env={**os.environ, **env},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def import_times(module: str, env: dict):
+    """-X importtimeの出力を{モジュール名: (self秒, cumulative秒)}にする"""
+    stderr = run_python(["-X", "importtime", "-c", f"import {module}"], env).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return times
+
+
+def by_package(times: dict):
+    packages = defaultdict(float)
+    for name, (self_time, _) in times.items():
+        packages[name.split(".")[0]] += self_time
+    return dict(sorted(packages.items(), key=lambda item: -item[1]))
+
+
+def report(module: str, env: dict, top: int):
+    times = import_times(module, env)
+    first = json.loads(
+        run_python(
+            ["-c", FIRST_REQUEST_SCRIPT.format(module=module, path=FIRST_REQUEST[module])],
+            env,
+        ).stdout
+    )
+    modules = sorted(times.items(), key=lambda item: -item[1][0])[:top]
+    return {
+        "import_total": times[module][1],
+        "packages": dict(list(by_package(times).items())[:top]),
+        "modules": {name: self_time for name, (self_time, _) in modules},
+        "first_request": first,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--apps", nargs="+", default=list(FIRST_REQUEST))
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        # リポジトリのsql_app.dbを書き換えないよう一時DBを使う
+        db_path = os.path.join(directory, "startup.db")
+        env = {
+            "DATABASE_URL": f"sqlite:///{db_path}",
+            "ASYNC_DATABASE_URL": f"sqlite+aiosqlite:///{db_path}",
+            "NOTIFICATION_LOG_PATH": os.path.join(directory, "log.txt"),
+        }
+        for module in args.apps:
+            results[module] = result = report(module, env, args.top)
+            first = result["first_request"]
+            print(
+                f"{module}: cold import {result['import_total'] * 1000:.1f}ms, "
+                f"app import {first['import'] * 1000:.1f}ms, "
+                f"startup {first['startup'] * 1000:.1f}ms, "
+                f"first request {first['first_request'] * 1000:.1f}ms "
+                f"(total {first['total'] * 1000:.1f}ms, status {first['status']})"
+            )
+            print("  packages (self time):")
+            for name, seconds in result["packages"].items():
+                print(f"    {name:<30} {seconds * 1000:7.1f}ms")
+            print("  modules (self time):")
+            for name, seconds in result["modules"].items():
+                print(f"    {name:<30} {seconds * 1000:7.1f}ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+ユーザーの一括登録を、POST /users/と同じ1件ずつの経路とPOST /users/importの経路で比較する
+(KDFの時間は除き、DBの経路だけを比べる)
+
+- signup: get_user_by_email + create_user (1件毎にSELECT・INSERT・commit・refresh)
+- import: NDJSONファイルをimport_usersで読み、バッチ毎にINSERT ... ON CONFLICTしてcommit
+
+    python -m benchmarks.user_import --users 100000
+"""
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sql_app import crud, schemas
+from sql_app.database import Base
+from sql_app.imports import ImportFormat, OnConflict, import_users
+
+
+def session(directory: str, name: str):
+    engine = create_engine(f"sqlite:///{os.path.join(directory, name)}")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+def signup(db, users: int):
+    for i in range(users):
+        user = schemas.UserCreate(email=f"user{i}@example.com", password="x")
+        if crud.get_user_by_email(db, email=user.email) is None:
+            crud.create_user(db, user, hashed_password="x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--signup-users", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    db = session(directory, "signup.db")
+    start = time.perf_counter()
+    signup(db, args.signup_users)
+    elapsed = time.perf_counter() - start
+    print(f" signup: {args.signup_users / elapsed:9.0f} users/s ({args.signup_users} users)")
+
+    path = os.path.join(directory, "users.ndjson")
+    with open(path, "w") as f:
+        for i in range(args.users):
+            f.write(json.dumps({"email": f"user{i}@example.com"}) + "\n")
+
+    for on_conflict in (OnConflict.ignore, OnConflict.update):
+        # 2回目は全件が既存ユーザーとの衝突になる
+        db = session(directory, f"import-{on_conflict.value}.db")
+        for run in ("new", "existing"):
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            start = time.perf_counter()
+            with open(path, "rb") as f:
+                report = import_users(
+                    db, f, ImportFormat.ndjson, on_conflict, batch_size=args.batch_size
+                )
+            elapsed = time.perf_counter() - start
+            growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - before
+            print(
+                f" import {on_conflict.value:>6} {run:>8}: {args.users / elapsed:9.0f} users/s "
+                f"inserted {report['inserted']} updated {report['updated']} "
+                f"skipped {report['skipped']} batches {report['batches']} "
+                f"max rss +{growth:.1f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+
+from fastapi import FastAPI
+from fastapi.dependencies.utils import is_gen_callable
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+class Lane:
+    """同時実行数の上限と待ち行列を持つ優先度レーン。lanesの先頭ほど優先して起こす"""
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiters = deque()
+        # 1リクエストの処理時間の指数移動平均。Retry-Afterの見積もりに使う
+        self.service_time = 0.05
+        self.stats = {"admitted": 0, "waited": 0, "shed": 0, "timeout": 0}
+
+    def retry_after(self) -> int:
+        backlog = len(self.waiters) + 1
+        return max(1, math.ceil(self.service_time * backlog / max(1, self.limit)))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # 最後に使った順。溢れたら一番長く使われていないバケツから捨てる
+        self._buckets = OrderedDict()
+
+    def take(self, key, now: float = None) -> float:
+        """取れれば0、取れなければトークンが溜まるまでの秒数を返す"""
+        now = time.monotonic() if now is None else now
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionController:
+    """
+    threadpoolで動く同期ルートの入場制御。
+    全体でcapacity件まで同時に通し、空きが出たらlanesの順(読み取りが先)に待ち行列から起こす。
+    待ち行列がmax_queueを超えたら待たせずに503、queue_timeout待っても入れなければ503を返す。
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        lanes,
+        queue_timeout: float = 5.0,
+        bucket: TokenBucket = None,
+    ):
+        self.capacity = capacity
+        self.lanes = {lane.name: lane for lane in lanes}
+        self.queue_timeout = queue_timeout
+        self.bucket = bucket
+        self.active = 0
+        self.throttled = 0
+
+    def lane_for(self, method: str) -> Lane:
+        return self.lanes["read" if method in READ_METHODS else "write"]
+
+    def _can_run(self, lane: Lane) -> bool:
+        return self.active < self.capacity and lane.active < lane.limit
+
+    def _grant(self, lane: Lane):
+        self.active += 1
+        lane.active += 1
+        lane.stats["admitted"] += 1
+
+    async def acquire(self, lane: Lane) -> bool:
+        if not lane.waiters and self._can_run(lane):
+            self._grant(lane)
+            return True
+        if len(lane.waiters) >= lane.max_queue:
+            lane.stats["shed"] += 1
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        lane.waiters.append(future)
+        lane.stats["waited"] += 1
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            lane.stats["timeout"] += 1
+            return False
+        except asyncio.CancelledError:
+            # releaseで枠を渡された直後にキャンセルされたら、その枠を返してから抜ける
+            if future.done() and not future.cancelled():
+                self.release(lane, 0)
+            raise
+        finally:
+            if future.cancelled():
+                try:
+                    lane.waiters.remove(future)
+                except ValueError:
+                    pass
+
+    def release(self, lane: Lane, elapsed: float):
+        self.active -= 1
+        lane.active -= 1
+        lane.service_time += (elapsed - lane.service_time) * 0.1
+        for waiting in self.lanes.values():
+            while waiting.waiters and self._can_run(waiting):
+                future = waiting.waiters.popleft()
+                if not future.done():
+                    self._grant(waiting)
+                    future.set_result(None)
+
+    def add_gauges(self, metrics):
+        """レーン毎の待ち行列の長さと実行中の数を/metricsに出す"""
+        for name, lane in self.lanes.items():
+            metrics.add_gauge(
+                f"admission_{name}_queued",
+                f"Requests waiting in the {name} lane.",
+                lambda lane=lane: len(lane.waiters),
+            )
+            metrics.add_gauge(
+                f"admission_{name}_active",
+                f"Requests admitted in the {name} lane.",
+                lambda lane=lane: lane.active,
+            )
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "active": self.active,
+            "throttled": self.throttled,
+            "lanes": {
+                name: {
+                    "limit": lane.limit,
+                    "active": lane.active,
+                    "queued": len(lane.waiters),
+                    **lane.stats,
+                }
+                for name, lane in self.lanes.items()
+            },
+        }
+
+
+def _holds_threadpool(dependant) -> bool:
+    """
+    yieldする同期のDependency(get_db等)はthreadpoolで開いたセッションを
+    リクエストの間ずっと持ち続けるので、async defのルートでも入場制御する
+    """
+    return any(
+        is_gen_callable(sub.call) or _holds_threadpool(sub)
+        for sub in dependant.dependencies
+    )
+
+
+def _is_threadpool_route(route) -> bool:
+    endpoint = getattr(route, "endpoint", None)
+    if endpoint is None:
+        return False
+    if not asyncio.iscoroutinefunction(endpoint):
+        return True
+    dependant = getattr(route, "dependant", None)
+    return dependant is not None and _holds_threadpool(dependant)
+
+
+def _bucket_key(scope: Scope, route):
+    """
+    X-Tokenはクライアントが自由に変えられるので、検証済み(verified_token)の時だけ使う。
+    それ以外は接続元のアドレス毎、アドレスが分からなければルート毎のバケツにする
+    """
+    token = scope.get("verified_token")
+    if token:
+        return ("token", token)
+    client = scope.get("client")
+    if client:
+        return ("client", client[0])
+    return ("route", route.path)
+
+
+class AdmissionMiddleware:
+    """
+    ルーティングより前にルートを引き、同期ルートと同期のyield Dependencyを使うルートだけを
+    AdmissionControllerに通す。それ以外のasync defのルートは素通しする。
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        controller: AdmissionController,
+        routes,
+        max_cached: int = 10000,
+    ):
+        self.app = app
+        self.controller = controller
+        # app.router.routesをそのまま持つので、後から追加したルートも見える
+        self.routes = routes
+        self.max_cached = max_cached
+        # (method, path) -> 入場制御するルートかNone。ルートが増減したら捨てる
+        self._cache = {}
+        self._cached_routes = len(routes)
+
+    def _lookup(self, scope: Scope):
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route if _is_threadpool_route(route) else None
+        return None
+
+    def _match(self, scope: Scope):
+        if len(self.routes) != self._cached_routes:
+            self._cache.clear()
+            self._cached_routes = len(self.routes)
+        key = (scope["method"], scope["path"])
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        route = self._lookup(scope)
+        if len(self._cache) >= self.max_cached:
+            # パスパラメータ付きのルートでキーが増え続けないようにする
+            self._cache.clear()
+        self._cache[key] = route
+        return route
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = self._match(scope)
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        if controller.bucket is not None:
+            key = _bucket_key(scope, route)
+            wait = controller.bucket.take(key)
+            if wait:
+                controller.throttled += 1
+                response = JSONResponse(
+                    {"detail": "Too many requests"},
+                    status_code=429,
+                    headers={"Retry-After": str(math.ceil(wait))},
+                )
+                await response(scope, receive, send)
+                return
+
+        lane = controller.lane_for(scope["method"])
+        if not await controller.acquire(lane):
+            response = JSONResponse(
+                {"detail": "Server busy"},
+                status_code=503,
+                headers={"Retry-After": str(lane.retry_after())},
+            )
+            await response(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(lane, time.perf_counter() - start)
+
+
+def admission_options():
+    capacity = int(os.getenv("ADMISSION_CAPACITY", "40"))
+    return {
+        "capacity": capacity,
+        "read_queue": int(os.getenv("ADMISSION_READ_QUEUE", "100")),
+        # 書き込みはcapacityの半分までにして、残りを読み取り用に空けておく
+        "write_limit": int(os.getenv("ADMISSION_WRITE_LIMIT", str(max(1, capacity // 2)))),
+        "write_queue": int(os.getenv("ADMISSION_WRITE_QUEUE", "50")),
+        "queue_timeout": float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5")),
+        "rate": float(os.getenv("ADMISSION_RATE", "0")),
+        "burst": float(os.getenv("ADMISSION_BURST", "0")),
+    }
+
+
+def setup_admission(app: FastAPI, **options):
+    """
+    ADMISSION_CONTROL=falseでなければAdmissionMiddlewareを登録してcontrollerを返す。
+    ADMISSION_RATE>0の時だけトークンバケツ(429)を使う。
+    503/429も計測されるよう、setup_metricsより前に呼ぶ。
+    """
+    if os.getenv("ADMISSION_CONTROL", "true").lower() != "true":
+        return None
+    options = {**admission_options(), **options}
+    capacity = options["capacity"]
+    bucket = None
+    if options["rate"] > 0:
+        bucket = TokenBucket(options["rate"], options["burst"] or options["rate"])
+    controller = AdmissionController(
+        capacity,
+        [
+            Lane("read", capacity, options["read_queue"]),
+            Lane("write", options["write_limit"], options["write_queue"]),
+        ],
+        queue_timeout=options["queue_timeout"],
+        bucket=bucket,
+    )
+    app.add_middleware(
+        AdmissionMiddleware, controller=controller, routes=app.router.routes
+    )
+    return controller
@@ -0,0 +1,142 @@
+import asyncio
+import json
+from typing import Any, Dict, List, Union
+from urllib.parse import urlsplit
+
+from pydantic import BaseModel, Field, validator
+from starlette.types import ASGIApp, Message, Scope
+
+
+class SubRequest(BaseModel):
+    method: str = "GET"
+    path: str
+    headers: Dict[str, str] = {}
+    body: Any = None
+
+    @validator("path")
+    def path_is_relative(cls, path):
+        url = urlsplit(path)
+        if url.scheme or url.netloc or not url.path.startswith("/"):
+            raise ValueError("path must be an absolute path like /items/foo, not a URL")
+        return path
+
+    @validator("headers")
+    def headers_are_latin1(cls, headers):
+        # ASGIのヘッダはlatin-1のバイト列なので、表せないものは422にする
+        for name, value in headers.items():
+            try:
+                name.encode("latin-1")
+                value.encode("latin-1")
+            except UnicodeEncodeError:
+                raise ValueError(f"header {name!r} must be latin-1")
+        return headers
+
+    @property
+    def url_path(self) -> str:
+        """実際にディスパッチされるパス(クエリ・フラグメントを除いたもの)"""
+        return urlsplit(self.path).path
+
+
+class SubResponse(BaseModel):
+    status: int
+    headers: Dict[str, str] = {}
+    body: Any = None
+
+
+class BatchRequest(BaseModel):
+    requests: List[SubRequest] = Field(min_items=1)
+
+
+# content-lengthは送るボディから付け直す。
+# 圧縮されたボディはJSONに埋め込めないのでaccept-encodingも外す
+_DROPPED_HEADERS = {"content-length", "accept-encoding"}
+
+
+def _sub_scope(parent: Scope, sub: SubRequest, body: bytes, extra: dict) -> Scope:
+    url = urlsplit(sub.path)
+    headers = [
+        (k.lower().encode("latin-1"), v.encode("latin-1"))
+        for k, v in sub.headers.items()
+        if k.lower() not in _DROPPED_HEADERS
+    ]
+    if body and not any(k == b"content-type" for k, _ in headers):
+        headers.append((b"content-type", b"application/json"))
+    headers.append((b"content-length", str(len(body)).encode()))
+    return {
+        "type": "http",
+        "asgi": parent.get("asgi", {"version": "3.0"}),
+        "http_version": parent.get("http_version", "1.1"),
+        "method": sub.method.upper(),
+        "scheme": parent.get("scheme", "http"),
+        "server": parent.get("server"),
+        "client": parent.get("client"),
+        "root_path": parent.get("root_path", ""),
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": headers,
+        # サブリクエストからの/batchを弾くための印
+        "in_batch": True,
+        **extra,
+    }
+
+
+async def dispatch(
+    app: ASGIApp, parent: Scope, sub: SubRequest, extra: dict = None
+) -> SubResponse:
+    """サブリクエストを同じプロセスのアプリにASGIで直接流す"""
+    body = b"" if sub.body is None else json.dumps(sub.body).encode()
+    scope = _sub_scope(parent, sub, body, extra or {})
+    received = False
+    status = 500
+    headers = {}
+    chunks = []
+
+    async def receive() -> Message:
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # レスポンスを返し終わるまで切断は通知しない
+        await asyncio.Event().wait()
+
+    async def send(message: Message):
+        nonlocal status, headers
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in message["headers"]}
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    content = b"".join(chunks)
+    content_type = headers.get("content-type", "")
+    if content_type.startswith("application/json") and content:
+        data = json.loads(content)
+    else:
+        data = content.decode("utf-8", errors="replace") if content else None
+    headers.pop("content-length", None)
+    return SubResponse(status=status, headers=headers, body=data)
+
+
+async def run_batch(
+    app: ASGIApp,
+    parent: Scope,
+    requests: List[Union[SubRequest, SubResponse]],
+    concurrency: int,
+    extras: List[dict] = None,
+) -> List[SubResponse]:
+    """
+    requestsを最大concurrency件ずつ並行に処理し、同じ順序で結果を返す。
+    既にSubResponseになっているもの(認証で弾いた等)はそのまま返す。
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    extras = extras or [{}] * len(requests)
+
+    async def one(sub, extra):
+        if isinstance(sub, SubResponse):
+            return sub
+        async with semaphore:
+            return await dispatch(app, parent, sub, extra)
+
+    return await asyncio.gather(*(one(sub, extra) for sub, extra in zip(requests, extras)))
@@ -0,0 +1,99 @@
+import hashlib
+from typing import Callable, Union
+
+from fastapi import Header, HTTPException, Request, Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def _strip_weak(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Matchは弱い比較(W/を無視)で、カンマ区切りで複数来ることもある
+    if if_none_match.strip() == "*":
+        return True
+    tags = {_strip_weak(tag) for tag in if_none_match.split(",")}
+    return _strip_weak(etag) in tags
+
+
+def conditional_get(etag_for: Callable[..., Union[str, None]]):
+    """
+    etag_for(**パスパラメータ)でバージョン等から安くETagを決め、If-None-Matchと一致すれば
+    エンドポイントを呼ばずに(シリアライズもせずに)304を返すDependencyを作る。
+    etag_forがNoneを返した時(404になる場合等)はそのままエンドポイントに任せる
+    """
+
+    def dependency(
+        request: Request,
+        response: Response,
+        if_none_match: Union[str, None] = Header(default=None),
+    ):
+        etag = etag_for(**request.path_params)
+        if etag is None:
+            return
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+
+    return dependency
+
+
+class ETagMiddleware:
+    """
+    GETの200レスポンスにボディのハッシュからETagを付け、If-None-Matchが一致すれば304を返す。
+    ボディが1回で送られるレスポンスだけが対象で、StreamingResponseはそのまま流す。
+    エンドポイントを実行してボディを作ってから比べるので、減るのは転送量だけ。
+    サーバー側の処理も省きたいルートはconditional_getでETagを先に決める
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        start_message = None
+
+        async def send_with_etag(message: Message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                if message["status"] != 200:
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            if message.get("more_body", False):
+                await send(start)
+                await send(message)
+                return
+
+            headers = MutableHeaders(scope=start)
+            etag = headers.get("etag") or make_etag(message.get("body", b""))
+            headers["etag"] = etag
+            if if_none_match is not None and etag_matches(if_none_match, etag):
+                del headers["content-length"]
+                if "content-type" in headers:
+                    del headers["content-type"]
+                start["status"] = 304
+                await send(start)
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
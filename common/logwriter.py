@@ -0,0 +1,127 @@
+import os
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class BatchedLogWriter:
+    """
+    1本のスレッドでキューから行を取り出し、まとめてファイルに書き込む。
+    batch_size行たまるかflush_interval秒経つとflushし、max_bytesを超えたらローテートする。
+    stop()の後、次にstart()するまでのwrite()は呼んだスレッドでそのまま書き込む。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 1000,
+        flush_interval: float = 1.0,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.lines_written = 0
+        self.flushes = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self._stopped = False
+            self._start()
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="BatchedLogWriter", daemon=True
+            )
+            self._thread.start()
+
+    def write(self, line: str):
+        # stop()の_STOPより後にputすると書かれないまま捨てられるので、putもロックの中でする
+        with self._lock:
+            if self._stopped:
+                self._write_now(line)
+                return
+            self._start()
+            self._queue.put(line)
+
+    def stop(self):
+        """キューに残っている行を書き切ってからスレッドを止める"""
+        with self._lock:
+            self._stopped = True
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                # 書き切るまでのwrite()は待たせて、行の順番を保つ
+                self._queue.put(_STOP)
+                thread.join()
+
+    def _write_now(self, line: str):
+        f = open(self.path, mode="a+")
+        try:
+            f = self._flush(f, [line])
+        finally:
+            f.close()
+
+    def _run(self):
+        f = open(self.path, mode="a+")
+        try:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                timeout = max(deadline - time.monotonic(), 0)
+                try:
+                    line = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    line = None
+                if line is _STOP:
+                    break
+                if line is not None:
+                    batch.append(line)
+                if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                    f = self._flush(f, batch)
+                    batch = []
+                    deadline = time.monotonic() + self.flush_interval
+            # stop()より前にputされた行を書き切る
+            while True:
+                try:
+                    line = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if line is not _STOP:
+                    batch.append(line)
+            f = self._flush(f, batch)
+        finally:
+            f.close()
+
+    def _flush(self, f, batch):
+        if not batch:
+            return f
+        f.write("".join(batch))
+        f.flush()
+        self.lines_written += len(batch)
+        self.flushes += 1
+        if self.max_bytes > 0 and f.tell() >= self.max_bytes:
+            f.close()
+            self._rotate()
+            f = open(self.path, mode="a+")
+        return f
+
+    def _rotate(self):
+        # log.txt -> log.txt.1 -> log.txt.2 ... (RotatingFileHandlerと同じ命名)
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
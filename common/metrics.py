@@ -0,0 +1,221 @@
+import time
+from bisect import bisect_left
+
+from anyio import to_thread
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+STATUS_CLASSES = ("0xx", "1xx", "2xx", "3xx", "4xx", "5xx")
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels=""):
+        sep = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+def _header(name, type, help):
+    return [f"# HELP {name} {help}", f"# TYPE {name} {type}"]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RouteMetrics:
+    __slots__ = ("labels", "latency", "size", "status")
+
+    def __init__(self, route):
+        if route is None:
+            method, template = "", "<unmatched>"
+        else:
+            method = ",".join(sorted(getattr(route, "methods", None) or ()))
+            template = getattr(route, "path_format", getattr(route, "path", ""))
+        # ラベル文字列はルート毎に1回だけ組み立てる
+        self.labels = f'method="{_escape(method)}",route="{_escape(template)}"'
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.status = [0] * len(STATUS_CLASSES)
+
+    def observe(self, elapsed, status, size):
+        self.latency.observe(elapsed)
+        self.size.observe(size)
+        self.status[min(status // 100, 5)] += 1
+
+
+class Metrics:
+    def __init__(self):
+        self.routes = {}
+        self.in_flight = 0
+        self.threadpool_wait = Histogram(LATENCY_BUCKETS)
+        self.gauges = []
+
+    def observe(self, route, elapsed, status, size):
+        # リクエスト毎のdict参照はここの1回だけ。Routeは__eq__を持ちhashできないのでidで引く
+        metrics = self.routes.get(id(route))
+        if metrics is None:
+            metrics = self.routes[id(route)] = RouteMetrics(route)
+        metrics.observe(elapsed, status, size)
+
+    def add_gauge(self, name, help, fn):
+        self.gauges.append((name, help, fn))
+
+    def render(self):
+        routes = list(self.routes.values())
+        lines = _header(
+            "http_request_duration_seconds",
+            "histogram",
+            "Request latency per route template.",
+        )
+        for route in routes:
+            lines.extend(
+                route.latency.render("http_request_duration_seconds", route.labels)
+            )
+        lines += _header(
+            "http_response_size_bytes",
+            "histogram",
+            "Response body size per route template.",
+        )
+        for route in routes:
+            lines.extend(route.size.render("http_response_size_bytes", route.labels))
+        lines += _header(
+            "http_requests_total",
+            "counter",
+            "Requests per route template and status class.",
+        )
+        for route in routes:
+            for status, count in zip(STATUS_CLASSES, route.status):
+                if count:
+                    labels = f'{route.labels},status="{status}"'
+                    lines.append(f"http_requests_total{{{labels}}} {count}")
+        lines += _header(
+            "http_requests_in_flight", "gauge", "Requests currently being served."
+        )
+        lines.append(f"http_requests_in_flight {self.in_flight}")
+        lines += _header(
+            "threadpool_wait_seconds",
+            "histogram",
+            "Time spent waiting for a threadpool token.",
+        )
+        lines.extend(self.threadpool_wait.render("threadpool_wait_seconds"))
+        for name, help, fn in self.gauges:
+            lines += _header(name, "gauge", help)
+            lines.append(f"{name} {fn()}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = self.metrics
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_with_metrics(message: Message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            metrics.in_flight -= 1
+            # ルーティング後のscopeにはFastAPIがマッチしたAPIRouteを入れている
+            metrics.observe(
+                scope.get("route"), time.perf_counter() - start, status, size
+            )
+
+
+class _TimedLimiter:
+    """デフォルトのthreadpool limiterを包んで、トークン待ちの時間を記録する"""
+
+    def __init__(self, limiter, histogram):
+        self._limiter = limiter
+        self._histogram = histogram
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        await self._limiter.acquire()
+        self._histogram.observe(time.perf_counter() - start)
+
+    async def __aexit__(self, *exc_info):
+        self._limiter.release()
+
+    def __getattr__(self, name):
+        return getattr(self._limiter, name)
+
+
+def instrument_threadpool(metrics: Metrics):
+    """イベントループ毎に1回、起動時に呼ぶ"""
+    try:
+        # anyioに差し替えるための公開APIが無いので、asyncioバックエンドのRunVarを直接使う
+        from anyio._backends._asyncio import _default_thread_limiter
+    except ImportError:  # pragma: no cover
+        return
+    limiter = to_thread.current_default_thread_limiter()
+    if not isinstance(limiter, _TimedLimiter):
+        _default_thread_limiter.set(_TimedLimiter(limiter, metrics.threadpool_wait))
+
+
+def setup_metrics(app: FastAPI) -> Metrics:
+    """MetricsMiddlewareと/metricsを登録する。最後に追加したミドルウェアが一番外側になる"""
+    metrics = Metrics()
+    metrics.add_gauge(
+        "threadpool_tokens_borrowed",
+        "Threadpool tokens in use.",
+        lambda: to_thread.current_default_thread_limiter().borrowed_tokens,
+    )
+    metrics.add_gauge(
+        "threadpool_tokens_total",
+        "Threadpool size.",
+        lambda: to_thread.current_default_thread_limiter().total_tokens,
+    )
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+    @app.on_event("startup")
+    async def start_threadpool_metrics():
+        instrument_threadpool(metrics)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def read_metrics():
+        return PlainTextResponse(
+            metrics.render(), media_type="text/plain; version=0.0.4"
+        )
+
+    return metrics
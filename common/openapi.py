@@ -0,0 +1,90 @@
+import json
+
+from fastapi import FastAPI
+from starlette.requests import Request
+from starlette.responses import Response
+
+from common.compression import _BrotliCompressor, _GzipCompressor, brotli, negotiate_encoding
+from common.etag import etag_matches, make_etag
+
+
+class CachedOpenAPI:
+    """
+    app.openapi()のJSONを一度だけエンコードし、ETag付きのバイト列として使い回す。
+    gzip/brは初回に最大圧縮で作っておき、以降はAccept-Encodingで選ぶだけにする。
+    """
+
+    def __init__(self, app: FastAPI, gzip_level: int = 9, brotli_quality: int = 11):
+        self.app = app
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.supported = ("br", "gzip") if brotli is not None else ("gzip",)
+        self._variants = {}
+        self._route_count = None
+
+    def regenerate(self):
+        """ルートを追加・変更した後に呼ぶと、次のリクエストでスキーマを作り直す"""
+        self.app.openapi_schema = None
+        self._variants = {}
+        self._route_count = None
+
+    def _encode(self, encoding: str) -> bytes:
+        if encoding == "identity":
+            # JSONResponse.renderと同じ形式
+            return json.dumps(
+                self.app.openapi(),
+                ensure_ascii=False,
+                allow_nan=False,
+                indent=None,
+                separators=(",", ":"),
+            ).encode("utf-8")
+        if encoding == "br":
+            compressor = _BrotliCompressor(self.brotli_quality)
+        else:
+            compressor = _GzipCompressor(self.gzip_level)
+        body = self.variant("identity")[0]
+        return compressor.compress(body) + compressor.finish()
+
+    def variant(self, encoding: str = "identity"):
+        # ルート数が変わっていたら古いスキーマを捨てる
+        if self._route_count != len(self.app.router.routes):
+            self.regenerate()
+            self._route_count = len(self.app.router.routes)
+        if encoding not in self._variants:
+            body = self._encode(encoding)
+            if encoding == "identity":
+                etag = make_etag(body)
+            else:
+                # 表現毎に別のETagにする
+                etag = self._variants["identity"][1][:-1] + f'-{encoding}"'
+            self._variants[encoding] = (body, etag)
+        return self._variants[encoding]
+
+    def warm(self):
+        for encoding in ("identity",) + self.supported:
+            self.variant(encoding)
+
+    async def endpoint(self, request: Request) -> Response:
+        encoding = negotiate_encoding(
+            request.headers.get("accept-encoding", ""), self.supported
+        ) or "identity"
+        body, etag = self.variant(encoding)
+        headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
+
+
+def serve_cached_openapi(app: FastAPI, warm_on_startup: bool = True) -> CachedOpenAPI:
+    """FastAPIが登録するopenapi_urlのルートを、キャッシュ済みのバイト列を返すルートに置き換える"""
+    cache = CachedOpenAPI(app)
+    app.router.routes = [
+        route for route in app.router.routes if getattr(route, "path", None) != app.openapi_url
+    ]
+    app.add_route(app.openapi_url, cache.endpoint, include_in_schema=False)
+    if warm_on_startup:
+        app.add_event_handler("startup", cache.warm)
+    return cache
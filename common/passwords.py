@@ -0,0 +1,178 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List, Tuple, Union
+
+SCRYPT = "scrypt"
+PBKDF2 = "pbkdf2_sha256"
+# crud.create_userが以前保存していた形式。ログイン時に本物のハッシュへ置き換える
+LEGACY_SUFFIX = "notreallyhashed"
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def derive(algorithm: str, params: tuple, password: str, salt: bytes) -> bytes:
+    """プロセスプールのworkerで動くので、pickleできる引数だけを取るモジュール関数にしておく"""
+    if algorithm == SCRYPT:
+        n, r, p = params
+        # OpenSSLのデフォルト上限(32MB)ではn=2**15,r=8で足りないので、必要な分だけ許す
+        maxmem = 128 * r * (n + p + 2) + 1024 * 1024
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=32)
+    if algorithm == PBKDF2:
+        (iterations,) = params
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    raise ValueError(f"Unknown password hash algorithm: {algorithm}")
+
+
+def parse(encoded: str):
+    """(algorithm, params, salt, digest)を返す。知らない形式ならNone"""
+    try:
+        algorithm, params, salt, digest = encoded.split("$")
+        if algorithm == SCRYPT:
+            values = dict(part.split("=") for part in params.split(","))
+            parsed = (int(values["n"]), int(values["r"]), int(values["p"]))
+        elif algorithm == PBKDF2:
+            parsed = (int(params),)
+        else:
+            return None
+        return algorithm, parsed, _b64decode(salt), _b64decode(digest)
+    except (ValueError, KeyError):
+        return None
+
+
+class PasswordHasher:
+    """
+    scrypt/PBKDF2でのハッシュと検証。KDFは数十msかかるので、hash_async/verify_asyncは
+    workers個までのプロセスプールで計算し、イベントループもthreadpoolも塞がない。
+    workers=0ならデフォルトのスレッドプールで計算する。
+    """
+
+    def __init__(
+        self,
+        algorithm: str = SCRYPT,
+        scrypt_n: int = 2 ** 14,
+        scrypt_r: int = 8,
+        scrypt_p: int = 1,
+        pbkdf2_iterations: int = 600000,
+        workers: Union[int, None] = None,
+    ):
+        if algorithm not in (SCRYPT, PBKDF2):
+            raise ValueError(f"Unknown password hash algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.params = (
+            (scrypt_n, scrypt_r, scrypt_p) if algorithm == SCRYPT else (pbkdf2_iterations,)
+        )
+        self.workers = min(4, os.cpu_count() or 1) if workers is None else workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _encode(self, salt: bytes, digest: bytes) -> str:
+        if self.algorithm == SCRYPT:
+            params = "n={},r={},p={}".format(*self.params)
+        else:
+            params = str(self.params[0])
+        return f"{self.algorithm}${params}${_b64encode(salt)}${_b64encode(digest)}"
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # threadを持つプロセスからforkしないよう、workerはspawnで起動する
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+
+    async def _derive(self, algorithm: str, params: tuple, password: str, salt: bytes):
+        executor = self._executor() if self.workers > 0 else None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, derive, algorithm, params, password, salt)
+
+    def hash(self, password: str) -> str:
+        salt = os.urandom(16)
+        return self._encode(salt, derive(self.algorithm, self.params, password, salt))
+
+    def hash_many(self, passwords: List[str]) -> List[str]:
+        """一括インポート用。呼び出したスレッドで待ちながら、プロセスプールで並列に計算する"""
+        salts = [os.urandom(16) for _ in passwords]
+        if self.workers > 0 and len(passwords) > 1:
+            digests = self._executor().map(
+                derive, repeat(self.algorithm), repeat(self.params), passwords, salts
+            )
+        else:
+            digests = (derive(self.algorithm, self.params, p, s) for p, s in zip(passwords, salts))
+        return [self._encode(salt, digest) for salt, digest in zip(salts, digests)]
+
+    async def hash_async(self, password: str) -> str:
+        salt = os.urandom(16)
+        digest = await self._derive(self.algorithm, self.params, password, salt)
+        return self._encode(salt, digest)
+
+    def verify(self, password: str, encoded: str) -> bool:
+        parsed = parse(encoded)
+        if parsed is None:
+            return _verify_legacy(password, encoded)
+        algorithm, params, salt, digest = parsed
+        return hmac.compare_digest(derive(algorithm, params, password, salt), digest)
+
+    async def verify_async(self, password: str, encoded: str) -> bool:
+        parsed = parse(encoded)
+        if parsed is None:
+            return _verify_legacy(password, encoded)
+        algorithm, params, salt, digest = parsed
+        return hmac.compare_digest(
+            await self._derive(algorithm, params, password, salt), digest
+        )
+
+    def needs_rehash(self, encoded: str) -> bool:
+        parsed = parse(encoded)
+        return parsed is None or parsed[:2] != (self.algorithm, self.params)
+
+    async def verify_and_update(self, password: str, encoded: str) -> Tuple[bool, Union[str, None]]:
+        """
+        検証に成功し、保存されているハッシュが今の設定(アルゴリズム・コスト)と違えば
+        新しいハッシュも返す。ログイン時に呼んで保存し直す
+        """
+        if not await self.verify_async(password, encoded):
+            return False, None
+        if self.needs_rehash(encoded):
+            return True, await self.hash_async(password)
+        return True, None
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+
+def _verify_legacy(password: str, encoded: str) -> bool:
+    return hmac.compare_digest((password + LEGACY_SUFFIX).encode(), encoded.encode())
+
+
+def hasher_options():
+    return {
+        "algorithm": os.getenv("PASSWORD_HASH_ALGORITHM", SCRYPT),
+        "scrypt_n": int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 14))),
+        "scrypt_r": int(os.getenv("PASSWORD_SCRYPT_R", "8")),
+        "scrypt_p": int(os.getenv("PASSWORD_SCRYPT_P", "1")),
+        "pbkdf2_iterations": int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", "600000")),
+        "workers": int(os.environ["PASSWORD_HASH_WORKERS"])
+        if "PASSWORD_HASH_WORKERS" in os.environ
+        else None,
+    }
+
+
+password_hasher = PasswordHasher(**hasher_options())
@@ -0,0 +1,316 @@
+import contextvars
+import itertools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from anyio import to_thread
+from fastapi import FastAPI, Header, HTTPException
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger("profiling")
+
+PROFILES_PATH = "/debug/profiles"
+
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+
+_SERIALIZATION_FUNCTIONS = {"serialize_response", "jsonable_encoder", "render"}
+
+
+class Profile:
+    def __init__(self, profile_id: int, method: str, path: str):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.duration = 0.0
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.samples = Counter()
+        self.interval = 0.0
+        # このリクエストの処理をthreadpoolで実行中のスレッド
+        self.threads = set()
+
+    def _frame_name(self, code):
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def track(self, func):
+        """threadpoolに渡す関数を包み、実行中のスレッドをthreadsに入れる"""
+
+        def tracked(*args):
+            ident = threading.get_ident()
+            self.threads.add(ident)
+            try:
+                return func(*args)
+            finally:
+                self.threads.discard(ident)
+
+        return tracked
+
+    def _add(self, frame, root=None):
+        stack = []
+        found = root is None
+        while frame is not None:
+            found = found or frame is root
+            stack.append(self._frame_name(frame.f_code))
+            frame = frame.f_back
+        if found:
+            self.samples[tuple(reversed(stack))] += 1
+
+    def sample(self, frames, loop_ident, root):
+        """
+        threadpoolのスレッドはtrackで登録されたものだけ、イベントループのスレッドは
+        スタックにこのリクエストのroot(ProfilingMiddlewareのフレーム)がある時だけ数える。
+        並行して動く他のリクエストやログ書き込み等のスレッドは混ぜない
+        """
+        for ident in tuple(self.threads):
+            frame = frames.get(ident)
+            if frame is not None:
+                self._add(frame)
+        frame = frames.get(loop_ident)
+        if frame is not None:
+            self._add(frame, root)
+
+    def call_tree(self, min_share: float = 0.01):
+        total = sum(self.samples.values()) or 1
+        root = {"children": {}}
+        for stack, count in self.samples.items():
+            node = root
+            for name in stack:
+                node = node["children"].setdefault(name, {"samples": 0, "children": {}})
+                node["samples"] += count
+
+        def prune(children):
+            return [
+                {
+                    "function": name,
+                    "samples": node["samples"],
+                    "seconds": node["samples"] * self.interval,
+                    "children": prune(node["children"]),
+                }
+                for name, node in sorted(
+                    children.items(), key=lambda item: -item[1]["samples"]
+                )
+                if node["samples"] / total >= min_share
+            ]
+
+        return prune(root["children"])
+
+    def serialization_time(self):
+        count = sum(
+            n
+            for stack, n in self.samples.items()
+            if any(name.split(" ", 1)[0] in _SERIALIZATION_FUNCTIONS for name in stack)
+        )
+        return count * self.interval
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "duration_seconds": self.duration,
+            "sql_count": self.sql_count,
+            "sql_seconds": self.sql_time,
+            "serialization_seconds": self.serialization_time(),
+            "samples": sum(self.samples.values()),
+        }
+
+    def report(self):
+        return {**self.summary(), "call_tree": self.call_tree()}
+
+
+class _Sampler(threading.Thread):
+    """
+    interval毎に、イベントループのスレッドとthreadpoolでこのリクエストを処理中のスレッドの
+    スタックを取る。threadpoolで動く同期ルートも拾える
+    """
+
+    def __init__(self, profile: Profile, interval: float, root):
+        super().__init__(name="ProfileSampler", daemon=True)
+        self.profile = profile
+        self.interval = interval
+        self.loop_ident = threading.get_ident()
+        self.root = root
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.profile.sample(sys._current_frames(), self.loop_ident, self.root)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        # リクエストが終わった後までフレームを生かしておかない
+        self.root = None
+
+
+def _track_threadpool():
+    """
+    プロファイル中のリクエストがto_thread.run_syncに渡した関数を、Profile.trackで包む。
+    starlette・FastAPIの同期ルート・Dependency・シリアライズは全てここを通る
+    """
+    run_sync = to_thread.run_sync
+    if getattr(run_sync, "tracks_profiles", False):
+        return
+
+    async def run_sync_tracked(func, *args, **kwargs):
+        profile = _current_profile.get()
+        if profile is not None:
+            func = profile.track(func)
+        return await run_sync(func, *args, **kwargs)
+
+    run_sync_tracked.tracks_profiles = True
+    to_thread.run_sync = run_sync_tracked
+
+
+class ProfilingMiddleware:
+    """
+    X-Profileヘッダにtokenが付いたリクエスト、またはsample_rateの割合のリクエストを
+    サンプリングプロファイラの下で実行し、結果をstoreに残す。
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        store: "ProfileStore",
+        token: str = "",
+        sample_rate: float = 0.0,
+        interval: float = 0.001,
+    ):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval = interval
+
+    def _selected(self, scope: Scope):
+        if self.token and Headers(scope=scope).get("x-profile") == self.token:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or scope["path"].startswith(PROFILES_PATH)
+            or not self._selected(scope)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        profile = self.store.new(scope["method"], scope["path"])
+        profile.interval = self.interval
+
+        async def send_with_profile_id(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Profile-Id"] = str(profile.id)
+            await send(message)
+
+        token = _current_profile.set(profile)
+        sampler = _Sampler(profile, self.interval, sys._getframe())
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            sampler.stop()
+            profile.duration = time.perf_counter() - start
+            _current_profile.reset(token)
+            self.store.add(profile)
+            logger.info("profile %s", profile.summary())
+
+
+class ProfileStore:
+    def __init__(self, maxlen: int = 100):
+        self._ids = itertools.count(1)
+        self._profiles = OrderedDict()
+        self.maxlen = maxlen
+
+    def new(self, method: str, path: str) -> Profile:
+        return Profile(next(self._ids), method, path)
+
+    def add(self, profile: Profile):
+        self._profiles[profile.id] = profile
+        while len(self._profiles) > self.maxlen:
+            self._profiles.popitem(last=False)
+
+    def get(self, profile_id: int):
+        return self._profiles.get(profile_id)
+
+    def list(self):
+        return [profile.summary() for profile in reversed(self._profiles.values())]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    if profile is not None and conn.info.get("profile_query_start"):
+        profile.sql_time += time.perf_counter() - conn.info["profile_query_start"].pop()
+        profile.sql_count += 1
+
+
+def instrument_engine(engine):
+    """プロファイル中のリクエストが発行したSQLの件数と時間を数える"""
+
+    # main.py/main_b.pyはSQLAlchemyを使わないので、計測を付ける時だけimportする
+    from sqlalchemy import event
+
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def setup_profiling(app: FastAPI, engine=None):
+    """
+    PROFILE_TOKENかPROFILE_SAMPLE_RATEが設定されている時だけミドルウェアを登録する。
+    無効な時はリクエスト毎のコストはゼロ。
+    """
+    token = os.getenv("PROFILE_TOKEN", "")
+    sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    if not token and sample_rate <= 0:
+        return None
+
+    store = ProfileStore(maxlen=int(os.getenv("PROFILE_STORE_SIZE", "100")))
+    _track_threadpool()
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=store,
+        token=token,
+        sample_rate=sample_rate,
+        interval=float(os.getenv("PROFILE_INTERVAL", "0.001")),
+    )
+    if callable(engine):
+        # engineを遅延生成するアプリはget_engineを渡す。起動時にengineを作って計測を付ける
+        app.add_event_handler("startup", lambda: instrument_engine(engine()))
+    elif engine is not None:
+        instrument_engine(engine)
+
+    if token:
+
+        def check_token(x_profile: str = Header(default="")):
+            if x_profile != token:
+                raise HTTPException(status_code=403, detail="Invalid X-Profile header")
+
+        @app.get(PROFILES_PATH, include_in_schema=False)
+        async def read_profiles(x_profile: str = Header(default="")):
+            check_token(x_profile)
+            return store.list()
+
+        @app.get(PROFILES_PATH + "/{profile_id}", include_in_schema=False)
+        async def read_profile(profile_id: int, x_profile: str = Header(default="")):
+            check_token(x_profile)
+            profile = store.get(profile_id)
+            if profile is None:
+                raise HTTPException(status_code=404, detail="Profile not found")
+            return profile.report()
+
+    return store
@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import os
+from typing import Any, List
+
+from fastapi import FastAPI, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() == "true"
+
+
+class FastJSONResponse(JSONResponse):
+    """orjsonでエンコードするJSONResponse。orjsonが無ければ標準のjsonにフォールバックする"""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(jsonable_encoder(content))
+        return orjson.dumps(
+            content, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS
+        )
+
+
+def _response_model_type(response_model):
+    if isinstance(response_model, type) and issubclass(response_model, BaseModel):
+        return response_model, False
+    # typing.get_origin/get_argsは3.8からなので、Dockerの3.7でも動くよう属性を直接見る
+    if getattr(response_model, "__origin__", None) in (list, List):
+        (inner,) = getattr(response_model, "__args__", (None,))
+        if isinstance(inner, type) and issubclass(inner, BaseModel):
+            return inner, True
+    return None, False
+
+
+class FastResponseRoute(APIRoute):
+    """
+    エンドポイントがresponse_modelそのもののインスタンスを返した場合は、
+    FastAPIの再バリデーションとjsonable_encoderを飛ばして直接FastJSONResponseにする。
+    サブクラスのインスタンスは余分なフィールドを持ちうるので通常の経路に回す。
+    """
+
+    def get_route_handler(self):
+        model, many = _response_model_type(self.response_model)
+        if model is not None:
+            self.dependant.call = self._wrap_endpoint(self.dependant.call, model, many)
+        return super().get_route_handler()
+
+    def _wrap_endpoint(self, call, model, many):
+        if asyncio.iscoroutinefunction(call):
+
+            @functools.wraps(call)
+            async def endpoint(**values):
+                return self._fast_response(await call(**values), values, model, many)
+
+        else:
+
+            @functools.wraps(call)
+            def endpoint(**values):
+                return self._fast_response(call(**values), values, model, many)
+
+        return endpoint
+
+    def _fast_response(self, content, values, model, many):
+        options = {
+            "include": self.response_model_include,
+            "exclude": self.response_model_exclude,
+            "by_alias": self.response_model_by_alias,
+            "exclude_unset": self.response_model_exclude_unset,
+            "exclude_defaults": self.response_model_exclude_defaults,
+            "exclude_none": self.response_model_exclude_none,
+        }
+        if many:
+            if not isinstance(content, list) or any(
+                type(value) is not model for value in content
+            ):
+                return content
+            data = [value.dict(**options) for value in content]
+        else:
+            if type(content) is not model:
+                return content
+            data = content.dict(**options)
+
+        response = FastJSONResponse(data, status_code=self.status_code or 200)
+        # `response: Response`引数で設定されたヘッダ・ステータスを引き継ぐ
+        for value in values.values():
+            if isinstance(value, Response):
+                response.headers.raw.extend(value.headers.raw)
+                if value.status_code and not self.status_code:
+                    response.status_code = value.status_code
+        return response
+
+
+def use_fast_json(app: FastAPI, enabled: bool = FAST_JSON) -> bool:
+    """ルートを登録する前に呼ぶこと。デフォルトではFAST_JSON=trueの時だけ有効にする"""
+    if not enabled:
+        return False
+    app.router.route_class = FastResponseRoute
+    app.router.default_response_class = FastJSONResponse
+    return True
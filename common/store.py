@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class StripedStore:
+    """
+    キーのハッシュでstripes個の辞書に分け、それぞれを別のロックで守るインメモリのストア。
+    値は常にplainなdictで持ち、読み出しではコピーを返す。
+    """
+
+    def __init__(self, stripes: int = 16, snapshot_path: Union[str, None] = None):
+        self._stripes = [({}, threading.Lock()) for _ in range(stripes)]
+        # stripe毎の書き込み回数。そのstripeのロックの中で上げるので取りこぼさない
+        self._writes = [0] * stripes
+        self.snapshot_path = snapshot_path
+        self._saved_version = 0
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def _index(self, key: str) -> int:
+        return hash(key) % len(self._stripes)
+
+    def _stripe(self, key: str):
+        return self._stripes[self._index(key)]
+
+    @property
+    def version(self) -> int:
+        """
+        全stripeの書き込み回数の合計。スナップショット後に変わっていなければ書き出しを省く。
+        値を書いた後に数えるので、ここで数えた書き込みは続くto_dictに必ず入る
+        """
+        return sum(self._writes)
+
+    def get(self, key: str) -> Union[dict, None]:
+        data, lock = self._stripe(key)
+        with lock:
+            value = data.get(key)
+            return dict(value) if value is not None else None
+
+    def get_many(self, keys: Iterable[str]) -> List[dict]:
+        """見つかったものだけをkeysの順で返す"""
+        values = (self.get(key) for key in keys)
+        return [value for value in values if value is not None]
+
+    def insert(self, key: str, value: dict) -> bool:
+        """キーが無い時だけ入れる。確認と挿入は同じロックの中で行う"""
+        index = self._index(key)
+        data, lock = self._stripes[index]
+        with lock:
+            if key in data:
+                return False
+            data[key] = dict(value)
+            self._writes[index] += 1
+            return True
+
+    def put(self, key: str, value: dict):
+        index = self._index(key)
+        data, lock = self._stripes[index]
+        with lock:
+            data[key] = dict(value)
+            self._writes[index] += 1
+
+    def update(self, items: Dict[str, dict]):
+        for key, value in items.items():
+            self.put(key, value)
+
+    def __contains__(self, key: str) -> bool:
+        data, lock = self._stripe(key)
+        with lock:
+            return key in data
+
+    def __len__(self) -> int:
+        return sum(len(data) for data, _ in self._stripes)
+
+    def to_dict(self) -> Dict[str, dict]:
+        result = {}
+        for data, lock in self._stripes:
+            with lock:
+                result.update((key, dict(value)) for key, value in data.items())
+        return result
+
+    def save(self, path: Union[str, None] = None) -> bool:
+        """変更があれば一時ファイルに書いてからrenameする。途中で落ちても前のスナップショットは残る"""
+        path = path or self.snapshot_path
+        version = self.version
+        if path is None or version == self._saved_version:
+            return False
+        content = self.to_dict()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            if orjson is not None:
+                f.write(orjson.dumps(content))
+            else:
+                f.write(json.dumps(content).encode())
+        os.replace(tmp_path, path)
+        self._saved_version = version
+        return True
+
+    def load(self, path: Union[str, None] = None) -> bool:
+        path = path or self.snapshot_path
+        if path is None or not os.path.exists(path):
+            return False
+        with open(path, "rb") as f:
+            raw = f.read()
+        content = orjson.loads(raw) if orjson is not None else json.loads(raw)
+        for key, value in content.items():
+            data, lock = self._stripe(key)
+            with lock:
+                data[key] = value
+        self._saved_version = self.version
+        return True
+
+    def start_snapshots(self, interval: float):
+        if self.snapshot_path is None or interval <= 0 or self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name="StoreSnapshot", daemon=True
+        )
+        self._thread.start()
+
+    def stop_snapshots(self):
+        """スレッドを止め、最後の変更を書き出す"""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            thread.join()
+        self.save()
+
+    def _run(self, interval: float):
+        while not self._stopped.wait(interval):
+            self.save()
@@ -0,0 +1,75 @@
+import asyncio
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Tuple
+
+
+async def call_asgi(
+    app,
+    method: str,
+    path: str,
+    query_string: bytes = b"",
+    headers: List[Tuple[bytes, bytes]] = (),
+    chunks: Iterable[bytes] = (),
+    keep_body: bool = True,
+):
+    """
+    TestClientはリクエスト・レスポンスのボディ全体をメモリに組み立てるので、
+    ストリーミングのテストではASGIアプリを直接呼ぶ。chunksを少しずつ送り、
+    keep_body=Falseならレスポンスのボディは長さだけ数えて捨てる
+    """
+    received = {"status": None, "size": 0, "body": b""}
+    body: Iterator[bytes] = iter(chunks)
+    finished = []
+
+    async def receive():
+        if finished:
+            # 切断されないクライアントとして、レスポンス完了でキャンセルされるまで待つ
+            await asyncio.Event().wait()
+        chunk = next(body, None)
+        if chunk is None:
+            finished.append(True)
+            return {"type": "http.request", "body": b"", "more_body": False}
+        return {"type": "http.request", "body": chunk, "more_body": True}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            received["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            received["size"] += len(chunk)
+            if keep_body:
+                received["body"] += chunk
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string,
+        "root_path": "",
+        "headers": list(headers),
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    await app(scope, receive, send)
+    return received
+
+
+@contextmanager
+def traced_peak():
+    """
+    ブロックの中で確保されたPythonオブジェクトのピーク(MB)をresult["peak_mb"]に入れる。
+    ru_maxrssはプロセス全体の最大値なので、先に走ったテストの方が多く使っていると何も測れない
+    """
+    result = {"peak_mb": 0.0}
+    tracemalloc.start()
+    try:
+        yield result
+        _, peak = tracemalloc.get_traced_memory()
+        result["peak_mb"] = peak / 1024 / 1024
+    finally:
+        tracemalloc.stop()
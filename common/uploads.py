@@ -0,0 +1,63 @@
+import hashlib
+import os
+import uuid
+from dataclasses import dataclass
+from typing import AsyncIterator, Union
+
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+
+
+@dataclass
+class SpooledUpload:
+    file_id: str
+    path: str
+    size: int
+    sha256: str
+
+
+def _too_large(max_size: int):
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File too large (max {max_size} bytes)",
+    )
+
+
+async def spool_upload(
+    chunks: AsyncIterator[bytes],
+    directory: str,
+    max_size: int,
+    content_length: Union[str, None] = None,
+) -> SpooledUpload:
+    """
+    リクエストボディをチャンク毎にディスクへ書き出しながらサイズとsha256を計算する。
+    ファイル全体をメモリに載せることはない。
+    """
+    if content_length is not None and content_length.isdigit():
+        if int(content_length) > max_size:
+            # ボディを読む前に断る
+            raise _too_large(max_size)
+
+    os.makedirs(directory, exist_ok=True)
+    file_id = uuid.uuid4().hex
+    path = os.path.join(directory, file_id)
+    part_path = path + ".part"
+    digest = hashlib.sha256()
+    size = 0
+    f = await run_in_threadpool(open, part_path, "wb")
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_size:
+                raise _too_large(max_size)
+            digest.update(chunk)
+            await run_in_threadpool(f.write, chunk)
+    except BaseException:
+        f.close()
+        os.remove(part_path)
+        raise
+    f.close()
+    os.replace(part_path, path)
+    return SpooledUpload(
+        file_id=file_id, path=path, size=size, sha256=digest.hexdigest()
+    )
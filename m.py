@@ -1,44 +1,234 @@
-from typing import List
+import os
+from typing import List, Tuple, Union
 
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
+from common.admission import setup_admission
+from common.compression import CompressionMiddleware, compression_options
+from common.etag import etag_matches
+from common.metrics import setup_metrics
+from common.passwords import password_hasher
+from common.profiling import setup_profiling
+from common.responses import use_fast_json
 from sql_app import crud, models, schemas
-from sql_app.database import SessionLocal, engine
+from sql_app.export import ExportFormat, export_chunks, media_types
+from sql_app.imports import ImportFormat, InvalidImport, OnConflict, detect_format, import_users
+from sql_app.pagination import (
+    InvalidCursor,
+    decode_search_cursor,
+    get_after_id,
+    next_cursor,
+    next_search_cursor,
+)
+from sql_app.database import (
+    SessionLocal,
+    dispose_engines,
+    get_engine,
+    get_read_engine,
+    pool_status,
+)
 
-models.Base.metadata.create_all(bind=engine)
+# importではDBに触れず、起動時にテーブル作成・カラム追加をする。
+# マイグレーション済みの環境ではINIT_DB=falseで省ける
+INIT_DB = os.getenv("INIT_DB", "true").lower() == "true"
 
 app = FastAPI()
 
+
+@app.on_event("startup")
+def init_database():
+    if INIT_DB:
+        with get_engine().begin() as conn:
+            models.init_db(conn)
+
+
+@app.on_event("shutdown")
+def close_database():
+    dispose_engines()
+    password_hasher.shutdown()
+
+
+use_fast_json(app)
+
+app.add_middleware(CompressionMiddleware, **compression_options())
+# 同期ルートはthreadpoolで動くので、溢れる分は待たせ続けずに503で返す
+admission = setup_admission(app)
+profiles = setup_profiling(app, get_engine)
+metrics = setup_metrics(app)
+if admission is not None:
+    admission.add_gauges(metrics)
+metrics.add_gauge(
+    "db_pool_checked_out",
+    "Connections checked out of the pool.",
+    lambda: pool_status(get_engine()).get("checked_out", 0),
+)
+metrics.add_gauge(
+    "db_pool_wait_seconds_total",
+    "Total time spent waiting for a pool connection.",
+    lambda: pool_status(get_engine()).get("wait_time_total", 0),
+)
+
+MAX_BULK_ITEMS = int(os.getenv("MAX_BULK_ITEMS", "1000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))
+
 # TODO yeild・session周りまとめる
 # Dependency
 def get_db():
-    db = SessionLocal()
+    db = SessionLocal(bind=get_engine())
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# 読み取りだけのルート用。SQLITE_MODE=walでは書き込みを待たない読み取り専用poolから取る
+def get_read_db():
+    db = SessionLocal(bind=get_read_engine())
     try:
         yield db
     finally:
         db.close()
 
 
+async def release_connection(db: Session):
+    """
+    KDFを待つ間、トランザクションを終えて接続をpoolに返しておく。
+    SQLITE_MODE=walでは書き込み用の接続が1本なので、持ったままだと他の書き込みが全部待つ
+    """
+    if db.in_transaction():
+        await run_in_threadpool(db.rollback)
+
+
+# KDFはプロセスプールで計算するのでasync defにし、DBアクセスだけをthreadpoolに回す
 @app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
+async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    db_user = await run_in_threadpool(crud.get_user_by_email_cached, db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    await release_connection(db)
+    hashed_password = await password_hasher.hash_async(user.password)
+    # KDFを待っている間に同じemailが登録されていることもある
+    db_user = await run_in_threadpool(crud.create_user, db, user, hashed_password)
+    if db_user is None:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return db_user
+
+
+@app.post("/login/", response_model=schemas.UserSummary)
+async def login(credentials: schemas.UserLogin, db: Session = Depends(get_db)):
+    db_user = await run_in_threadpool(crud.get_user_by_email, db, email=credentials.email)
+    # rollbackするとdb_userは期限切れになるので、使う値は先に取り出しておく
+    user = schemas.UserSummary.from_orm(db_user) if db_user is not None else None
+    hashed_password = db_user.hashed_password if db_user is not None else None
+    await release_connection(db)
+    # パスワード無しでインポートされたユーザーはログインできない
+    if hashed_password is None:
+        # 存在しないemailでも同じだけ時間を掛け、応答時間から登録の有無が分からないようにする
+        await password_hasher.hash_async(credentials.password)
+        raise HTTPException(status_code=401, detail="Incorrect email or password")
+    verified, new_hash = await password_hasher.verify_and_update(
+        credentials.password, hashed_password
+    )
+    if not verified:
+        raise HTTPException(status_code=401, detail="Incorrect email or password")
+    if new_hash is not None:
+        # コストやアルゴリズムを変えた後は、平文が手元にあるログイン時に保存し直す
+        await run_in_threadpool(crud.update_user_password, db, user.id, new_hash)
+    return user
+
+
+# UploadFileは1MBを超えるとディスクに退避されるので、ファイル全体をメモリに載せずに読める
+@app.post("/users/import", response_model=schemas.UserImportReport)
+def import_users_from_file(
+    file: UploadFile,
+    format: Union[ImportFormat, None] = None,
+    on_conflict: OnConflict = OnConflict.ignore,
+    db: Session = Depends(get_db),
+):
+    if not crud.supports_upsert(db):
+        raise HTTPException(
+            status_code=501, detail="User import is not supported on this database"
+        )
+    format = format or detect_format(file.filename, file.content_type)
+    if format is None:
+        raise HTTPException(
+            status_code=400, detail="Unknown file format, pass format=csv or format=ndjson"
+        )
+    try:
+        return import_users(
+            db,
+            file.file,
+            format,
+            on_conflict,
+            batch_size=IMPORT_BATCH_SIZE,
+            hash_many=password_hasher.hash_many,
+            max_errors=IMPORT_MAX_ERRORS,
+        )
+    except InvalidImport as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/users/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = crud.get_users(db, skip=skip, limit=limit)
+def read_users(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Union[int, None] = Depends(get_after_id),
+    db: Session = Depends(get_read_db),
+):
+    users = crud.get_users(db, skip=skip, limit=limit, after_id=after_id)
+    cursor = next_cursor(users, limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return users
+
+
+@app.get("/users/summary/", response_model=List[schemas.UserSummary])
+def read_users_summary(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Union[int, None] = Depends(get_after_id),
+    db: Session = Depends(get_read_db),
+):
+    # itemsを返さないのでrelationshipはロードしない
+    users = crud.get_users(
+        db, skip=skip, limit=limit, after_id=after_id, load=crud.UserLoad.noload
+    )
+    cursor = next_cursor(users, limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
     return users
 
 
+def user_etag(user_id: int, version: int):
+    return f'"user-{user_id}-{version}"'
+
+
 @app.get("/users/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, user_id=user_id)
+def read_user(
+    user_id: int,
+    response: Response,
+    if_none_match: Union[str, None] = Header(default=None),
+    db: Session = Depends(get_read_db),
+):
+    if if_none_match is not None:
+        # versionだけを引いて、一致すれば行とitemsを読まずに304を返す
+        version = crud.get_user_version(db, user_id=user_id)
+        if version is not None and etag_matches(
+            if_none_match, user_etag(user_id, version)
+        ):
+            return Response(
+                status_code=304, headers={"ETag": user_etag(user_id, version)}
+            )
+    db_user = crud.get_user_cached(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    response.headers["ETag"] = user_etag(user_id, db_user.version)
     return db_user
 
 
@@ -49,7 +239,103 @@ def create_item_for_user(
     return crud.create_user_item(db=db, item=item, user_id=user_id)
 
 
+# 各行のバリデーションエラーはloc(["body", index, field])付きの422で返る
+@app.post("/users/{user_id}/items/bulk", response_model=List[schemas.Item])
+def create_items_for_user(
+    user_id: int, items: List[schemas.ItemCreate], db: Session = Depends(get_db)
+):
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many items: {len(items)} (max {MAX_BULK_ITEMS})",
+        )
+    if crud.get_user(db, user_id=user_id, load=crud.UserLoad.noload) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return crud.create_user_items(db=db, items=items, user_id=user_id)
+
+
 @app.get("/items/", response_model=List[schemas.Item])
-def read_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    items = crud.get_items(db, skip=skip, limit=limit)
-    return items
\ No newline at end of file
+def read_items(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Union[int, None] = Depends(get_after_id),
+    db: Session = Depends(get_read_db),
+):
+    items = crud.get_items(db, skip=skip, limit=limit, after_id=after_id)
+    cursor = next_cursor(items, limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return items
+
+
+def get_search_after(cursor: Union[str, None] = None):
+    if cursor is None:
+        return None
+    try:
+        return decode_search_cursor(cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@app.get("/items/search", response_model=List[schemas.ItemSearchResult])
+def search_items(
+    response: Response,
+    q: str = Query(min_length=1, max_length=200),
+    limit: int = Query(default=20, ge=1, le=100),
+    after: Union[Tuple[float, int], None] = Depends(get_search_after),
+    db: Session = Depends(get_read_db),
+):
+    items = crud.search_items(db, q=q, limit=limit, after=after)
+    cursor = next_search_cursor(items, limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return items
+
+
+def export_response(partitions, format: ExportFormat, name: str, fields):
+    return StreamingResponse(
+        export_chunks(partitions, format, fields),
+        media_type=media_types[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{name}.{format.value}"'
+        },
+    )
+
+
+# yield_perで少しずつ読み出して流すので、テーブルの大きさに関わらずメモリは一定
+@app.get("/export/users")
+def export_users(
+    format: ExportFormat = ExportFormat.ndjson, db: Session = Depends(get_read_db)
+):
+    return export_response(
+        crud.iter_users(db), format, "users", ["id", "email", "is_active"]
+    )
+
+
+@app.get("/export/items")
+def export_items(
+    format: ExportFormat = ExportFormat.ndjson, db: Session = Depends(get_read_db)
+):
+    return export_response(
+        crud.iter_items(db),
+        format,
+        "items",
+        ["id", "title", "description", "owner_id"],
+    )
+
+
+@app.get("/stats/pool")
+def read_pool_status():
+    status = pool_status(get_engine())
+    if get_read_engine() is not get_engine():
+        status["reader"] = pool_status(get_read_engine())
+    return status
+
+
+@app.get("/stats/cache")
+def read_cache_stats():
+    return {
+        "user": crud.user_cache.stats(),
+        "user_email": crud.user_email_cache.stats(),
+    }
@@ -0,0 +1,109 @@
+# m.py の async 版。同期版は `uvicorn m:app`、こちらは `uvicorn m_async:app` で起動する
+import os
+from typing import List, Union
+
+from fastapi import Depends, FastAPI, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.passwords import password_hasher
+from sql_app import async_crud as crud, models, schemas
+from sql_app.async_database import AsyncSessionLocal, get_async_engine
+from sql_app.crud import UserLoad
+from sql_app.pagination import get_after_id, next_cursor
+
+# m.pyと同じくINIT_DB=falseで起動時のテーブル作成を省ける
+INIT_DB = os.getenv("INIT_DB", "true").lower() == "true"
+
+app = FastAPI()
+
+
+@app.on_event("startup")
+async def create_tables():
+    if INIT_DB:
+        async with get_async_engine().begin() as conn:
+            await conn.run_sync(models.init_db)
+
+
+@app.on_event("shutdown")
+def stop_password_hasher():
+    password_hasher.shutdown()
+
+
+# Dependency
+async def get_db():
+    async with AsyncSessionLocal(bind=get_async_engine()) as db:
+        yield db
+
+
+@app.post("/users/", response_model=schemas.User)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await crud.get_user_by_email(db, email=user.email)
+    if db_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    hashed_password = await password_hasher.hash_async(user.password)
+    db_user = await crud.create_user(db=db, user=user, hashed_password=hashed_password)
+    if db_user is None:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return db_user
+
+
+@app.get("/users/", response_model=List[schemas.User])
+async def read_users(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Union[int, None] = Depends(get_after_id),
+    db: AsyncSession = Depends(get_db),
+):
+    users = await crud.get_users(db, skip=skip, limit=limit, after_id=after_id)
+    cursor = next_cursor(users, limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return users
+
+
+@app.get("/users/summary/", response_model=List[schemas.UserSummary])
+async def read_users_summary(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Union[int, None] = Depends(get_after_id),
+    db: AsyncSession = Depends(get_db),
+):
+    users = await crud.get_users(
+        db, skip=skip, limit=limit, after_id=after_id, load=UserLoad.noload
+    )
+    cursor = next_cursor(users, limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return users
+
+
+@app.get("/users/{user_id}", response_model=schemas.User)
+async def read_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    db_user = await crud.get_user(db, user_id=user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+
+@app.post("/users/{user_id}/items/", response_model=schemas.Item)
+async def create_item_for_user(
+    user_id: int, item: schemas.ItemCreate, db: AsyncSession = Depends(get_db)
+):
+    return await crud.create_user_item(db=db, item=item, user_id=user_id)
+
+
+@app.get("/items/", response_model=List[schemas.Item])
+async def read_items(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Union[int, None] = Depends(get_after_id),
+    db: AsyncSession = Depends(get_db),
+):
+    items = await crud.get_items(db, skip=skip, limit=limit, after_id=after_id)
+    cursor = next_cursor(items, limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return items
@@ -21,6 +21,19 @@ from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, EmailStr,Field
 from enum import Enum
 from typing import Union, List
+import os
+import tempfile
+
+from common.admission import setup_admission
+from common.compression import CompressionMiddleware, compression_options
+from common.etag import ETagMiddleware, conditional_get
+from common.logwriter import BatchedLogWriter
+from common.metrics import setup_metrics
+from common.openapi import serve_cached_openapi
+from common.passwords import password_hasher
+from common.profiling import setup_profiling
+from common.responses import use_fast_json
+from common.uploads import spool_upload
 
 
 description = """
@@ -71,6 +84,23 @@ app = FastAPI(
     openapi_url="/api/v1/openapi.json"
 )
 
+# スキーマはゲートウェイのヘルスチェック毎に取られるので、エンコード済みのバイト列を返す
+openapi_cache = serve_cached_openapi(app)
+
+# orjsonでのレスポンス生成と、response_modelのインスタンスを返した時の再バリデーション省略
+use_fast_json(app)
+
+# GETのレスポンスにETagを付けて、If-None-Matchが一致すれば304を返す
+app.add_middleware(ETagMiddleware)
+# ETagは非圧縮のボディから計算したいので、圧縮はその外側に置く
+app.add_middleware(CompressionMiddleware, **compression_options())
+# update_item等の同期ルートはthreadpoolで動くので、溢れる分は待たせ続けずに503で返す
+admission = setup_admission(app)
+profiles = setup_profiling(app)
+metrics = setup_metrics(app)
+if admission is not None:
+    admission.add_gauges(metrics)
+
 class Item(BaseModel):
     name: str = Field(example="Foo2")
     description: Union[str, None] = Field(default=None, example="A very nice Item22")
@@ -256,11 +286,22 @@ items = {
     },
 }
 
+# itemsは起動中に変わらないので、中身を書き換えたらITEMS_VERSIONを上げる
+ITEMS_VERSION = 1
+
+
+def item_etag(item_id: str):
+    if item_id not in items:
+        return None
+    return f'"item-{item_id}-{ITEMS_VERSION}"'
+
+
 @app.get(
     "/items2/{item_id}", 
     response_model=Item, 
     response_model_exclude_unset=True,
-    tags=[Tags.items]
+    tags=[Tags.items],
+    dependencies=[Depends(conditional_get(item_etag))],
 )
 async def read_item(item_id: str):
     if item_id not in items:
@@ -275,7 +316,8 @@ async def read_item(item_id: str):
     "/items/{item_id}/name",
     response_model=Item,
     response_model_include={"name", "description"}, # includeはkeyを一部に
-    tags=[Tags.items]
+    tags=[Tags.items],
+    dependencies=[Depends(conditional_get(item_etag))],
 )
 async def read_item_name(item_id: str):
     return items[item_id]
@@ -286,6 +328,7 @@ async def read_item_name(item_id: str):
     response_model=Item, 
     response_model_exclude={"tax"},
     tags=[Tags.items],
+    dependencies=[Depends(conditional_get(item_etag))],
 ) # excludeはkeyを除く
 async def read_item_public_data(item_id: str):
     return items[item_id]
@@ -394,11 +437,7 @@ async def get_model(model_name: ModelName):
 
 fake_items_db = [{"item_name": "Foo"}, {"item_name": "Bar"}, {"item_name": "Baz"}]
 
-def fake_password_hasher(raw_password: str):
-    return "supersecret" + raw_password
-
-def fake_save_user(user_in: UserIn):
-    hashed_password = fake_password_hasher(user_in.password)
+def fake_save_user(user_in: UserIn, hashed_password: str):
     user_in_db = UserInDB(**user_in.dict(),hashed_password=hashed_password)
     print(user_in,user_in_db)
     print("User saved! ..not really")
@@ -411,7 +450,9 @@ def fake_save_user(user_in: UserIn):
     tags=[Tags.users],
 )
 async def create_user(user_in: UserIn):
-    user_saved = fake_save_user(user_in)
+    # KDFはプロセスプールで計算し、イベントループを塞がない
+    hashed_password = await password_hasher.hash_async(user_in.password)
+    user_saved = fake_save_user(user_in, hashed_password)
     return user_saved
 
 
@@ -424,10 +465,17 @@ items3 = {
     },
 }
 
+def item3_etag(item_id: str):
+    if item_id not in items3:
+        return None
+    return f'"item3-{item_id}-{ITEMS_VERSION}"'
+
+
 @app.get(
     "/items3/{item_id}", 
     response_model=Union[PlaneItem, CarItem],
     tags=[Tags.items],
+    dependencies=[Depends(conditional_get(item3_etag))],
 )
 async def read_item(item_id: str):
     return items3[item_id]
@@ -463,6 +511,27 @@ async def create_file(file: Union[bytes, None] = File(default=None)):
         return {"file_size": len(file)}
 
 
+UPLOAD_SPOOL_DIR = os.getenv(
+    "UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "uploads")
+)
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", str(10 * 1024 ** 3)))
+
+# File()はファイル全体をメモリに載せるので、大きいファイルはボディをそのまま流し込む
+@app.post("/files/stream")
+async def create_file_stream(request: Request):
+    upload = await spool_upload(
+        request.stream(),
+        directory=UPLOAD_SPOOL_DIR,
+        max_size=UPLOAD_MAX_SIZE,
+        content_length=request.headers.get("content-length"),
+    )
+    return {
+        "file_id": upload.file_id,
+        "file_size": upload.size,
+        "sha256": upload.sha256,
+    }
+
+
 @app.post("/uploadfile/")
 # async def create_upload_file(file: UploadFile):
 # UploadFileの型推定を入れることで、デフォルト値を設定しなくてもいい
@@ -490,10 +559,27 @@ async def read_unicorn(name: str):
         raise UnicornException(name=name)
     return {"unicorn_name": name}
 
+# タスク毎にlog.txtを開閉せず、1本のwriterスレッドでまとめて書き込む
+notification_log = BatchedLogWriter(
+    os.getenv("NOTIFICATION_LOG_PATH", "log.txt"),
+    batch_size=int(os.getenv("NOTIFICATION_LOG_BATCH_SIZE", "1000")),
+    flush_interval=float(os.getenv("NOTIFICATION_LOG_FLUSH_INTERVAL", "1.0")),
+    max_bytes=int(os.getenv("NOTIFICATION_LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+)
+
+@app.on_event("startup")
+def start_notification_log():
+    notification_log.start()
+
+@app.on_event("shutdown")
+def stop_notification_log():
+    notification_log.stop()
+
+app.add_event_handler("shutdown", password_hasher.shutdown)
+
 def write_notification(email: str, message=""):
-    with open("log.txt", mode="a+") as email_file:
-        content = f"notification for {email}: {message}\n"
-        email_file.write(content)
+    content = f"notification for {email}: {message}\n"
+    notification_log.write(content)
 
 # @app.post("/send-notification/{email}")
 # async def send_notification(email: str, background_tasks: BackgroundTasks):
@@ -1,16 +1,48 @@
-from typing import Union
+import os
+from typing import List, Union
 
-from fastapi import FastAPI, Header, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
 from pydantic import BaseModel
 
+from common.batch import BatchRequest, SubResponse, run_batch
+from common.compression import CompressionMiddleware, compression_options
+from common.metrics import setup_metrics
+from common.profiling import setup_profiling
+from common.store import StripedStore
+
 fake_secret_token = "coneofsilence"
 
-fake_db = {
-    "foo": {"id": "foo", "title": "Foo", "description": "There goes my hero"},
-    "bar": {"id": "bar", "title": "Bar", "description": "The bartenders"},
-}
+# ITEM_SNAPSHOT_PATHを指定するとITEM_SNAPSHOT_INTERVAL秒毎に書き出し、
+# 起動時に読み戻す
+ITEM_SNAPSHOT_PATH = os.getenv("ITEM_SNAPSHOT_PATH")
+ITEM_SNAPSHOT_INTERVAL = float(os.getenv("ITEM_SNAPSHOT_INTERVAL", "30"))
+
+item_store = StripedStore(
+    stripes=int(os.getenv("ITEM_STORE_STRIPES", "16")),
+    snapshot_path=ITEM_SNAPSHOT_PATH,
+)
+item_store.update(
+    {
+        "foo": {"id": "foo", "title": "Foo", "description": "There goes my hero"},
+        "bar": {"id": "bar", "title": "Bar", "description": "The bartenders"},
+    }
+)
 
 app = FastAPI()
+app.add_middleware(CompressionMiddleware, **compression_options())
+profiles = setup_profiling(app)
+metrics = setup_metrics(app)
+
+
+@app.on_event("startup")
+def load_item_snapshot():
+    item_store.load()
+    item_store.start_snapshots(ITEM_SNAPSHOT_INTERVAL)
+
+
+@app.on_event("shutdown")
+def save_item_snapshot():
+    item_store.stop_snapshots()
 
 
 class Item(BaseModel):
@@ -19,20 +51,90 @@ class Item(BaseModel):
     description: Union[str, None] = None
 
 
-@app.get("/items/{item_id}", response_model=Item)
-async def read_main(item_id: str, x_token: str = Header()):
-    if x_token != fake_secret_token:
+def check_token(x_token: str) -> bool:
+    return x_token == fake_secret_token
+
+
+def verify_token(request: Request, x_token: str = Header()):
+    # /batchで検証済みのトークンはサブリクエスト毎に検証し直さない
+    if request.scope.get("verified_token") == x_token:
+        return x_token
+    if not check_token(x_token):
         raise HTTPException(status_code=400, detail="Invalid X-Token header")
-    if item_id not in fake_db:
+    return x_token
+
+
+MAX_MULTI_GET_IDS = int(os.getenv("MAX_MULTI_GET_IDS", "100"))
+
+
+@app.get("/items", response_model=List[Item])
+async def read_items(ids: str = Query(), x_token: str = Depends(verify_token)):
+    """ids=a,b,c の順で、存在するitemだけを返す"""
+    keys = [key for key in ids.split(",") if key]
+    if len(keys) > MAX_MULTI_GET_IDS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_MULTI_GET_IDS} ids per request"
+        )
+    return item_store.get_many(keys)
+
+
+@app.get("/items/{item_id}", response_model=Item)
+async def read_main(item_id: str, x_token: str = Depends(verify_token)):
+    item = item_store.get(item_id)
+    if item is None:
         raise HTTPException(status_code=404, detail="Item not found")
-    return fake_db[item_id]
+    return item
 
 
 @app.post("/items/", response_model=Item)
-async def create_item(item: Item, x_token: str = Header()):
-    if x_token != fake_secret_token:
-        raise HTTPException(status_code=400, detail="Invalid X-Token header")
-    if item.id in fake_db:
+async def create_item(item: Item, x_token: str = Depends(verify_token)):
+    if not item_store.insert(item.id, item.dict()):
         raise HTTPException(status_code=400, detail="Item already exists")
-    fake_db[item.id] = item
-    return item
\ No newline at end of file
+    return item
+
+
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "100"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "10"))
+
+
+@app.post("/batch", response_model=List[SubResponse])
+async def batch(
+    request: Request,
+    batch: BatchRequest,
+    x_token: Union[str, None] = Header(default=None),
+):
+    """
+    複数のサブリクエストを1往復で処理する。
+    サブリクエストのX-Tokenを省略するとバッチのものを使い、
+    同じトークンの検証はバッチ内で1回だけ行う。
+    """
+    if request.scope.get("in_batch"):
+        raise HTTPException(status_code=400, detail="Nested batch requests are not allowed")
+    if len(batch.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=413, detail=f"At most {BATCH_MAX_REQUESTS} requests per batch"
+        )
+
+    verified = {}
+    requests, extras = [], []
+    for sub in batch.requests:
+        headers = {k.lower(): v for k, v in sub.headers.items()}
+        if x_token is not None:
+            headers.setdefault("x-token", x_token)
+        token = headers.get("x-token")
+        sub = sub.copy(update={"headers": headers})
+        extra = {}
+        if sub.url_path.rstrip("/") == "/batch":
+            sub = SubResponse(
+                status=400, body={"detail": "Nested batch requests are not allowed"}
+            )
+        elif token is not None:
+            if token not in verified:
+                verified[token] = check_token(token)
+            if not verified[token]:
+                sub = SubResponse(status=400, body={"detail": "Invalid X-Token header"})
+            else:
+                extra = {"verified_token": token}
+        requests.append(sub)
+        extras.append(extra)
+    return await run_batch(request.app, request.scope, requests, BATCH_CONCURRENCY, extras)
@@ -0,0 +1,76 @@
+from typing import Union
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from sql_app import models, schemas
+from sql_app.crud import UserLoad, _user_items_loaders
+
+
+# AsyncSessionではlazy loadが使えないので、itemsはselectin/joined/noloadで読む
+def _select_users(load: UserLoad):
+    return select(models.User).options(_user_items_loaders[load](models.User.items))
+
+
+async def get_user(db: AsyncSession, user_id: int, load: UserLoad = UserLoad.selectin):
+    result = await db.execute(_select_users(load).filter(models.User.id == user_id))
+    return result.unique().scalars().first()
+
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).filter(models.User.email == email))
+    return result.scalars().first()
+
+
+async def get_users(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Union[int, None] = None,
+    load: UserLoad = UserLoad.selectin,
+):
+    query = _select_users(load).order_by(models.User.id)
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.unique().scalars().all()
+
+
+# emailが既に登録されていればNoneを返す
+async def create_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str):
+    db_user = models.User(email=user.email, hashed_password=hashed_password)
+    db.add(db_user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return None
+    return await get_user(db, db_user.id)
+
+
+async def get_items(
+    db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Union[int, None] = None
+):
+    query = select(models.Item).order_by(models.Item.id)
+    if after_id is not None:
+        query = query.filter(models.Item.id > after_id)
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.scalars().all()
+
+
+async def create_user_item(db: AsyncSession, item: schemas.ItemCreate, user_id: int):
+    db_item = models.Item(**item.dict(), owner_id=user_id)
+    db.add(db_item)
+    await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(version=models.User.version + 1)
+    )
+    await db.commit()
+    await db.refresh(db_item)
+    return db_item
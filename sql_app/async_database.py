@@ -0,0 +1,36 @@
+import os
+import threading
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+# aiosqlite / asyncpg 等の非同期ドライバが必要なので同期側とはモジュールを分けている
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL", "sqlite+aiosqlite:///./sql_app.db"
+)
+
+_async_engine = None
+_async_engine_lock = threading.Lock()
+AsyncSessionLocal = sessionmaker(
+    class_=AsyncSession,
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+
+def get_async_engine():
+    # database.get_engineと同じく、importではengineを作らない
+    global _async_engine
+    if _async_engine is None:
+        with _async_engine_lock:
+            if _async_engine is None:
+                _async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+                AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
+
+
+def __getattr__(name):
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class _Call:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    同じキーの呼び出しが実行中なら、新しく実行せずにその結果を待って共有する。
+    同期ルートはthreadpoolのスレッドから呼ぶので、threading.Eventで待つ。
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.value
+
+    def forget(self, key):
+        """実行中の呼び出しを切り離し、次の呼び出しは新しく実行させる"""
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._calls.clear()
+            self.calls = self.shared = 0
+
+
+class LRUCache:
+    """
+    TTL付きのLRUキャッシュ。Noneも「存在しない」という結果としてnegative_ttlの間キャッシュする。
+    get_or_loadでミスが重なった時は、同じキーのloaderを1回だけ実行して結果を共有する。
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 60.0,
+        negative_ttl: float = 5.0,
+        timer=time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._flight = SingleFlight()
+        # invalidateの度に上げる。読み込み中に無効化されたら、古い値をキャッシュに入れない
+        self._epoch = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > self.timer():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return MISSING
+
+    def set(self, key, value):
+        with self._lock:
+            self._set(key, value)
+
+    def _set(self, key, value):
+        ttl = self.negative_ttl if value is None else self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._data[key] = (self.timer() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is MISSING:
+            value = self._flight.do(key, lambda: self._load(key, loader))
+        return value
+
+    def _load(self, key, loader):
+        epoch = self._epoch
+        value = loader()
+        with self._lock:
+            if epoch == self._epoch:
+                self._set(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._epoch += 1
+        self._flight.forget(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+            self._epoch += 1
+        self._flight.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "loads": self._flight.calls,
+            "coalesced": self._flight.shared,
+        }
@@ -1,34 +1,327 @@
-from sqlalchemy.orm import Session
+import os
+from enum import Enum
+from typing import List, Tuple, Union
+
+from sqlalchemy import Boolean, bindparam, func, literal, or_, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, lazyload, noload, selectinload
 
 from sql_app import models, schemas
+from sql_app.cache import LRUCache
+
+
+class UserLoad(str, Enum):
+    lazy = "lazy"
+    selectin = "selectin"
+    joined = "joined"
+    noload = "noload"
+
+
+_user_items_loaders = {
+    UserLoad.lazy: lazyload,
+    UserLoad.selectin: selectinload,
+    UserLoad.joined: joinedload,
+    UserLoad.noload: noload,
+}
+
+
+def _query_users(db: Session, load: UserLoad):
+    # lazyのままだとschemas.Userのitemsをシリアライズする際にユーザー毎にSELECTが走る(N+1)
+    return db.query(models.User).options(_user_items_loaders[load](models.User.items))
 
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+
+def get_user(db: Session, user_id: int, load: UserLoad = UserLoad.selectin):
+    return _query_users(db, load).filter(models.User.id == user_id).first()
+
+
+def get_user_version(db: Session, user_id: int):
+    return db.query(models.User.version).filter(models.User.id == user_id).scalar()
+
+
+def _bump_user_version(db: Session, user_id: int):
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {models.User.version: models.User.version + 1}, synchronize_session=False
+    )
 
 
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+
+# プロセス内キャッシュなので、他のworkerでの更新はTTLが切れるまで見えない
+_user_cache_options = {
+    "maxsize": int(os.getenv("USER_CACHE_SIZE", "1024")),
+    "ttl": float(os.getenv("USER_CACHE_TTL", "60")),
+    "negative_ttl": float(os.getenv("USER_CACHE_NEGATIVE_TTL", "5")),
+}
+user_cache = LRUCache(**_user_cache_options)
+user_email_cache = LRUCache(**_user_cache_options)
 
 
-def create_user(db: Session, user: schemas.UserCreate):
-    fake_hashed_password = user.password + "notreallyhashed"
-    db_user = models.User(email=user.email, hashed_password=fake_hashed_password)
+# ORMオブジェクトはセッションを跨げないので、キャッシュにはschemasのスナップショットを入れる
+def get_user_cached(db: Session, user_id: int):
+    def load():
+        db_user = get_user(db, user_id=user_id)
+        return schemas.User.from_orm(db_user) if db_user else None
+
+    return user_cache.get_or_load(user_id, load)
+
+
+def get_user_by_email_cached(db: Session, email: str):
+    def load():
+        db_user = get_user_by_email(db, email=email)
+        return schemas.UserSummary.from_orm(db_user) if db_user else None
+
+    return user_email_cache.get_or_load(email, load)
+
+
+def get_users(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Union[int, None] = None,
+    load: UserLoad = UserLoad.selectin,
+):
+    query = _query_users(db, load).order_by(models.User.id)
+    if after_id is not None:
+        # keyset: 主キーでseekするので深いページでも読み捨てが発生しない
+        query = query.filter(models.User.id > after_id)
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+
+# hashed_passwordはcommon.passwords.password_hasherで作ったもの。
+# emailが既に登録されていればNoneを返す
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
+    db_user = models.User(email=user.email, hashed_password=hashed_password)
     db.add(db_user)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # 事前のチェックの後に他のリクエスト・workerが登録した。
+        # negative cacheが残っているとまた同じ事になるので捨てる
+        db.rollback()
+        user_email_cache.invalidate(user.email)
+        return None
     db.refresh(db_user)
+    # negative cacheを作成したユーザーで置き換える
+    user_cache.set(db_user.id, schemas.User.from_orm(db_user))
+    user_email_cache.set(db_user.email, schemas.UserSummary.from_orm(db_user))
     return db_user
 
 
-def get_items(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Item).offset(skip).limit(limit).all()
+def update_user_password(db: Session, user_id: int, hashed_password: str):
+    # キャッシュしているschemasにはパスワードが入っていないので、無効化もversionの更新も要らない
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {models.User.hashed_password: hashed_password}, synchronize_session=False
+    )
+    db.commit()
+
+
+# SQLiteのバインド変数上限(古いビルドでは999)に収まるように分割する
+BULK_INSERT_CHUNK = 250
+
+
+_upsert_inserts = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def supports_upsert(db: Session) -> bool:
+    return db.get_bind().dialect.name in _upsert_inserts
+
+
+def _upsert_statement(dialect: str, update: bool):
+    table = models.User.__table__
+    insert = _upsert_inserts.get(dialect)
+    if insert is None:
+        raise NotImplementedError(f"upsert is not supported on {dialect}")
+    # is_activeの指定が無い行はNoneで来る。新しい行はTrue、既存の行はそのままにする
+    is_active = bindparam("import_is_active", type_=Boolean)
+    statement = insert(table).values(is_active=func.coalesce(is_active, True))
+    if not update:
+        return statement.on_conflict_do_nothing(index_elements=[table.c.email])
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.email],
+        set_={
+            "is_active": func.coalesce(is_active, table.c.is_active),
+            "hashed_password": func.coalesce(
+                statement.excluded.hashed_password, table.c.hashed_password
+            ),
+            "version": table.c.version + 1,
+        },
+    )
+
+
+def upsert_users(db: Session, users: List[dict], update: bool = False) -> int:
+    """
+    usersをINSERT ... ON CONFLICT(email)のexecutemanyで入れてcommitし、既にいたユーザーの数を返す。
+    updateなら(指定があれば)is_activeとhashed_passwordを上書きしてversionを上げ、
+    そうでなければ既存の行には触れない。sqlite・postgresql以外ではNotImplementedError
+    """
+    table = models.User.__table__
+    emails = [user["email"] for user in users]
+    email_chunks = [
+        emails[start : start + BULK_INSERT_CHUNK]
+        for start in range(0, len(emails), BULK_INSERT_CHUNK)
+    ]
+    existing = sum(
+        db.execute(select(func.count()).where(table.c.email.in_(chunk))).scalar()
+        for chunk in email_chunks
+    )
+    rows = [
+        {
+            "email": user["email"],
+            "hashed_password": user["hashed_password"],
+            "import_is_active": user["is_active"],
+        }
+        for user in users
+    ]
+    # 複数VALUESの1文にするとバッチ毎にコンパイルし直すので、文はキャッシュが効くexecutemanyで流す
+    db.execute(_upsert_statement(db.get_bind().dialect.name, update), rows)
+    db.commit()
+
+    # 「存在しない」というnegative cacheと、上書きした行のキャッシュを捨てる
+    for chunk in email_chunks:
+        for user_id, email in db.execute(
+            select(table.c.id, table.c.email).where(table.c.email.in_(chunk))
+        ):
+            user_cache.invalidate(user_id)
+            user_email_cache.invalidate(email)
+    return existing
+
+
+# 1行ずつORMオブジェクトを作らず、カラムのタプルをbatch_size毎に取り出す
+def iter_users(db: Session, batch_size: int = 1000):
+    query = (
+        select(models.User.id, models.User.email, models.User.is_active)
+        .order_by(models.User.id)
+        .execution_options(yield_per=batch_size)
+    )
+    yield from db.execute(query).partitions()
+
+
+def iter_items(db: Session, batch_size: int = 1000):
+    query = (
+        select(
+            models.Item.id,
+            models.Item.title,
+            models.Item.description,
+            models.Item.owner_id,
+        )
+        .order_by(models.Item.id)
+        .execution_options(yield_per=batch_size)
+    )
+    yield from db.execute(query).partitions()
+
+
+def get_items(
+    db: Session, skip: int = 0, limit: int = 100, after_id: Union[int, None] = None
+):
+    query = db.query(models.Item).order_by(models.Item.id)
+    if after_id is not None:
+        query = query.filter(models.Item.id > after_id)
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+
+_SEARCH_ITEMS_SQL = """
+SELECT items.id, items.title, items.description, items.owner_id,
+       bm25(items_fts) AS score,
+       snippet(items_fts, -1, '<b>', '</b>', '…', 16) AS snippet
+FROM items_fts JOIN items ON items.id = items_fts.rowid
+WHERE items_fts MATCH :query {after}
+ORDER BY score, items.id
+LIMIT :limit
+"""
+_SEARCH_ITEMS_AFTER = (
+    "AND (bm25(items_fts) > :score OR (bm25(items_fts) = :score AND items.id > :after_id))"
+)
+
+
+def _fts_query(q: str):
+    # 入力をそのままMATCHに渡すとAND/OR/NEARや"がFTS5の構文になるので、語毎にフレーズとして引用する
+    return " ".join('"%s"' % term.replace('"', '""') for term in q.split())
+
+
+def search_items(
+    db: Session, q: str, limit: int = 20, after: Union[Tuple[float, int], None] = None
+):
+    """
+    itemsのtitle/descriptionを全文検索する。bm25のスコア(小さい方が良い)順で、snippetに一致箇所を含む。
+    SQLite以外ではFTS5がないので、LIKEの部分一致をid順で返す。
+    """
+    if db.get_bind().dialect.name != "sqlite":
+        return _search_items_like(db, q, limit, after[1] if after else None)
+    query = _fts_query(q)
+    if not query:
+        return []
+    params = {"query": query, "limit": limit}
+    if after is not None:
+        params["score"], params["after_id"] = after
+    sql = _SEARCH_ITEMS_SQL.format(after=_SEARCH_ITEMS_AFTER if after else "")
+    return db.execute(text(sql), params).all()
+
+
+def _search_items_like(db: Session, q: str, limit: int, after_id: Union[int, None]):
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    pattern = f"%{escaped}%"
+    query = select(
+        models.Item.id,
+        models.Item.title,
+        models.Item.description,
+        models.Item.owner_id,
+        literal(0.0).label("score"),
+        models.Item.description.label("snippet"),
+    ).where(
+        or_(
+            models.Item.title.ilike(pattern, escape="\\"),
+            models.Item.description.ilike(pattern, escape="\\"),
+        )
+    )
+    if after_id is not None:
+        query = query.where(models.Item.id > after_id)
+    return db.execute(query.order_by(models.Item.id).limit(limit)).all()
 
 
 def create_user_item(db: Session, item: schemas.ItemCreate, user_id: int):
     db_item = models.Item(**item.dict(), owner_id=user_id)
     db.add(db_item)
+    _bump_user_version(db, user_id)
     db.commit()
     db.refresh(db_item)
-    return db_item
\ No newline at end of file
+    user_cache.invalidate(user_id)
+    return db_item
+
+
+def create_user_items(db: Session, items: List[schemas.ItemCreate], user_id: int):
+    table = models.Item.__table__
+    rows = [{**item.dict(), "owner_id": user_id} for item in items]
+    dialect = db.get_bind().dialect
+    created = []
+    for start in range(0, len(rows), BULK_INSERT_CHUNK):
+        chunk = rows[start : start + BULK_INSERT_CHUNK]
+        if dialect.insert_executemany_returning:
+            result = db.execute(table.insert().returning(*table.c), chunk)
+            created.extend(result.all())
+        elif dialect.name == "sqlite":
+            # 複数VALUESの1文でinsertする。1文の中ではrowidが連番で振られるのでlastrowidから範囲を引ける
+            last_id = db.execute(table.insert().values(chunk)).lastrowid
+            result = db.execute(
+                select(table)
+                .where(table.c.id.between(last_id - len(chunk) + 1, last_id))
+                .order_by(table.c.id)
+            )
+            created.extend(result.all())
+        else:
+            # MySQL等はlastrowidが最初の行のidになる等、範囲を当てにできないので1行ずつ入れる
+            ids = [
+                db.execute(table.insert(), row).inserted_primary_key[0] for row in chunk
+            ]
+            result = db.execute(select(table).where(table.c.id.in_(ids)).order_by(table.c.id))
+            created.extend(result.all())
+    _bump_user_version(db, user_id)
+    db.commit()
+    user_cache.invalidate(user_id)
+    return created
@@ -1,17 +1,218 @@
 import os
+import threading
+import time
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
-from dotenv import load_dotenv
-load_dotenv()
+# backend毎のpool設定。DB_POOL_SIZE等の環境変数で上書きできる
+POOL_PROFILES = {
+    "sqlite": {
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 30,
+        "pool_pre_ping": False,
+        "pool_recycle": -1,
+    },
+    "postgresql": {
+        "pool_size": 10,
+        "max_overflow": 20,
+        "pool_timeout": 30,
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+    },
+}
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
+POOL_ENV = {
+    "pool_size": ("DB_POOL_SIZE", int),
+    "max_overflow": ("DB_MAX_OVERFLOW", int),
+    "pool_timeout": ("DB_POOL_TIMEOUT", float),
+    "pool_pre_ping": ("DB_POOL_PRE_PING", lambda v: v.lower() in ("1", "true", "yes")),
+    "pool_recycle": ("DB_POOL_RECYCLE", int),
+}
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+class TimedQueuePool(QueuePool):
+    """checkout待ち時間を記録するQueuePool"""
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self._stats_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.wait_count += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+def pool_settings(url: str):
+    backend = make_url(url).get_backend_name()
+    settings = dict(POOL_PROFILES.get(backend, POOL_PROFILES["postgresql"]))
+    for key, (env, convert) in POOL_ENV.items():
+        value = os.getenv(env)
+        if value is not None:
+            settings[key] = convert(value)
+    return settings
+
+
+def database_url():
+    # python-dotenvのimportだけで10ms程かかるので、engineを作る時まで遅らせる
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
+
+
+def create_db_engine(url: str = None, **kwargs):
+    url = url or database_url()
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        kwargs.setdefault("connect_args", {"check_same_thread": False})
+        if parsed.database in (None, "", ":memory:"):
+            # in-memoryは接続毎に別DBになるのでpool設定は付けない
+            return create_engine(url, **kwargs)
+    return create_engine(
+        url, poolclass=TimedQueuePool, **{**pool_settings(url), **kwargs}
+    )
+
+
+def sqlite_wal_enabled(url: str):
+    """SQLITE_MODE=walの時、ファイルのSQLiteをWAL + 読み取り専用pool + 単一writerで使う"""
+    parsed = make_url(url)
+    return (
+        os.getenv("SQLITE_MODE", "default").lower() == "wal"
+        and parsed.get_backend_name() == "sqlite"
+        and parsed.database not in (None, "", ":memory:")
+    )
+
+
+def sqlite_pragmas(readonly: bool = False):
+    pragmas = {
+        "journal_mode": "WAL",
+        # WALならNORMALでもコミット済みのデータは壊れない(電源断で直近のコミットが消え得るだけ)
+        "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),
+    }
+    if readonly:
+        pragmas["query_only"] = "ON"
+    return pragmas
+
+
+def apply_sqlite_pragmas(engine, pragmas: dict):
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
+
+
+def pool_status(engine):
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+    status = {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        # QueuePool.overflow()は-pool_sizeから数えるので、超過分だけを返す
+        "overflow": max(pool.overflow(), 0),
+    }
+    if isinstance(pool, TimedQueuePool):
+        status.update(
+            {
+                "wait_count": pool.wait_count,
+                "wait_time_total": pool.wait_total,
+                "wait_time_max": pool.wait_max,
+                "timeouts": pool.timeouts,
+            }
+        )
+    return status
+
+
+# importだけではengineを作らない(.envの読み込みもしない)。最初にget_engine()を呼んだ時に作る
+_engine = None
+_read_engine = None
+_engine_lock = threading.Lock()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+
+
+def get_engine():
+    """書き込み用のengine。WALモードでは接続1本のpoolで書き込みを直列にする"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                url = database_url()
+                if sqlite_wal_enabled(url):
+                    _engine = apply_sqlite_pragmas(
+                        create_db_engine(url, pool_size=1, max_overflow=0),
+                        sqlite_pragmas(),
+                    )
+                else:
+                    _engine = create_db_engine(url)
+                SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def get_read_engine():
+    """読み取り専用のengine。WALモード以外では書き込み用と同じものを返す"""
+    global _read_engine
+    if _read_engine is None:
+        engine = get_engine()
+        with _engine_lock:
+            if _read_engine is None:
+                url = database_url()
+                if sqlite_wal_enabled(url):
+                    _read_engine = apply_sqlite_pragmas(
+                        create_db_engine(
+                            url,
+                            pool_size=int(os.getenv("DB_READ_POOL_SIZE", "5")),
+                            max_overflow=int(os.getenv("DB_READ_MAX_OVERFLOW", "10")),
+                        ),
+                        sqlite_pragmas(readonly=True),
+                    )
+                else:
+                    _read_engine = engine
+    return _read_engine
+
+
+def dispose_engines():
+    global _engine, _read_engine
+    with _engine_lock:
+        if _read_engine is not None and _read_engine is not _engine:
+            _read_engine.dispose()
+        if _engine is not None:
+            _engine.dispose()
+        _engine = _read_engine = None
+        SessionLocal.configure(bind=None)
+
+
+def __getattr__(name):
+    # `from sql_app.database import engine` はここでengineを作る
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+Base = declarative_base()
@@ -0,0 +1,39 @@
+import csv
+import io
+import json
+from enum import Enum
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+media_types = {
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.csv: "text/csv",
+}
+
+
+def ndjson_chunks(partitions):
+    for rows in partitions:
+        yield "".join(json.dumps(dict(row._mapping)) + "\n" for row in rows)
+
+
+def csv_chunks(partitions, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for rows in partitions:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_chunks(partitions, format: ExportFormat, fields):
+    if format == ExportFormat.csv:
+        return csv_chunks(partitions, fields)
+    return ndjson_chunks(partitions)
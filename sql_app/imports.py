@@ -0,0 +1,169 @@
+import csv
+import io
+import json
+from enum import Enum
+from typing import BinaryIO, Callable, Iterator, List, Tuple, Union
+
+from sqlalchemy.orm import Session
+
+from common.passwords import password_hasher
+from sql_app import crud
+
+
+class ImportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+class OnConflict(str, Enum):
+    ignore = "ignore"
+    update = "update"
+
+
+class InvalidImport(ValueError):
+    pass
+
+
+_extensions = {
+    ".csv": ImportFormat.csv,
+    ".ndjson": ImportFormat.ndjson,
+    ".jsonl": ImportFormat.ndjson,
+}
+_content_types = {
+    "text/csv": ImportFormat.csv,
+    "application/x-ndjson": ImportFormat.ndjson,
+    "application/jsonl": ImportFormat.ndjson,
+}
+
+
+def detect_format(filename: Union[str, None], content_type: Union[str, None]):
+    for extension, format in _extensions.items():
+        if filename and filename.lower().endswith(extension):
+            return format
+    return _content_types.get((content_type or "").split(";")[0].strip())
+
+
+_TRUE = {"true", "1", "yes"}
+_FALSE = {"false", "0", "no"}
+
+
+def normalize_row(raw) -> dict:
+    """
+    1行を{email, is_active, password}にする。不正ならValueError。
+    is_activeが無ければNone(新規はTrue、updateでは既存の値のまま)
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("row must be an object")
+    email = raw.get("email")
+    if not isinstance(email, str) or "@" not in email.strip():
+        raise ValueError("invalid email")
+    is_active = raw.get("is_active")
+    if is_active is None or is_active == "":
+        is_active = None
+    elif isinstance(is_active, str) and is_active.lower() in _TRUE | _FALSE:
+        is_active = is_active.lower() in _TRUE
+    elif not isinstance(is_active, bool):
+        raise ValueError("invalid is_active")
+    password = raw.get("password") or None
+    if password is not None and not isinstance(password, str):
+        raise ValueError("invalid password")
+    return {"email": email.strip(), "is_active": is_active, "password": password}
+
+
+def _csv_rows(text) -> Iterator[Tuple[int, object]]:
+    reader = csv.DictReader(text)
+    if reader.fieldnames is None or "email" not in reader.fieldnames:
+        raise InvalidImport("CSV header must contain an email column")
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _ndjson_rows(text) -> Iterator[Tuple[int, object]]:
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, ValueError("invalid JSON")
+
+
+def parse_rows(file: BinaryIO, format: ImportFormat) -> Iterator[Tuple[int, object]]:
+    """
+    アップロードされたファイルを先頭から少しずつ読み、(行番号, dict)を返す。
+    読めない行は(行番号, ValueError)、壊れたUTF-8やCSVに当たった所で打ち切る
+    """
+    # BOM付きのUTF-8(Excelが書き出すCSV)も読めるようにする
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    rows = _csv_rows(text) if format == ImportFormat.csv else _ndjson_rows(text)
+    line_number = 0
+    try:
+        for line_number, row in rows:
+            yield line_number, row
+    except (UnicodeDecodeError, csv.Error) as e:
+        yield line_number + 1, ValueError(f"unreadable file: {e}")
+    finally:
+        # UploadFileのファイルはFastAPIが閉じるので、TextIOWrapperからは切り離す
+        text.detach()
+
+
+def import_users(
+    db: Session,
+    file: BinaryIO,
+    format: ImportFormat,
+    on_conflict: OnConflict = OnConflict.ignore,
+    batch_size: int = 1000,
+    hash_many: Callable[[List[str]], List[str]] = None,
+    max_errors: int = 100,
+) -> dict:
+    """
+    batch_size行毎にINSERT ... ON CONFLICTを1回流してcommitする。
+    ファイル内の重複はignoreなら最初の行、updateなら最後の行が残る。
+    errorsは先頭のmax_errors件だけを持ち、件数はfailedで数える
+    """
+    report = {
+        "rows": 0,
+        "inserted": 0,
+        "updated": 0,
+        "skipped": 0,
+        "failed": 0,
+        "batches": 0,
+        "errors": [],
+    }
+    hash_many = hash_many or password_hasher.hash_many
+    batch = {}
+
+    def flush():
+        users = list(batch.values())
+        batch.clear()
+        passwords = [user.pop("password") for user in users]
+        to_hash = [password for password in passwords if password is not None]
+        hashed = iter(hash_many(to_hash) if to_hash else [])
+        for user, password in zip(users, passwords):
+            user["hashed_password"] = next(hashed) if password is not None else None
+        existing = crud.upsert_users(db, users, update=on_conflict == OnConflict.update)
+        report["inserted"] += len(users) - existing
+        report["updated" if on_conflict == OnConflict.update else "skipped"] += existing
+        report["batches"] += 1
+
+    for line_number, raw in parse_rows(file, format):
+        report["rows"] += 1
+        try:
+            if isinstance(raw, Exception):
+                raise raw
+            user = normalize_row(raw)
+        except ValueError as e:
+            report["failed"] += 1
+            if len(report["errors"]) < max_errors:
+                report["errors"].append({"line": line_number, "error": str(e)})
+            continue
+        if user["email"] in batch:
+            report["skipped"] += 1
+            if on_conflict == OnConflict.ignore:
+                continue
+        batch[user["email"]] = user
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return report
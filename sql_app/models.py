@@ -1,4 +1,14 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String
+from sqlalchemy import (
+    DDL,
+    Boolean,
+    Column,
+    ForeignKey,
+    Integer,
+    String,
+    event,
+    inspect,
+    text,
+)
 from sqlalchemy.orm import relationship
 
 from .database import Base
@@ -11,6 +21,8 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     is_active = Column(Boolean, default=True)
+    # ユーザーかそのitemsが変わる度に上げる。ETagに使う
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     items = relationship("Item", back_populates="owner")
 
@@ -20,7 +32,53 @@ class Item(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
-    description = Column(String, index=True)
+    # 部分一致の検索はitems_ftsで行うので、descriptionのB-treeインデックスは持たない
+    description = Column(String)
     owner_id = Column(Integer, ForeignKey("users.id"))
 
-    owner = relationship("User", back_populates="items")
\ No newline at end of file
+    owner = relationship("User", back_populates="items")
+
+
+# SQLiteではitemsの全文検索用にFTS5のテーブルを持ち、トリガーで同期する(external content)
+ITEMS_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5("
+    "title, description, content='items', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN "
+    "INSERT INTO items_fts(rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN "
+    "INSERT INTO items_fts(items_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE ON items BEGIN "
+    "INSERT INTO items_fts(items_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO items_fts(rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); END",
+]
+
+for statement in ITEMS_FTS_DDL:
+    event.listen(
+        Item.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite")
+    )
+# トリガーはitemsと一緒に消える
+event.listen(
+    Item.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS items_fts").execute_if(dialect="sqlite"),
+)
+
+
+def init_db(conn):
+    Base.metadata.create_all(bind=conn)
+    # versionカラム追加前に作られたDB(sql_app.db)を移行する
+    columns = {column["name"] for column in inspect(conn).get_columns("users")}
+    if "version" not in columns:
+        conn.execute(
+            text("ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        )
+    conn.execute(text("DROP INDEX IF EXISTS ix_items_description"))
+    # FTS5を入れる前に作られたitemsには、テーブルとトリガーを足して既存の行を索引する
+    if conn.dialect.name == "sqlite" and not inspect(conn).has_table("items_fts"):
+        for statement in ITEMS_FTS_DDL:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO items_fts(items_fts) VALUES ('rebuild')"))
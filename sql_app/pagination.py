@@ -0,0 +1,68 @@
+import base64
+import binascii
+from typing import Tuple, Union
+
+from fastapi import HTTPException
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode(value: str) -> str:
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+
+def _decode(cursor: str) -> str:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        return base64.urlsafe_b64decode(padded.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def encode_cursor(last_id: int) -> str:
+    return _encode(str(last_id))
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(_decode(cursor))
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+# 検索結果はスコア順なので、(スコア, id)の組でseekする
+def encode_search_cursor(score: float, last_id: int) -> str:
+    return _encode(f"{score!r}:{last_id}")
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    score, _, last_id = _decode(cursor).partition(":")
+    try:
+        return float(score), int(last_id)
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+# m.py・m_async.pyの一覧ルートで?cursor=を受け取るDependency
+def get_after_id(cursor: Union[str, None] = None):
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def next_cursor(rows, limit: int):
+    # 1ページ分埋まっていなければ次はない
+    if limit <= 0 or len(rows) < limit:
+        return None
+    return encode_cursor(rows[-1].id)
+
+
+def next_search_cursor(rows, limit: int):
+    if limit <= 0 or len(rows) < limit:
+        return None
+    return encode_search_cursor(rows[-1].score, rows[-1].id)
@@ -16,15 +16,43 @@ class Item(ItemBase):
     class Config:
         orm_mode = True
 
+class ItemSearchResult(Item):
+    score: float
+    snippet: Union[str, None] = None
+
 class UserBase(BaseModel):
     email: str
 
 class UserCreate(UserBase):
     password: str
 
+class UserLogin(UserBase):
+    password: str
+
+class UserImportError(BaseModel):
+    line: int
+    error: str
+
+class UserImportReport(BaseModel):
+    rows: int
+    inserted: int
+    updated: int
+    skipped: int
+    failed: int
+    batches: int
+    errors: List[UserImportError] = []
+
+class UserSummary(UserBase):
+    id: int
+    is_active: bool
+
+    class Config:
+        orm_mode = True
+
 class User(UserBase):
     id: int
     is_active: bool
+    version: int
     items: List[Item] = []
 
     class Config:
@@ -0,0 +1,202 @@
+import asyncio
+import threading
+import time
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from common.admission import AdmissionController, Lane, TokenBucket, setup_admission
+
+
+def make_app(**options):
+    app = FastAPI()
+    controller = setup_admission(app, **options)
+    running = {"now": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def work(seconds):
+        with lock:
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+        time.sleep(seconds)
+        with lock:
+            running["now"] -= 1
+
+    @app.get("/slow")
+    def slow(seconds: float = 0.05):
+        work(seconds)
+        return {}
+
+    @app.post("/slow")
+    def slow_write(seconds: float = 0.05):
+        work(seconds)
+        return {}
+
+    @app.get("/fast")
+    async def fast():
+        return {}
+
+    return app, controller, running
+
+
+async def load(app, requests):
+    """(method, path, headers)を全部同時に投げ、(status, Retry-After, 秒)を返す"""
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+
+        async def one(method, path, headers):
+            start = time.perf_counter()
+            response = await client.request(method, path, headers=headers)
+            return (
+                response.status_code,
+                response.headers.get("retry-after"),
+                time.perf_counter() - start,
+            )
+
+        return await asyncio.gather(*(one(*request) for request in requests))
+
+
+def test_sheds_when_queue_is_full():
+    app, controller, running = make_app(capacity=4, read_queue=8, queue_timeout=10)
+    results = asyncio.run(load(app, [("GET", "/slow", {})] * 50))
+
+    statuses = [status for status, _, _ in results]
+    assert statuses.count(200) == 12
+    assert statuses.count(503) == 38
+    assert running["peak"] <= 4
+    # 溢れた分は待たずにすぐ返り、Retry-Afterが付く
+    shed = [(retry, seconds) for status, retry, seconds in results if status == 503]
+    assert all(int(retry) >= 1 for retry, _ in shed)
+    assert max(seconds for _, seconds in shed) < 0.05
+    lane = controller.stats()["lanes"]["read"]
+    assert (lane["admitted"], lane["shed"], lane["active"], lane["queued"]) == (12, 38, 0, 0)
+
+
+def test_queue_timeout():
+    app, controller, _ = make_app(capacity=1, read_queue=10, queue_timeout=0.05)
+    results = asyncio.run(load(app, [("GET", "/slow?seconds=0.2", {})] * 3))
+    assert sorted(status for status, _, _ in results) == [200, 503, 503]
+    assert controller.stats()["lanes"]["read"]["timeout"] == 2
+
+
+def test_writes_cannot_take_every_slot():
+    app, _, _ = make_app(capacity=4, write_limit=2, write_queue=0, queue_timeout=10)
+    results = asyncio.run(
+        load(app, [("POST", "/slow?seconds=0.1", {})] * 6 + [("GET", "/slow", {})] * 2)
+    )
+    writes, reads = results[:6], results[6:]
+    assert [status for status, _, _ in writes].count(200) == 2
+    # 読み取りは書き込みの後ろに並ばない
+    assert all(status == 200 and seconds < 0.1 for status, _, seconds in reads)
+
+
+def test_reads_are_woken_before_writes():
+    async def run():
+        controller = AdmissionController(
+            1, [Lane("read", 1, 10), Lane("write", 1, 10)], queue_timeout=1
+        )
+        read, write = controller.lanes["read"], controller.lanes["write"]
+        assert await controller.acquire(write)
+        order = []
+
+        async def wait(lane):
+            await controller.acquire(lane)
+            order.append(lane.name)
+            controller.release(lane, 0)
+
+        tasks = [asyncio.create_task(wait(lane)) for lane in (write, read, read)]
+        await asyncio.sleep(0)
+        controller.release(write, 0)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["read", "read", "write"]
+
+
+def test_cancelled_after_grant_releases_slot():
+    async def run():
+        controller = AdmissionController(1, [Lane("read", 1, 10)], queue_timeout=1)
+        lane = controller.lanes["read"]
+        assert await controller.acquire(lane)
+        task = asyncio.create_task(controller.acquire(lane))
+        await asyncio.sleep(0)
+        # 枠を渡した直後、待っていた側が起きる前にキャンセルする
+        controller.release(lane, 0)
+        task.cancel()
+        try:
+            if await task:
+                controller.release(lane, 0)
+        except asyncio.CancelledError:
+            pass
+        return controller.active, lane.active
+
+    assert asyncio.run(run()) == (0, 0)
+
+
+def test_match_is_cached_by_path():
+    app, controller, _ = make_app()
+    client = TestClient(app)
+    app.middleware_stack = middleware = app.build_middleware_stack()
+    while not hasattr(middleware, "_match"):
+        middleware = middleware.app
+    calls = []
+    lookup = middleware._lookup
+    middleware._lookup = lambda scope: calls.append(scope["path"]) or lookup(scope)
+
+    for _ in range(3):
+        client.get("/slow?seconds=0")
+        client.get("/fast")
+    assert calls == ["/slow", "/fast"]
+    assert controller.stats()["lanes"]["read"]["admitted"] == 3
+
+    @app.get("/added")
+    def added():
+        return {}
+
+    # ルートが増えたらキャッシュを捨てて引き直す
+    client.get("/slow?seconds=0")
+    assert calls == ["/slow", "/fast", "/slow"]
+
+
+def test_async_routes_are_not_admitted():
+    app, controller, _ = make_app(capacity=1, read_queue=0)
+    results = asyncio.run(load(app, [("GET", "/fast", {})] * 20))
+    assert {status for status, _, _ in results} == {200}
+    assert controller.stats()["lanes"]["read"]["admitted"] == 0
+
+
+def test_token_bucket_per_client():
+    app, controller, _ = make_app(rate=1, burst=2)
+
+    async def run(host, tokens):
+        transport = httpx.ASGITransport(app=app, client=(host, 1234))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [
+                await client.get("/slow?seconds=0", headers={"X-Token": token})
+                for token in tokens
+            ]
+
+    # X-Tokenを毎回変えても同じ接続元なら同じバケツ
+    responses = asyncio.run(run("10.0.0.1", ["a", "b", "c", "d"]))
+    assert [r.status_code for r in responses] == [200, 200, 429, 429]
+    assert responses[3].headers["retry-after"] == "1"
+    # 別の接続元は別のバケツ
+    assert asyncio.run(run("10.0.0.2", ["a"]))[0].status_code == 200
+    assert controller.throttled == 2
+
+
+def test_token_bucket_refill():
+    bucket = TokenBucket(rate=2, burst=1, max_keys=2)
+    assert bucket.take("a", now=0) == 0
+    assert bucket.take("a", now=0.1) == 0.4
+    assert bucket.take("a", now=0.5) == 0
+    bucket.take("b", now=0.5)
+    bucket.take("a", now=0.6)
+    bucket.take("c", now=0.6)
+    # 溢れたら一番長く使われていないバケツを捨てる
+    assert list(bucket._buckets) == ["a", "c"]
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setenv("ADMISSION_CONTROL", "false")
+    assert setup_admission(FastAPI()) is None
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from pydantic import ValidationError
+
+from common.batch import SubRequest, SubResponse, dispatch, run_batch
+from common.compression import CompressionMiddleware
+
+app = FastAPI()
+active = 0
+peak = 0
+
+
+@app.get("/slow")
+async def slow(n: int):
+    global active, peak
+    active += 1
+    peak = max(peak, active)
+    await asyncio.sleep(0.01)
+    active -= 1
+    return {"n": n}
+
+
+@app.get("/text", response_class=PlainTextResponse)
+async def text():
+    return "hello"
+
+
+compressed = FastAPI()
+compressed.add_middleware(CompressionMiddleware, minimum_size=1)
+
+
+@compressed.post("/echo")
+async def echo(request: Request):
+    return {
+        "headers": [[k.decode(), v.decode()] for k, v in request.scope["headers"]],
+        "body": (await request.body()).decode(),
+    }
+
+
+def test_run_batch_caps_concurrency_and_keeps_order():
+    requests = [SubRequest(path=f"/slow?n={i}") for i in range(20)]
+    results = asyncio.run(run_batch(app, {"type": "http"}, requests, concurrency=4))
+    assert [r.body for r in results] == [{"n": i} for i in range(20)]
+    assert peak == 4
+
+
+def test_run_batch_passes_through_responses():
+    ready = SubResponse(status=400, body={"detail": "no"})
+    results = asyncio.run(
+        run_batch(app, {"type": "http"}, [SubRequest(path="/text"), ready], concurrency=2)
+    )
+    assert results[0].status == 200
+    assert results[0].body == "hello"
+    assert results[1] is ready
+
+
+def test_dispatch_rewrites_length_and_encoding_headers():
+    sub = SubRequest(
+        method="POST",
+        path="/echo",
+        headers={"Accept-Encoding": "gzip", "Content-Length": "999"},
+        body={"a": 1},
+    )
+    response = asyncio.run(dispatch(compressed, {"type": "http"}, sub))
+    # 圧縮されずにJSONとして読める
+    assert response.status == 200
+    assert "content-encoding" not in response.headers
+    headers = response.body["headers"]
+    assert [v for k, v in headers if k == "content-length"] == ["8"]
+    assert not any(k == "accept-encoding" for k, _ in headers)
+    assert response.body["body"] == '{"a": 1}'
+
+
+def test_sub_request_headers_must_be_latin1():
+    with pytest.raises(ValidationError):
+        SubRequest(path="/text", headers={"X-Note": "\u20ac"})
+    with pytest.raises(ValidationError):
+        SubRequest(path="/text", headers={"X-\u20ac": "1"})
+    assert SubRequest(path="/text", headers={"X-Note": "caf\u00e9"}).headers == {
+        "X-Note": "caf\u00e9"
+    }
@@ -0,0 +1,29 @@
+import asyncio
+
+from benchmarks import routes
+
+
+def test_every_route_has_a_case():
+    routes.check_coverage(routes.CASES)
+
+
+def test_cases_return_expected_status():
+    # 期待と違うステータスが返るとrun_caseがRuntimeErrorを投げる
+    with routes.isolated_state():
+        results = asyncio.run(routes.run(routes.CASES, iterations=2, warmup=1))
+    assert set(results) == {case.name for case in routes.CASES}
+    assert all(result["requests"] == 2 for result in results.values())
+
+
+def test_compare_reports_regressions():
+    baseline = {"a": {"p99_ms": 10.0, "throughput": 100.0}}
+    assert routes.compare({"a": {"p99_ms": 12.0, "throughput": 90.0}}, baseline, 0.25) == []
+    regressions = routes.compare(
+        {"a": {"p99_ms": 13.0, "throughput": 70.0}, "new": {"p99_ms": 1, "throughput": 1}},
+        baseline,
+        0.25,
+    )
+    assert regressions == [
+        "a: p99 10.00ms -> 13.00ms",
+        "a: throughput 100/s -> 70/s",
+    ]
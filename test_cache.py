@@ -0,0 +1,143 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from sql_app.cache import MISSING, LRUCache, SingleFlight
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.stats() == {
+        "size": 2,
+        "maxsize": 2,
+        "hits": 2,
+        "misses": 1,
+        "evictions": 1,
+        "loads": 0,
+        "coalesced": 0,
+    }
+
+
+def test_ttl_and_negative_ttl():
+    timer = FakeTimer()
+    cache = LRUCache(ttl=10, negative_ttl=1, timer=timer)
+    cache.set("user", {"id": 1})
+    cache.set("nobody", None)
+    timer.now = 2
+    assert cache.get("user") == {"id": 1}
+    assert cache.get("nobody") is MISSING
+    timer.now = 11
+    assert cache.get("user") is MISSING
+
+
+def test_get_or_load_caches_none():
+    calls = []
+    cache = LRUCache()
+
+    def loader():
+        calls.append(1)
+        return None
+
+    assert cache.get_or_load("k", loader) is None
+    assert cache.get_or_load("k", loader) is None
+    assert len(calls) == 1
+    cache.invalidate("k")
+    cache.get_or_load("k", loader)
+    assert len(calls) == 2
+
+
+def run_concurrently(n, fn):
+    barrier = threading.Barrier(n)
+
+    def call():
+        barrier.wait()
+        return fn()
+
+    with ThreadPoolExecutor(n) as pool:
+        futures = [pool.submit(call) for _ in range(n)]
+    return futures
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.05)
+        return {"id": 1}
+
+    futures = run_concurrently(20, lambda: flight.do("k", load))
+    assert len(calls) == 1
+    assert all(future.result() == {"id": 1} for future in futures)
+    assert (flight.calls, flight.shared) == (1, 19)
+    # 終わった後の呼び出しは新しく実行する
+    flight.do("k", load)
+    assert len(calls) == 2
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+
+    def load():
+        time.sleep(0.05)
+        raise ValueError("boom")
+
+    futures = run_concurrently(5, lambda: flight.do("k", load))
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result()
+    assert flight.calls == 1
+
+
+def test_get_or_load_coalesces_misses():
+    cache = LRUCache()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return "value"
+
+    futures = run_concurrently(10, lambda: cache.get_or_load("k", loader))
+    assert [future.result() for future in futures] == ["value"] * 10
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats["misses"], stats["loads"], stats["coalesced"]) == (10, 1, 9)
+
+
+def test_get_or_load_skips_value_invalidated_while_loading():
+    cache = LRUCache()
+    loading = threading.Event()
+    release = threading.Event()
+
+    def loader():
+        loading.set()
+        release.wait()
+        return "old"
+
+    thread = threading.Thread(target=cache.get_or_load, args=("k", loader))
+    thread.start()
+    loading.wait()
+    cache.invalidate("k")
+    # 無効化の後に来た呼び出しは実行中の読み込みを待たない
+    assert cache.get_or_load("k", lambda: "new") == "new"
+    release.set()
+    thread.join()
+    assert cache.get("k") == "new"
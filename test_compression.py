@@ -0,0 +1,91 @@
+import gzip
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from common.compression import (
+    CompressionMiddleware,
+    _GzipCompressor,
+    negotiate_encoding,
+)
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+
+@app.get("/small")
+def small():
+    return PlainTextResponse("x" * 99)
+
+
+@app.get("/large")
+def large():
+    return PlainTextResponse("x" * 1000)
+
+
+@app.get("/tagged")
+def tagged():
+    return PlainTextResponse("x" * 1000, headers={"ETag": '"abc"'})
+
+
+@app.get("/stream")
+def stream():
+    return StreamingResponse(iter([b"a" * 10, b"b" * 10]), media_type="text/plain")
+
+
+client = TestClient(app)
+
+
+def test_negotiate_encoding():
+    assert negotiate_encoding("gzip, deflate", ("br", "gzip")) == "gzip"
+    assert negotiate_encoding("gzip;q=0.5, br", ("br", "gzip")) == "br"
+    assert negotiate_encoding("br;q=0.1, gzip;q=0.8", ("br", "gzip")) == "gzip"
+    assert negotiate_encoding("gzip;q=0", ("gzip",)) is None
+    assert negotiate_encoding("*", ("gzip",)) == "gzip"
+    assert negotiate_encoding("identity", ("gzip",)) is None
+    assert negotiate_encoding("", ("gzip",)) is None
+
+
+def test_below_minimum_size_is_not_compressed():
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+
+
+def test_compressed_response():
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < 1000
+    assert response.text == "x" * 1000
+
+
+def test_not_compressed_without_accept_encoding():
+    response = client.get("/large", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-length"] == "1000"
+
+
+def test_compressed_response_has_weak_etag():
+    response = client.get("/tagged", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == 'W/"abc"'
+    response = client.get("/tagged", headers={"Accept-Encoding": "identity"})
+    assert response.headers["etag"] == '"abc"'
+
+
+def test_streaming_response_is_compressed():
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.text == "a" * 10 + "b" * 10
+
+
+def test_gzip_output_is_deterministic():
+    # ETagを持つレスポンスでも同じ入力なら同じ圧縮結果になる
+    outputs = []
+    for _ in range(2):
+        compressor = _GzipCompressor(6)
+        outputs.append(compressor.compress(b"x" * 1000) + compressor.finish())
+    assert outputs[0] == outputs[1]
+    assert gzip.decompress(outputs[0]) == b"x" * 1000
@@ -0,0 +1,74 @@
+import time
+
+from common import logwriter
+from common.logwriter import BatchedLogWriter
+
+
+def test_flush_on_batch_size(tmp_path):
+    path = tmp_path / "log.txt"
+    writer = BatchedLogWriter(str(path), batch_size=2, flush_interval=60)
+    writer.write("a\n")
+    writer.write("b\n")
+    for _ in range(100):
+        if writer.flushes:
+            break
+        time.sleep(0.01)
+    assert path.read_text() == "a\nb\n"
+    writer.write("c\n")
+    writer.stop()
+    assert path.read_text() == "a\nb\nc\n"
+    assert writer.flushes == 2
+
+
+def test_flush_on_interval(tmp_path):
+    path = tmp_path / "log.txt"
+    writer = BatchedLogWriter(str(path), flush_interval=0.05)
+    writer.write("a\n")
+    time.sleep(0.3)
+    assert path.read_text() == "a\n"
+    writer.stop()
+
+
+def test_rotate(tmp_path):
+    path = tmp_path / "log.txt"
+    writer = BatchedLogWriter(str(path), batch_size=1, max_bytes=4, backup_count=2)
+    for line in ["aaaa\n", "bbbb\n", "cccc\n", "dddd\n"]:
+        writer.write(line)
+    writer.stop()
+    assert path.read_text() == ""
+    assert (tmp_path / "log.txt.1").read_text() == "dddd\n"
+    assert (tmp_path / "log.txt.2").read_text() == "cccc\n"
+    assert not (tmp_path / "log.txt.3").exists()
+
+
+def test_rotate_on_stop_closes_files(tmp_path, monkeypatch):
+    opened = []
+
+    def tracking_open(*args, **kwargs):
+        opened.append(open(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(logwriter, "open", tracking_open, raising=False)
+    path = tmp_path / "log.txt"
+    writer = BatchedLogWriter(str(path), flush_interval=60, max_bytes=4)
+    writer.write("aaaa\n")
+    # stop()の最後のflushでローテートしても、開き直したファイルを閉じる
+    writer.stop()
+    assert (tmp_path / "log.txt.1").read_text() == "aaaa\n"
+    assert len(opened) == 2
+    assert all(f.closed for f in opened)
+
+
+def test_write_after_stop_is_synchronous(tmp_path):
+    path = tmp_path / "log.txt"
+    writer = BatchedLogWriter(str(path), flush_interval=60)
+    writer.write("a\n")
+    writer.stop()
+    writer.write("b\n")
+    # スレッドを起こさずにその場で書く
+    assert writer._thread is None
+    assert path.read_text() == "a\nb\n"
+    writer.start()
+    writer.write("c\n")
+    writer.stop()
+    assert path.read_text() == "a\nb\nc\n"
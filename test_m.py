@@ -0,0 +1,704 @@
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import m
+from common.passwords import password_hasher
+from common.testing import call_asgi, traced_peak
+from m import app, get_db, get_read_db
+from sql_app import crud, models
+from sql_app.database import Base
+from sql_app.imports import ImportFormat, import_users
+from sql_app.testing import assert_query_count, count_queries
+
+engine = create_engine(
+    "sqlite://",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def override_get_db():
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def reset_db():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    crud.user_cache.clear()
+    crud.user_email_cache.clear()
+    yield
+
+
+def create_users(n):
+    for i in range(n):
+        response = client.post(
+            "/users/", json={"email": f"user{i}@example.com", "password": "secret"}
+        )
+        assert response.status_code == 200
+
+
+def test_create_user():
+    response = client.post(
+        "/users/", json={"email": "deadpool@example.com", "password": "chimichangas4life"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["email"] == "deadpool@example.com"
+    assert data["items"] == []
+
+    response = client.get(f"/users/{data['id']}")
+    assert response.status_code == 200
+    assert response.json()["email"] == "deadpool@example.com"
+
+
+def stored_password(email):
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT hashed_password FROM users WHERE email = :email"), {"email": email}
+        ).scalar()
+
+
+def test_create_user_stores_kdf_hash():
+    create_users(1)
+    stored = stored_password("user0@example.com")
+    assert stored.startswith("scrypt$n=16384,r=8,p=1$")
+    assert password_hasher.verify("secret", stored)
+
+
+def test_login():
+    create_users(1)
+    response = client.post("/login/", json={"email": "user0@example.com", "password": "secret"})
+    assert response.status_code == 200
+    assert response.json() == {"email": "user0@example.com", "id": 1, "is_active": True}
+    for email, password in (("user0@example.com", "wrong"), ("nobody@example.com", "secret")):
+        response = client.post("/login/", json={"email": email, "password": password})
+        assert response.status_code == 401
+
+
+def test_signup_and_login_go_through_admission():
+    lane = m.admission.lanes["write"]
+    admitted = lane.stats["admitted"]
+    create_users(1)
+    client.post("/login/", json={"email": "user0@example.com", "password": "secret"})
+    # async defでもget_dbでthreadpoolのセッションを持つので書き込みレーンで数える
+    assert lane.stats["admitted"] == admitted + 2
+    assert lane.active == 0
+
+
+def test_kdf_runs_without_a_checked_out_connection(monkeypatch):
+    checked_out = [0]
+    seen = []
+    listeners = {
+        "checkout": lambda *args: checked_out.__setitem__(0, checked_out[0] + 1),
+        "checkin": lambda *args: checked_out.__setitem__(0, checked_out[0] - 1),
+    }
+    for name, listener in listeners.items():
+        event.listen(engine, name, listener)
+
+    def recording(method):
+        async def kdf(*args):
+            seen.append(checked_out[0])
+            return await method(*args)
+
+        return kdf
+
+    monkeypatch.setattr(password_hasher, "hash_async", recording(password_hasher.hash_async))
+    monkeypatch.setattr(
+        password_hasher, "verify_and_update", recording(password_hasher.verify_and_update)
+    )
+    try:
+        create_users(1)
+        for email in ("user0@example.com", "nobody@example.com"):
+            client.post("/login/", json={"email": email, "password": "secret"})
+    finally:
+        for name, listener in listeners.items():
+            event.remove(engine, name, listener)
+    # KDFを待っている間は接続をpoolに返している(WALでは書き込み用の1本を塞がない)
+    assert seen == [0, 0, 0]
+
+
+def test_login_rehashes_when_parameters_change(monkeypatch):
+    create_users(1)
+    before = stored_password("user0@example.com")
+    monkeypatch.setattr(password_hasher, "params", (2 ** 8, 8, 1))
+    response = client.post("/login/", json={"email": "user0@example.com", "password": "secret"})
+    assert response.status_code == 200
+    after = stored_password("user0@example.com")
+    assert after != before and after.startswith("scrypt$n=256,r=8,p=1$")
+    # 次のログインでは保存し直さない
+    client.post("/login/", json={"email": "user0@example.com", "password": "secret"})
+    assert stored_password("user0@example.com") == after
+
+
+def test_login_upgrades_legacy_hash():
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO users (email, hashed_password, is_active)"
+                " VALUES (:email, :password, 1)"
+            ),
+            {"email": "old@example.com", "password": "secretnotreallyhashed"},
+        )
+    response = client.post("/login/", json={"email": "old@example.com", "password": "secret"})
+    assert response.status_code == 200
+    assert stored_password("old@example.com").startswith("scrypt$")
+
+
+def test_read_users_cursor_pagination():
+    create_users(5)
+    response = client.get("/users/", params={"limit": 2})
+    assert [u["email"] for u in response.json()] == [
+        "user0@example.com",
+        "user1@example.com",
+    ]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get("/users/", params={"limit": 2, "cursor": cursor})
+    assert [u["email"] for u in response.json()] == [
+        "user2@example.com",
+        "user3@example.com",
+    ]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get("/users/", params={"limit": 2, "cursor": cursor})
+    assert [u["email"] for u in response.json()] == ["user4@example.com"]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_read_users_skip_limit():
+    create_users(3)
+    response = client.get("/users/", params={"skip": 1, "limit": 1})
+    assert [u["email"] for u in response.json()] == ["user1@example.com"]
+
+
+def test_read_items_cursor_pagination():
+    create_users(1)
+    for i in range(3):
+        client.post("/users/1/items/", json={"title": f"item{i}"})
+    response = client.get("/items/", params={"limit": 2})
+    assert [i["title"] for i in response.json()] == ["item0", "item1"]
+    response = client.get(
+        "/items/", params={"limit": 2, "cursor": response.headers["X-Next-Cursor"]}
+    )
+    assert [i["title"] for i in response.json()] == ["item2"]
+
+
+def test_read_users_invalid_cursor():
+    response = client.get("/users/", params={"cursor": "!!!"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+def create_users_with_items(n, items_per_user=2):
+    create_users(n)
+    for user_id in range(1, n + 1):
+        for i in range(items_per_user):
+            client.post(f"/users/{user_id}/items/", json={"title": f"item{i}"})
+
+
+@pytest.mark.parametrize("n", [3, 10])
+def test_read_users_constant_query_count(n):
+    create_users_with_items(n)
+    # SELECT users + SELECT items(selectin)
+    with assert_query_count(engine, 2):
+        response = client.get("/users/")
+    assert len(response.json()) == n
+    assert all(len(u["items"]) == 2 for u in response.json())
+
+
+def test_read_users_summary_skips_items():
+    create_users_with_items(3)
+    with assert_query_count(engine, 1):
+        response = client.get("/users/summary/")
+    assert response.json()[0] == {
+        "email": "user0@example.com",
+        "id": 1,
+        "is_active": True,
+    }
+
+
+@pytest.mark.parametrize("load", list(crud.UserLoad))
+def test_get_users_load_strategies(load):
+    create_users_with_items(3)
+    db = TestingSessionLocal()
+    try:
+        with count_queries(engine) as counter:
+            users = crud.get_users(db, load=load)
+            [len(u.items) for u in users]
+    finally:
+        db.close()
+    expected = {"lazy": 4, "selectin": 2, "joined": 1, "noload": 1}
+    assert counter.count == expected[load.value]
+
+
+def test_read_pool_status():
+    response = client.get("/stats/pool")
+    assert response.status_code == 200
+    assert {"checked_out", "overflow", "wait_time_total"} <= response.json().keys()
+
+
+def test_create_items_bulk():
+    create_users(1)
+    client.post("/users/1/items/", json={"title": "first"})
+    items = [{"title": f"bulk{i}", "description": "d"} for i in range(600)]
+    # SELECT user + (INSERT + SELECT) x 3 chunks + UPDATE version, commitは1回
+    with assert_query_count(engine, 1 + 3 * 2 + 1):
+        response = client.post("/users/1/items/bulk", json=items)
+    assert response.status_code == 200
+    created = response.json()
+    assert len(created) == 600
+    assert created[0] == {"title": "bulk0", "description": "d", "id": 2, "owner_id": 1}
+    assert created[-1]["id"] == 601
+    response = client.get("/users/1")
+    assert len(response.json()["items"]) == 601
+
+
+def test_create_items_bulk_without_rowid_range(monkeypatch):
+    create_users(1)
+    client.post("/users/1/items/", json={"title": "first"})
+    # lastrowidの範囲を当てにできないdialectでは1行ずつinsertしてidで引き直す
+    monkeypatch.setattr(engine.dialect, "name", "mysql")
+    items = [{"title": f"bulk{i}"} for i in range(3)]
+    with assert_query_count(engine, 1 + 3 + 1 + 1):
+        response = client.post("/users/1/items/bulk", json=items)
+    assert [(item["id"], item["title"]) for item in response.json()] == [
+        (2, "bulk0"),
+        (3, "bulk1"),
+        (4, "bulk2"),
+    ]
+
+
+def test_create_items_bulk_row_errors():
+    create_users(1)
+    response = client.post(
+        "/users/1/items/bulk", json=[{"title": "ok"}, {"description": "no title"}]
+    )
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", 1, "title"]
+    assert client.get("/items/").json() == []
+
+
+def test_create_items_bulk_too_many(monkeypatch):
+    create_users(1)
+    monkeypatch.setattr("m.MAX_BULK_ITEMS", 2)
+    response = client.post("/users/1/items/bulk", json=[{"title": "x"}] * 3)
+    assert response.status_code == 413
+
+
+def test_create_items_bulk_unknown_user():
+    response = client.post("/users/1/items/bulk", json=[{"title": "x"}])
+    assert response.status_code == 404
+
+
+def test_read_user_is_cached_and_invalidated():
+    create_users(1)
+    with assert_query_count(engine, 0):
+        response = client.get("/users/1")
+    assert response.json()["items"] == []
+
+    client.post("/users/1/items/", json={"title": "Foo"})
+    response = client.get("/users/1")
+    assert [i["title"] for i in response.json()["items"]] == ["Foo"]
+    assert client.get("/stats/cache").json()["user"] == {
+        "size": 1,
+        "maxsize": 1024,
+        "hits": 1,
+        "misses": 1,
+        "evictions": 0,
+        "loads": 1,
+        "coalesced": 0,
+    }
+
+
+def test_concurrent_read_user_runs_one_query(monkeypatch):
+    create_users(1)
+    crud.user_cache.clear()
+    get_user = crud.get_user
+
+    def slow_get_user(db, user_id, **kwargs):
+        # 全リクエストが読み込み中に重なるように遅らせる
+        time.sleep(0.1)
+        return get_user(db, user_id, **kwargs)
+
+    monkeypatch.setattr(crud, "get_user", slow_get_user)
+
+    async def run(n):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as ac:
+            return await asyncio.gather(*(ac.get("/users/1") for _ in range(n)))
+
+    with count_queries(engine) as counter:
+        responses = asyncio.run(run(20))
+    assert {r.status_code for r in responses} == {200}
+    assert {r.json()["email"] for r in responses} == {"user0@example.com"}
+    users = [s for s in counter.statements if "FROM users" in s]
+    assert len(users) == 1
+    stats = client.get("/stats/cache").json()["user"]
+    assert (stats["loads"], stats["coalesced"]) == (1, 19)
+
+
+def test_read_user_negative_cache_invalidated_on_create():
+    assert client.get("/users/1").status_code == 404
+    with assert_query_count(engine, 0):
+        assert client.get("/users/1").status_code == 404
+    create_users(1)
+    assert client.get("/users/1").status_code == 200
+
+
+def test_create_user_duplicate_email_uses_cache():
+    create_users(1)
+    with assert_query_count(engine, 0):
+        response = client.post(
+            "/users/", json={"email": "user0@example.com", "password": "secret"}
+        )
+    assert response.status_code == 400
+
+
+def test_create_user_duplicate_hidden_by_negative_cache():
+    # 他のworkerが登録する前のnegative cacheが残っていても500にしない
+    assert crud.get_user_by_email_cached(TestingSessionLocal(), "late@example.com") is None
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO users (email, hashed_password, is_active) "
+                "VALUES ('late@example.com', 'x', 1)"
+            )
+        )
+    response = client.post("/users/", json={"email": "late@example.com", "password": "secret"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Email already registered"}
+    assert crud.get_user_by_email_cached(TestingSessionLocal(), "late@example.com") is not None
+
+
+def test_export_users_ndjson():
+    create_users(3)
+    response = client.get("/export/users")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"id": i + 1, "email": f"user{i}@example.com", "is_active": True}
+        for i in range(3)
+    ]
+
+
+def test_export_items_csv():
+    create_users_with_items(2, items_per_user=1)
+    response = client.get("/export/items", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text.splitlines() == [
+        "id,title,description,owner_id",
+        "1,item0,,1",
+        "2,item0,,2",
+    ]
+
+
+def test_export_empty_csv_has_header():
+    response = client.get("/export/users", params={"format": "csv"})
+    assert response.text.splitlines() == ["id,email,is_active"]
+
+
+def test_export_users_memory_is_flat():
+    rows = int(os.getenv("EXPORT_TEST_ROWS", "100000"))
+    with engine.begin() as conn:
+        for start in range(0, rows, 10000):
+            conn.execute(
+                models.User.__table__.insert(),
+                [
+                    {"email": f"user{i}@example.com", "hashed_password": "x"}
+                    for i in range(start, min(start + 10000, rows))
+                ],
+            )
+    with traced_peak() as memory:
+        received = asyncio.run(
+            call_asgi(app, "GET", "/export/users", b"format=ndjson", keep_body=False)
+        )
+    assert received["status"] == 200
+    assert received["size"] > rows * 20
+    # 100k行のNDJSONは約6.5MB、ORMオブジェクトで持てばその数倍になる
+    assert memory["peak_mb"] < 4
+
+
+def upload(content, filename="users.csv", **params):
+    return client.post(
+        "/users/import", params=params, files={"file": (filename, content)}
+    )
+
+
+def test_import_users_csv():
+    create_users(1)
+    content = (
+        "email,is_active,password\n"
+        "new1@example.com,true,pw1\n"
+        "user0@example.com,false,\n"
+        "bad-email,true,\n"
+        "new2@example.com,,\n"
+        "new1@example.com,false,other\n"
+        "new3@example.com,maybe,\n"
+    )
+    response = upload(content)
+    assert response.status_code == 200
+    assert response.json() == {
+        "rows": 6,
+        "inserted": 2,
+        "updated": 0,
+        "skipped": 2,
+        "failed": 2,
+        "batches": 1,
+        "errors": [
+            {"line": 4, "error": "invalid email"},
+            {"line": 7, "error": "invalid is_active"},
+        ],
+    }
+    # ファイル内の重複は最初の行、既存のユーザーはそのまま
+    users = {u["email"]: u for u in client.get("/users/").json()}
+    assert users["new1@example.com"]["is_active"] is True
+    assert users["user0@example.com"]["is_active"] is True
+    assert password_hasher.verify("pw1", stored_password("new1@example.com"))
+    assert stored_password("new2@example.com") is None
+    response = client.post("/login/", json={"email": "new2@example.com", "password": ""})
+    assert response.status_code == 401
+
+
+def test_import_users_ndjson_update():
+    create_users(2)
+    version = client.get("/users/1").json()["version"]
+    content = (
+        '{"email": "user0@example.com", "is_active": false}\n'
+        "\n"
+        '{"email": "user1@example.com", "password": "changed"}\n'
+        "not json\n"
+        '{"email": "user1@example.com", "password": "last"}\n'
+        '{"email": "new@example.com", "is_active": "0"}\n'
+    )
+    response = upload(content, filename="users.ndjson", on_conflict="update")
+    report = response.json()
+    assert (report["inserted"], report["updated"], report["skipped"], report["failed"]) == (
+        1,
+        2,
+        1,
+        1,
+    )
+    assert report["errors"] == [{"line": 4, "error": "invalid JSON"}]
+    # 上書きした行はキャッシュが捨てられ、versionが上がる
+    user = client.get("/users/1").json()
+    assert user["is_active"] is False and user["version"] == version + 1
+    assert password_hasher.verify("secret", stored_password("user0@example.com"))
+    response = client.post("/login/", json={"email": "user1@example.com", "password": "last"})
+    assert response.status_code == 200
+    assert client.get("/users/3").json()["is_active"] is False
+
+
+def test_import_users_update_keeps_is_active():
+    create_users(1)
+    content = '{"email": "user0@example.com", "is_active": false}\n'
+    upload(content, filename="users.ndjson", on_conflict="update")
+    # is_active列の無いファイルで上書きしても、無効にしたユーザーは有効に戻らない
+    content = "email,password\nuser0@example.com,changed\nnew@example.com,pw\n"
+    response = upload(content, filename="users.csv", on_conflict="update")
+    assert (response.json()["inserted"], response.json()["updated"]) == (1, 1)
+    assert client.get("/users/1").json()["is_active"] is False
+    assert client.get("/users/2").json()["is_active"] is True
+    assert password_hasher.verify("changed", stored_password("user0@example.com"))
+
+
+def test_import_users_unsupported_database(monkeypatch):
+    monkeypatch.setattr(crud, "_upsert_inserts", {})
+    response = upload("email\nuser0@example.com\n", filename="users.csv")
+    assert response.status_code == 501
+
+
+def test_import_users_commits_in_batches(monkeypatch):
+    monkeypatch.setattr(m, "IMPORT_BATCH_SIZE", 3)
+    assert client.get("/users/2").status_code == 404
+    content = "email\n" + "".join(f"user{i}@example.com\n" for i in range(7))
+    with count_queries(engine) as counter:
+        report = upload(content).json()
+    assert (report["inserted"], report["batches"]) == (7, 3)
+    assert sum(s.startswith("INSERT INTO users") for s in counter.statements) == 3
+    # 404のnegative cacheも捨てられている
+    assert client.get("/users/2").status_code == 200
+
+
+def test_import_users_chunks_email_lookups(monkeypatch):
+    monkeypatch.setattr(crud, "BULK_INSERT_CHUNK", 2)
+    create_users(1)
+    content = "email\n" + "".join(f"user{i}@example.com\n" for i in range(5))
+    with count_queries(engine) as counter:
+        report = upload(content).json()
+    assert (report["inserted"], report["skipped"], report["batches"]) == (4, 1, 1)
+    lookups = [s for s in counter.statements if s.startswith("SELECT") and " IN (" in s]
+    # 件数の確認とキャッシュの無効化を、それぞれ2件ずつ3回に分ける
+    assert len(lookups) == 6
+    assert max(s.count("?") for s in lookups) == 2
+    assert client.get("/users/5").status_code == 200
+
+
+def test_import_users_rejects_bad_files():
+    assert upload("email\n", filename="users.txt").status_code == 400
+    assert upload("email\nx@example.com\n", filename="users.txt", format="csv").json()[
+        "inserted"
+    ] == 1
+    response = upload("name,password\nx,y\n")
+    assert response.status_code == 400
+    assert "email" in response.json()["detail"]
+    report = upload(b"email\nok@example.com\n\xff\xfe\n").json()
+    assert report["failed"] == 1 and report["errors"][0]["error"].startswith("unreadable")
+
+
+def test_import_users_memory_is_flat(tmp_path):
+    rows = int(os.getenv("IMPORT_TEST_ROWS", "20000"))
+    path = tmp_path / "users.ndjson"
+    with open(path, "w") as f:
+        for i in range(rows):
+            f.write(json.dumps({"email": f"user{i}@example.com"}) + "\n")
+    db = TestingSessionLocal()
+    try:
+        with traced_peak() as memory, open(path, "rb") as f:
+            report = import_users(db, f, ImportFormat.ndjson)
+    finally:
+        db.close()
+    assert report["inserted"] == rows
+    # 全行をdictで持てば100k行で数十MBになる
+    assert memory["peak_mb"] < 4
+
+
+def test_read_user_etag_from_version():
+    create_users(1)
+    response = client.get("/users/1")
+    etag = response.headers["ETag"]
+    assert response.json()["version"] == 1
+
+    # versionだけを読む
+    with assert_query_count(engine, 1):
+        response = client.get("/users/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    client.post("/users/1/items/", json={"title": "Foo"})
+    response = client.get("/users/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+    assert response.headers["ETag"] != etag
+
+
+def test_init_db_adds_version_column():
+    with engine.begin() as conn:
+        Base.metadata.drop_all(bind=conn)
+        conn.execute(
+            text(
+                "CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR, "
+                "hashed_password VARCHAR, is_active BOOLEAN)"
+            )
+        )
+        conn.execute(text("INSERT INTO users (email) VALUES ('old@example.com')"))
+        models.init_db(conn)
+    assert crud.get_user_version(TestingSessionLocal(), user_id=1) == 1
+
+
+@pytest.mark.parametrize("init_db", [True, False])
+def test_init_db_on_startup(monkeypatch, init_db):
+    Base.metadata.drop_all(bind=engine)
+    monkeypatch.setattr(m, "INIT_DB", init_db)
+    monkeypatch.setattr(m, "get_engine", lambda: engine)
+    with TestClient(app):
+        pass
+    assert ("users" in inspect(engine).get_table_names()) is init_db
+
+
+def test_search_items():
+    create_users(1)
+    items = [
+        {"title": "Red bicycle", "description": "A fast road bicycle with red paint"},
+        {"title": "Blue kettle", "description": "Boils water quickly"},
+        {"title": "Bicycle pump", "description": "Fits every tyre"},
+        {"title": "100% cotton", "description": "Not a bicycle"},
+    ]
+    client.post("/users/1/items/bulk", json=items)
+
+    response = client.get("/items/search", params={"q": "bicycle"})
+    assert response.status_code == 200
+    results = response.json()
+    assert {r["title"] for r in results} == {"Red bicycle", "Bicycle pump", "100% cotton"}
+    # titleとdescriptionの両方に出てくるものが最上位
+    assert results[0]["title"] == "Red bicycle"
+    assert "<b>bicycle</b>" in results[0]["snippet"]
+    assert [r["score"] for r in results] == sorted(r["score"] for r in results)
+
+    # FTS5の構文として解釈されない
+    assert client.get("/items/search", params={"q": 'cotton" OR "water'}).json() == []
+    assert client.get("/items/search", params={"q": "NOT"}).status_code == 200
+    assert client.get("/items/search", params={"q": ""}).status_code == 422
+
+
+def test_search_items_synced_on_update_and_delete():
+    create_users(1)
+    client.post("/users/1/items/", json={"title": "old title"})
+    db = TestingSessionLocal()
+    try:
+        item = db.get(models.Item, 1)
+        item.title = "new title"
+        db.commit()
+        assert client.get("/items/search", params={"q": "old"}).json() == []
+        assert len(client.get("/items/search", params={"q": "new"}).json()) == 1
+        db.delete(item)
+        db.commit()
+    finally:
+        db.close()
+    assert client.get("/items/search", params={"q": "new"}).json() == []
+
+
+def test_search_items_keyset_pagination():
+    create_users(1)
+    client.post(
+        "/users/1/items/bulk",
+        json=[{"title": f"lamp {i}", "description": "lamp " * (i % 3)} for i in range(25)],
+    )
+    seen = []
+    params = {"q": "lamp", "limit": 10}
+    while True:
+        response = client.get("/items/search", params=params)
+        seen.extend(r["id"] for r in response.json())
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert sorted(seen) == list(range(1, 26))
+    assert len(seen) == 25
+
+    response = client.get("/items/search", params={"q": "lamp", "cursor": "bad"})
+    assert response.status_code == 400
+
+
+def test_init_db_indexes_existing_items():
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE items_fts"))
+        conn.execute(text("DROP TRIGGER items_fts_insert"))
+        conn.execute(
+            text("INSERT INTO users (email, hashed_password) VALUES ('a@example.com', 'x')")
+        )
+        conn.execute(text("INSERT INTO items (title, owner_id) VALUES ('legacy lamp', 1)"))
+        models.init_db(conn)
+    assert len(client.get("/items/search", params={"q": "lamp"}).json()) == 1
+    client.post("/users/1/items/", json={"title": "another lamp"})
+    assert len(client.get("/items/search", params={"q": "lamp"}).json()) == 2
@@ -0,0 +1,75 @@
+import os
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from m_async import app, get_db
+from sql_app.database import Base
+
+db_path = os.path.join(tempfile.mkdtemp(), "test.db")
+# スキーマ作成は同期エンジンで行う
+sync_engine = create_engine(f"sqlite:///{db_path}")
+engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", poolclass=NullPool)
+TestingSessionLocal = sessionmaker(
+    engine, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False
+)
+
+
+async def override_get_db():
+    async with TestingSessionLocal() as db:
+        yield db
+
+
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def reset_db():
+    Base.metadata.drop_all(bind=sync_engine)
+    Base.metadata.create_all(bind=sync_engine)
+    yield
+
+
+def test_create_and_read_user():
+    response = client.post(
+        "/users/", json={"email": "deadpool@example.com", "password": "chimichangas4life"}
+    )
+    assert response.status_code == 200
+    user = response.json()
+    assert user["items"] == []
+
+    response = client.post(
+        "/users/", json={"email": "deadpool@example.com", "password": "chimichangas4life"}
+    )
+    assert response.status_code == 400
+
+    response = client.post(f"/users/{user['id']}/items/", json={"title": "Foo"})
+    assert response.status_code == 200
+
+    response = client.get(f"/users/{user['id']}")
+    assert response.status_code == 200
+    assert [i["title"] for i in response.json()["items"]] == ["Foo"]
+
+
+def test_read_users_cursor_pagination():
+    for i in range(3):
+        client.post("/users/", json={"email": f"user{i}@example.com", "password": "x"})
+    response = client.get("/users/", params={"limit": 2})
+    assert len(response.json()) == 2
+    response = client.get(
+        "/users/", params={"limit": 2, "cursor": response.headers["X-Next-Cursor"]}
+    )
+    assert [u["email"] for u in response.json()] == ["user2@example.com"]
+
+
+def test_read_user_not_found():
+    response = client.get("/users/42")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "User not found"}
@@ -1,5 +1,11 @@
+import asyncio
+import hashlib
+import os
+
 from fastapi.testclient import TestClient
 
+import main
+from common.testing import call_asgi, traced_peak
 from main import app
 
 client = TestClient(app)
@@ -7,4 +13,168 @@ client = TestClient(app)
 def test_read_root():
     response = client.get("/")
     assert response.status_code == 200
-    assert response.json() == {"msg": "Hello World"}
\ No newline at end of file
+    assert response.json() == {"msg": "Hello World"}
+
+
+def test_create_file_stream(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    body = b"x" * 200000
+    response = client.post("/files/stream", content=body)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["file_size"] == len(body)
+    assert data["sha256"] == hashlib.sha256(body).hexdigest()
+    assert (tmp_path / data["file_id"]).read_bytes() == body
+
+
+def test_create_file_stream_too_large(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "UPLOAD_MAX_SIZE", 10)
+    response = client.post("/files/stream", content=b"x" * 11)
+    assert response.status_code == 413
+
+    # Content-Lengthが無い場合は読みながら打ち切る
+    response = client.post("/files/stream", content=iter([b"x" * 6, b"x" * 6]))
+    assert response.status_code == 413
+    assert os.listdir(tmp_path) == []
+
+
+def test_create_file_stream_memory_is_flat(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    chunk = os.urandom(64 * 1024)
+    count = 512  # 32MB
+    with traced_peak() as memory:
+        received = asyncio.run(
+            call_asgi(
+                app,
+                "POST",
+                "/files/stream",
+                headers=[(b"content-type", b"application/octet-stream")],
+                chunks=[chunk] * count,
+            )
+        )
+    assert received["status"] == 200
+    assert b'"file_size":%d' % (len(chunk) * count) in received["body"]
+    # ボディを溜め込んでいれば32MB以上になる
+    assert memory["peak_mb"] < 4
+
+
+def test_send_notification_log_drained_on_shutdown(tmp_path, monkeypatch):
+    log_path = tmp_path / "log.txt"
+    writer = main.BatchedLogWriter(str(log_path), flush_interval=60)
+    monkeypatch.setattr(main, "notification_log", writer)
+    with TestClient(app) as c:
+        response = c.post("/send-notification/foo@example.com", params={"q": "bar"})
+        assert response.status_code == 200
+    assert log_path.read_text().splitlines() == [
+        "notification for a: found query: bar",
+        "notification for foo@example.com: message to foo@example.com",
+    ]
+
+
+def test_read_item_etag():
+    response = client.get("/items2/foo")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = client.get("/items2/foo", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    response = client.get("/items2/bar", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_read_item_etag_skips_endpoint(monkeypatch):
+    class CountingItems(dict):
+        reads = 0
+
+        def __getitem__(self, key):
+            CountingItems.reads += 1
+            return super().__getitem__(key)
+
+    monkeypatch.setattr(main, "items", CountingItems(main.items))
+    for path in ("/items2/foo", "/items/foo/name", "/items/foo/public"):
+        etag = client.get(path).headers["ETag"]
+        reads = CountingItems.reads
+        response = client.get(path, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        # ETagはバージョンから決まるので、エンドポイントは呼ばれない
+        assert CountingItems.reads == reads
+
+    etag = client.get("/items3/item1").headers["ETag"]
+    assert client.get("/items3/item1", headers={"If-None-Match": etag}).status_code == 304
+    monkeypatch.setattr(main, "ITEMS_VERSION", main.ITEMS_VERSION + 1)
+    assert client.get("/items3/item1", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_etag_only_for_successful_get():
+    assert "ETag" not in client.get("/items2/nope").headers
+    assert "ETag" not in client.post("/items/", json={"name": "Foo", "price": 1}).headers
+
+
+def test_openapi_served_from_cache(monkeypatch):
+    identity = client.get(
+        "/api/v1/openapi.json", headers={"Accept-Encoding": "identity"}
+    )
+    assert identity.status_code == 200
+    assert identity.json() == app.openapi()
+    assert "content-encoding" not in identity.headers
+    etag = identity.headers["etag"]
+
+    # 2回目以降はスキーマを作り直さず、エンコードもしない
+    monkeypatch.setattr(app, "openapi", lambda: 1 / 0)
+    gzipped = client.get("/api/v1/openapi.json", headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert gzipped.json() == identity.json()
+    assert gzipped.headers["etag"] != etag
+
+    not_modified = client.get(
+        "/api/v1/openapi.json",
+        headers={"Accept-Encoding": "identity", "If-None-Match": etag},
+    )
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+
+
+def test_openapi_regenerated_when_routes_change():
+    client.get("/api/v1/openapi.json")
+
+    @app.get("/openapi-regenerate-probe")
+    async def probe():
+        return {}
+
+    try:
+        paths = client.get("/api/v1/openapi.json").json()["paths"]
+        assert "/openapi-regenerate-probe" in paths
+    finally:
+        app.router.routes.pop()
+        main.openapi_cache.regenerate()
+    assert "/openapi-regenerate-probe" not in client.get("/api/v1/openapi.json").json()["paths"]
+
+
+def test_sync_routes_go_through_admission():
+    lanes = main.admission.lanes
+    writes, reads = lanes["write"].stats["admitted"], lanes["read"].stats["admitted"]
+    response = client.put("/items/1", json={"name": "Foo", "price": 1.0})
+    assert response.status_code == 200
+    # async defのルートは数えない
+    client.get("/items/foo")
+    assert lanes["write"].stats["admitted"] == writes + 1
+    assert lanes["read"].stats["admitted"] == reads
+    assert "admission_write_active 0" in client.get("/metrics").text
+
+
+def test_create_user_hashes_password(monkeypatch):
+    saved = []
+    monkeypatch.setattr(main, "UserInDB", lambda **kwargs: saved.append(kwargs) or kwargs)
+    response = client.post(
+        "/user/",
+        json={"username": "Test", "email": "test@example.com", "password": "secret"},
+    )
+    assert response.status_code == 200
+    assert "password" not in response.json()
+    assert main.password_hasher.verify("secret", saved[0]["hashed_password"])
@@ -1,5 +1,9 @@
+import asyncio
+
 from fastapi.testclient import TestClient
 
+from common.batch import SubRequest, dispatch
+from common.store import StripedStore
 from main_b import app
 
 client = TestClient(app)
@@ -63,3 +67,173 @@ def test_create_existing_item():
     )
     assert response.status_code == 400
     assert response.json() == {"detail": "Item already exists"}
+
+
+def test_batch_shares_token_check(monkeypatch):
+    import main_b
+
+    calls = []
+
+    def check_token(token):
+        calls.append(token)
+        return token == "coneofsilence"
+
+    monkeypatch.setattr(main_b, "check_token", check_token)
+    response = client.post(
+        "/batch",
+        headers={"X-Token": "coneofsilence"},
+        json={
+            "requests": [
+                {"path": "/items/foo"},
+                {"path": "/items/bar"},
+                {"path": "/items/baz"},
+                {"path": "/items/foo", "headers": {"X-Token": "hailhydra"}},
+                {"path": "/batch", "method": "POST"},
+            ]
+        },
+    )
+    assert response.status_code == 200
+    results = response.json()
+    assert [r["status"] for r in results] == [200, 200, 404, 400, 400]
+    assert results[0]["body"] == {
+        "id": "foo",
+        "title": "Foo",
+        "description": "There goes my hero",
+    }
+    assert results[2]["body"] == {"detail": "Item not found"}
+    assert results[3]["body"] == {"detail": "Invalid X-Token header"}
+    # トークン毎に1回だけ
+    assert calls == ["coneofsilence", "hailhydra"]
+
+
+def test_batch_post_and_missing_token(monkeypatch):
+    import main_b
+
+    store = StripedStore()
+    store.update(main_b.item_store.to_dict())
+    monkeypatch.setattr(main_b, "item_store", store)
+    response = client.post(
+        "/batch",
+        json={
+            "requests": [
+                {
+                    "method": "POST",
+                    "path": "/items/",
+                    "headers": {"X-Token": "coneofsilence"},
+                    "body": {"id": "batched", "title": "Batched"},
+                },
+                {"path": "/items/foo"},
+            ]
+        },
+    )
+    results = response.json()
+    assert results[0]["status"] == 200
+    assert results[0]["body"]["id"] == "batched"
+    assert results[1]["status"] == 422
+    assert "batched" in store
+
+
+def test_batch_rejects_nested_batch_paths():
+    nested = {"requests": [{"path": "/items/foo"}]}
+    response = client.post(
+        "/batch",
+        headers={"X-Token": "coneofsilence"},
+        json={"requests": [{"path": "/batch#x", "method": "POST", "body": nested}]},
+    )
+    assert response.json()[0] == {
+        "status": 400,
+        "headers": {},
+        "body": {"detail": "Nested batch requests are not allowed"},
+    }
+    response = client.post(
+        "/batch",
+        json={"requests": [{"path": "http://x/batch", "method": "POST", "body": nested}]},
+    )
+    assert response.status_code == 422
+
+
+def test_batch_rejects_requests_dispatched_from_a_batch():
+    # ガードをすり抜けても、サブリクエストのscopeに付いた印で弾く
+    sub = SubRequest(method="POST", path="/batch", body={"requests": [{"path": "/"}]})
+    result = asyncio.run(dispatch(app, {"type": "http"}, sub))
+    assert result.status == 400
+    assert result.body == {"detail": "Nested batch requests are not allowed"}
+
+
+def test_batch_rejects_non_latin1_headers():
+    response = client.post(
+        "/batch", json={"requests": [{"path": "/items/foo", "headers": {"X-Note": "\u20ac"}}]}
+    )
+    assert response.status_code == 422
+
+
+def test_batch_too_large(monkeypatch):
+    import main_b
+
+    monkeypatch.setattr(main_b, "BATCH_MAX_REQUESTS", 2)
+    response = client.post(
+        "/batch", json={"requests": [{"path": "/items/foo"}] * 3}
+    )
+    assert response.status_code == 413
+
+
+def test_read_items_multi_get():
+    response = client.get(
+        "/items", params={"ids": "bar,missing,foo"}, headers={"X-Token": "coneofsilence"}
+    )
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json()] == ["bar", "foo"]
+    assert client.get("/items", params={"ids": "foo"}).status_code == 422
+
+
+def test_create_item_stored_as_plain_dict():
+    client.post(
+        "/items/",
+        headers={"X-Token": "coneofsilence"},
+        json={"id": "plain", "title": "Plain"},
+    )
+    from main_b import item_store
+
+    assert item_store.get("plain") == {"id": "plain", "title": "Plain", "description": None}
+
+
+def test_concurrent_create_and_read(monkeypatch):
+    import asyncio
+
+    import httpx
+    import main_b
+
+    monkeypatch.setattr(main_b, "item_store", StripedStore(stripes=4))
+    headers = {"X-Token": "coneofsilence"}
+
+    async def run():
+        async with httpx.AsyncClient(app=app, base_url="http://test") as ac:
+            creates = [
+                ac.post("/items/", headers=headers, json={"id": f"id{i % 20}", "title": f"t{i}"})
+                for i in range(100)
+            ]
+            reads = [ac.get(f"/items/id{i % 20}", headers=headers) for i in range(100)]
+            return await asyncio.gather(*creates, *reads)
+
+    responses = asyncio.run(run())
+    creates, reads = responses[:100], responses[100:]
+    assert sum(r.status_code == 200 for r in creates) == 20
+    assert {r.status_code for r in creates} == {200, 400}
+    assert {r.status_code for r in reads} <= {200, 404}
+    assert len(main_b.item_store) == 20
+
+
+def test_item_snapshot_reloaded_on_startup(tmp_path, monkeypatch):
+    import main_b
+
+    path = str(tmp_path / "items.json")
+    store = StripedStore(snapshot_path=path)
+    monkeypatch.setattr(main_b, "item_store", store)
+    with TestClient(app) as c:
+        c.post("/items/", headers={"X-Token": "coneofsilence"}, json={"id": "kept", "title": "K"})
+
+    reloaded = StripedStore(snapshot_path=path)
+    monkeypatch.setattr(main_b, "item_store", reloaded)
+    with TestClient(app) as c:
+        response = c.get("/items/kept", headers={"X-Token": "coneofsilence"})
+    assert response.json()["title"] == "K"
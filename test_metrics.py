@@ -0,0 +1,57 @@
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from common.metrics import Histogram, setup_metrics
+
+app = FastAPI()
+metrics = setup_metrics(app)
+
+
+@app.get("/items/{item_id}")
+def read_item(item_id: int):
+    return {"item_id": item_id}
+
+
+@app.get("/slow")
+async def slow():
+    time.sleep(0.03)
+    return {}
+
+
+def test_histogram_buckets():
+    histogram = Histogram((1, 10))
+    for value in (0.5, 1, 5, 50):
+        histogram.observe(value)
+    assert histogram.render("x", 'a="b"') == [
+        'x_bucket{a="b",le="1"} 2',
+        'x_bucket{a="b",le="10"} 3',
+        'x_bucket{a="b",le="+Inf"} 4',
+        'x_sum{a="b"} 56.5',
+        'x_count{a="b"} 4',
+    ]
+
+
+def test_metrics_endpoint():
+    with TestClient(app) as client:
+        client.get("/items/1")
+        client.get("/items/2")
+        client.get("/items/foo")
+        client.get("/slow")
+        client.get("/nope")
+        body = client.get("/metrics").text
+
+    labels = 'method="GET",route="/items/{item_id}"'
+    assert f'http_requests_total{{{labels},status="2xx"}} 2' in body
+    assert f'http_requests_total{{{labels},status="4xx"}} 1' in body
+    assert f"http_request_duration_seconds_count{{{labels}}} 3" in body
+    slow = 'method="GET",route="/slow"'
+    assert f'http_request_duration_seconds_bucket{{{slow},le="0.025"}} 0' in body
+    assert 'route="<unmatched>",status="4xx"} 1' in body
+    assert "http_requests_in_flight 1" in body
+    # 同期ルートはthreadpoolを通る
+    assert "threadpool_wait_seconds_count{} 2" in body
+    assert "threadpool_tokens_total 40" in body
+    # ラベルオブジェクトはルート毎に1つだけ
+    assert len(metrics.routes) == 4
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from common.passwords import PBKDF2, SCRYPT, PasswordHasher, parse
+
+CHEAP = {"scrypt_n": 2 ** 8, "pbkdf2_iterations": 1000}
+
+
+@pytest.mark.parametrize("algorithm", [SCRYPT, PBKDF2])
+def test_hash_and_verify(algorithm):
+    hasher = PasswordHasher(algorithm, **CHEAP)
+    encoded = hasher.hash("secret")
+    assert encoded.startswith(algorithm + "$")
+    assert hasher.verify("secret", encoded)
+    assert not hasher.verify("wrong", encoded)
+    # saltは毎回違う
+    assert hasher.hash("secret") != encoded
+    assert not hasher.needs_rehash(encoded)
+
+
+def test_parse_rejects_unknown_formats():
+    assert parse("secretnotreallyhashed") is None
+    assert parse("md5$x$y$z") is None
+    assert parse("scrypt$n=1,r=8$x$y") is None
+    assert parse("scrypt$n=16,r=8,p=1$c2FsdA$ZGlnZXN0")[1] == (16, 8, 1)
+
+
+def test_legacy_hash_is_verified_and_rehashed():
+    hasher = PasswordHasher(**CHEAP, workers=0)
+    assert hasher.verify("secret", "secretnotreallyhashed")
+    assert not hasher.verify("other", "secretnotreallyhashed")
+    ok, new_hash = asyncio.run(hasher.verify_and_update("secret", "secretnotreallyhashed"))
+    assert ok and new_hash.startswith("scrypt$n=256,")
+    assert hasher.verify("secret", new_hash)
+
+
+def test_rehash_when_parameters_change():
+    old = PasswordHasher(PBKDF2, **CHEAP).hash("secret")
+    hasher = PasswordHasher(SCRYPT, **CHEAP, workers=0)
+    assert hasher.needs_rehash(old)
+    assert asyncio.run(hasher.verify_and_update("wrong", old)) == (False, None)
+    ok, new_hash = asyncio.run(hasher.verify_and_update("secret", old))
+    assert ok and parse(new_hash)[:2] == (SCRYPT, (256, 8, 1))
+
+    stronger = PasswordHasher(SCRYPT, scrypt_n=2 ** 9, workers=0)
+    assert stronger.needs_rehash(new_hash)
+    assert asyncio.run(stronger.verify_and_update("secret", new_hash))[1] is not None
+    assert asyncio.run(hasher.verify_and_update("secret", new_hash)) == (True, None)
+
+
+def test_hash_async_runs_in_process_pool():
+    hasher = PasswordHasher(**CHEAP, workers=2)
+
+    async def run():
+        encoded = await asyncio.gather(*(hasher.hash_async(f"pw{i}") for i in range(4)))
+        checks = await asyncio.gather(
+            *(hasher.verify_async(f"pw{i}", e) for i, e in enumerate(encoded))
+        )
+        return encoded, checks
+
+    try:
+        encoded, checks = asyncio.run(run())
+        assert all(checks)
+        assert hasher._pool is not None
+        assert all(hasher.verify(f"pw{i}", e) for i, e in enumerate(encoded))
+    finally:
+        hasher.shutdown()
+    assert hasher._pool is None
+    # shutdownの後も使えば作り直す
+    assert asyncio.run(hasher.verify_async("pw0", encoded[0]))
+    hasher.shutdown()
+
+
+def test_unknown_algorithm():
+    with pytest.raises(ValueError):
+        PasswordHasher("md5")
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_hash_many(workers):
+    hasher = PasswordHasher(**CHEAP, workers=workers)
+    try:
+        encoded = hasher.hash_many(["a", "b", "c"])
+    finally:
+        hasher.shutdown()
+    assert [hasher.verify(p, e) for p, e in zip("abc", encoded)] == [True] * 3
+    assert hasher.hash_many([]) == []
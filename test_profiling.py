@@ -0,0 +1,111 @@
+import threading
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+import main_b
+from common.profiling import setup_profiling
+
+engine = create_engine(
+    "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+)
+
+
+def build_app(monkeypatch, **env):
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+    app = FastAPI()
+    store = setup_profiling(app, engine)
+
+    @app.get("/work")
+    def work():
+        with engine.connect() as conn:
+            for _ in range(3):
+                conn.execute(text("SELECT 1"))
+        # threadpoolで動く同期ルートの処理もサンプルに乗ること
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        return [{"n": n} for n in range(1000)]
+
+    @app.get("/other")
+    def other():
+        deadline = time.perf_counter() + 0.3
+        while time.perf_counter() < deadline:
+            pass
+        return {}
+
+    return app, store
+
+
+def test_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("PROFILE_TOKEN", raising=False)
+    monkeypatch.delenv("PROFILE_SAMPLE_RATE", raising=False)
+    app, store = build_app(monkeypatch)
+    assert store is None
+    assert not app.user_middleware
+    assert TestClient(app).get("/debug/profiles").status_code == 404
+
+
+def test_header_trigger(monkeypatch):
+    app, store = build_app(monkeypatch, PROFILE_TOKEN="secret")
+    client = TestClient(app)
+
+    assert "X-Profile-Id" not in client.get("/work").headers
+    assert client.get("/work", headers={"X-Profile": "wrong"}).status_code == 200
+    assert store.list() == []
+
+    response = client.get("/work", headers={"X-Profile": "secret"})
+    profile_id = response.headers["X-Profile-Id"]
+    assert client.get(f"/debug/profiles/{profile_id}").status_code == 403
+
+    report = client.get(
+        f"/debug/profiles/{profile_id}", headers={"X-Profile": "secret"}
+    ).json()
+    assert report["path"] == "/work"
+    assert report["sql_count"] == 3
+    assert report["sql_seconds"] > 0
+    assert report["duration_seconds"] >= 0.05
+    assert report["samples"] > 0
+
+    def names(nodes):
+        for node in nodes:
+            yield node["function"]
+            yield from names(node["children"])
+
+    assert any(name.startswith("work ") for name in names(report["call_tree"]))
+
+    listed = client.get("/debug/profiles", headers={"X-Profile": "secret"}).json()
+    assert [summary["id"] for summary in listed] == [int(profile_id)]
+
+
+def test_sample_rate(monkeypatch):
+    monkeypatch.delenv("PROFILE_TOKEN", raising=False)
+    app, store = build_app(monkeypatch, PROFILE_SAMPLE_RATE="1")
+    client = TestClient(app)
+    client.get("/work")
+    client.get("/work")
+    assert [summary["sql_count"] for summary in store.list()] == [3, 3]
+
+
+def test_apps_without_profiling_env():
+    assert main_b.profiles is None
+
+
+def test_samples_only_threads_of_the_request(monkeypatch):
+    app, store = build_app(monkeypatch, PROFILE_TOKEN="secret")
+    client = TestClient(app)
+    # プロファイルしていないリクエストが別のスレッドでCPUを使っている間にプロファイルする
+    other = threading.Thread(target=client.get, args=("/other",))
+    other.start()
+    time.sleep(0.05)
+    response = client.get("/work", headers={"X-Profile": "secret"})
+    other.join()
+
+    profile = store.get(int(response.headers["X-Profile-Id"]))
+    functions = {name.split(" ", 1)[0] for stack in profile.samples for name in stack}
+    assert "work" in functions
+    assert "other" not in functions
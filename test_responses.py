@@ -0,0 +1,74 @@
+from typing import List, Union
+
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from common.responses import FastJSONResponse, use_fast_json
+
+app = FastAPI()
+use_fast_json(app, enabled=True)
+
+
+class Item(BaseModel):
+    name: str
+    tax: Union[float, None] = None
+
+
+class SecretItem(Item):
+    secret: str
+
+
+@app.get("/item", response_model=Item, response_model_exclude_unset=True)
+async def read_item():
+    return Item(name="Foo")
+
+
+@app.get("/items", response_model=List[Item])
+def read_items(response: Response):
+    response.headers["X-Total"] = "2"
+    return [Item(name="Foo"), Item(name="Bar", tax=1.5)]
+
+
+@app.get("/secret", response_model=Item)
+async def read_secret():
+    # サブクラスは通常のバリデーションを通るのでsecretは落ちる
+    return SecretItem(name="Foo", secret="hidden")
+
+
+@app.get("/dict", response_model=Item, status_code=201)
+async def read_dict():
+    return {"name": "Foo", "tax": "2"}
+
+
+client = TestClient(app)
+
+
+def test_fast_path_instance():
+    response = client.get("/item")
+    assert response.status_code == 200
+    assert response.json() == {"name": "Foo"}
+
+
+def test_fast_path_list_keeps_sub_response_headers():
+    response = client.get("/items")
+    assert response.headers["X-Total"] == "2"
+    assert response.json() == [
+        {"name": "Foo", "tax": None},
+        {"name": "Bar", "tax": 1.5},
+    ]
+
+
+def test_subclass_goes_through_validation():
+    assert client.get("/secret").json() == {"name": "Foo", "tax": None}
+
+
+def test_dict_goes_through_validation():
+    response = client.get("/dict")
+    assert response.status_code == 201
+    assert response.json() == {"name": "Foo", "tax": 2.0}
+
+
+def test_fast_json_response_encodes_unsupported_types():
+    response = FastJSONResponse({"tags": {"a"}, 1: "x"})
+    assert response.body == b'{"tags":["a"],"1":"x"}'
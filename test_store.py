@@ -0,0 +1,116 @@
+import json
+import threading
+import time
+
+from common.store import StripedStore
+
+
+def test_insert_is_atomic_under_concurrent_writers():
+    store = StripedStore(stripes=4)
+    winners = []
+    barrier = threading.Barrier(8)
+
+    def writer(n):
+        barrier.wait()
+        for i in range(500):
+            if store.insert(f"key{i}", {"id": f"key{i}", "writer": n}):
+                winners.append((i, n))
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(store) == 500
+    # キー毎に勝者は1人で、残っている値はその勝者のもの
+    assert sorted(i for i, _ in winners) == list(range(500))
+    for i, n in winners:
+        assert store.get(f"key{i}")["writer"] == n
+
+
+def test_version_counts_writes_from_every_stripe(tmp_path):
+    store = StripedStore(stripes=8, snapshot_path=str(tmp_path / "items.json"))
+    threads = [
+        threading.Thread(target=lambda n=n: [store.put(f"{n}-{i}", {}) for i in range(5000)])
+        for n in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.version == 8 * 5000
+    assert store.save()
+    assert not store.save()
+    store.put("late", {})
+    # 最後の書き込みもスナップショットに残る
+    assert store.save()
+    assert "late" in json.loads((tmp_path / "items.json").read_text())
+
+
+def test_concurrent_reads_see_whole_values():
+    store = StripedStore()
+    store.put("a", {"id": "a", "n": 0, "m": 0})
+    stop = threading.Event()
+    torn = []
+
+    def writer():
+        n = 0
+        while not stop.is_set():
+            n += 1
+            store.put("a", {"id": "a", "n": n, "m": n})
+
+    def reader():
+        while not stop.is_set():
+            value = store.get("a")
+            if value["n"] != value["m"]:
+                torn.append(value)
+
+    threads = [threading.Thread(target=writer)] + [
+        threading.Thread(target=reader) for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert torn == []
+
+
+def test_get_returns_copies():
+    store = StripedStore()
+    store.put("a", {"id": "a"})
+    store.get("a")["id"] = "changed"
+    assert store.get("a") == {"id": "a"}
+    assert store.get_many(["b", "a", "c"]) == [{"id": "a"}]
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "items.json")
+    store = StripedStore(snapshot_path=path)
+    store.update({"a": {"id": "a"}, "b": {"id": "b", "title": "B"}})
+    assert store.save() is True
+    # 変更がなければ書き出さない
+    assert store.save() is False
+
+    reloaded = StripedStore(snapshot_path=path)
+    assert reloaded.load() is True
+    assert reloaded.to_dict() == store.to_dict()
+    assert json.loads((tmp_path / "items.json").read_text())["b"]["title"] == "B"
+    assert not (tmp_path / "items.json.tmp").exists()
+
+
+def test_periodic_snapshots(tmp_path):
+    path = tmp_path / "items.json"
+    store = StripedStore(snapshot_path=str(path))
+    store.start_snapshots(0.01)
+    store.put("a", {"id": "a"})
+    deadline = time.monotonic() + 2
+    while not path.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert json.loads(path.read_text()) == {"a": {"id": "a"}}
+
+    store.put("b", {"id": "b"})
+    store.stop_snapshots()
+    assert set(json.loads(path.read_text())) == {"a", "b"}